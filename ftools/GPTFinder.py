@@ -1,29 +1,64 @@
 import sys
 import struct
 import uuid
+import zlib
+from collections import namedtuple
 from vdrive import Drive
 
 
-class GPTFinder(object):
-    UNUSED_GUID = uuid.UUID('00000000-0000-0000-0000-000000000000')
+GPT_SIGNATURE = b"EFI PART"
+GPT_HEADER = struct.Struct("<8sIIIIQQQQ16sQIII")
+GPT_HEADER_CRC_OFFSET = 16
+GPT_ENTRY = struct.Struct("<16s16sQQQ72s")
+UNUSED_GUID = bytes(16)
+
+# Logical sector sizes a GPT is looked for with (512e/512n and 4Kn disks).
+SECTOR_SIZES = (512, 4096)
+# The entry array size the spec asks room for (128 entries of 128 bytes),
+# read together with the header so that one read usually gets both.
+DEFAULT_ENTRY_ARRAY_SIZE = 128 * 128
+MAX_ENTRY_ARRAY_SIZE = 4 * 1024 * 1024
+
+
+class GPTEntry(namedtuple("GPTEntry", "index partition_type_guid unique_partition_guid lba size flags name")):
+    # A used slot of the entry array; the GUIDs are kept as their 16 raw
+    # (mixed endian) bytes.
+    __slots__ = ()
+
+    def type_uuid(self):
+        return uuid.UUID(bytes_le=self.partition_type_guid)
+
+    def unique_uuid(self):
+        return uuid.UUID(bytes_le=self.unique_partition_guid)
+
 
-    def __init__(self, drive):
+class GPTFinder(object):
+    def __init__(self, drive, sector_size=None):
+        # sector_size: the disk's logical sector size. By default the
+        # drive's block size, then the other SECTOR_SIZES are tried.
         self.drive = drive
+        self.sector_sizes = [sector_size] if sector_size else self._sector_sizes()
+        self.sector_size = self.sector_sizes[0]
+        self.header = None
+        self.backup = False
+
+    def _sector_sizes(self):
+        block_size = self.drive.get_block_size()
+        return [block_size] + [size for size in SECTOR_SIZES
+                               if size != block_size and size % block_size == 0]
+
+    def _read(self, lba, count=1):
+        scale = self.sector_size // self.drive.get_block_size()
+        return self.drive.read(lba * scale, count * scale)
+
+    def last_lba(self):
+        return self.drive.get_size() // self.sector_size - 1
 
     def parse_header(self, data):
-        signature = data[0:8]
-        revision = struct.unpack_from("<I", data, 8)[0]
-        header_size = struct.unpack_from("<I", data, 12)[0]
-        crc32 = struct.unpack_from("<I", data, 16)[0]
-        gpt_lba = struct.unpack_from("<Q", data, 24)[0]
-        backup_gpt_lba = struct.unpack_from("<Q", data, 32)[0]
-        first_usable_lba = struct.unpack_from("<Q", data, 40)[0]
-        last_usable_lba = struct.unpack_from("<Q", data, 48)[0]
-        disk_guid = uuid.UUID(bytes=data[56:72])
-        partition_etnry_start_lba = struct.unpack_from("<Q", data, 72)[0]
-        number_of_partition_entries = struct.unpack_from("<I", data, 80)[0]
-        size_of_partition_entry = struct.unpack_from("<I", data, 84)[0]
-        crc32_of_partition_array = struct.unpack_from("<I", data, 88)[0]
+        (signature, revision, header_size, crc32, _, gpt_lba, backup_gpt_lba,
+         first_usable_lba, last_usable_lba, disk_guid, partition_entry_start_lba,
+         number_of_partition_entries, size_of_partition_entry,
+         crc32_of_partition_array) = GPT_HEADER.unpack_from(data)
 
         return {
             'signature': signature,
@@ -34,56 +69,113 @@ class GPTFinder(object):
             'backup_gpt_lba': backup_gpt_lba,
             'first_usable_lba': first_usable_lba,
             'last_usable_lba': last_usable_lba,
-            'disk_guid': disk_guid,
-            'partition_entry_start_lba': partition_etnry_start_lba,
+            'disk_guid': uuid.UUID(bytes_le=disk_guid),
+            'partition_entry_start_lba': partition_entry_start_lba,
             'number_of_partition_entries': number_of_partition_entries,
             'size_of_partition_entry': size_of_partition_entry,
             'crc32_of_partition_array': crc32_of_partition_array
         }
 
-    def parse_entry(self, entry):
-        partition_type_guid = uuid.UUID(bytes=entry[0:16])
-        unique_partition_guid = uuid.UUID(bytes=entry[16:32])
-        lba = struct.unpack_from("<Q", entry, 32)[0]
-        size = struct.unpack_from("<Q", entry, 40)[0] - lba + 1
-        flags = entry[48:56]
-        name = entry[56:128].decode('utf-16')
+    def check_header(self, data, lba):
+        # The header in data if it is a valid one for sector lba: signature,
+        # sizes, its own CRC and the LBA it says it is at. None otherwise.
+        if len(data) < GPT_HEADER.size or data[0:8] != GPT_SIGNATURE:
+            return None
+
+        header = self.parse_header(data)
+        header_size = header['header_size']
+        entry_size = header['size_of_partition_entry']
+        if header_size < GPT_HEADER.size or header_size > min(len(data), self.sector_size):
+            return None
+        if entry_size < GPT_ENTRY.size or entry_size % 8:
+            return None
+        if header['number_of_partition_entries'] * entry_size > MAX_ENTRY_ARRAY_SIZE:
+            return None
+        if header['gpt_lba'] != lba:
+            return None
 
-        if partition_type_guid == self.UNUSED_GUID:
+        raw = bytearray(data[:header_size])
+        raw[GPT_HEADER_CRC_OFFSET:GPT_HEADER_CRC_OFFSET + 4] = bytes(4)
+        if zlib.crc32(raw) != header['crc32']:
             return None
 
-        return {
-            'partition_type_guid': partition_type_guid,
-            'unique_partition_guid': unique_partition_guid,
-            'lba': lba,
-            'size': size,
-            'flags': flags,
-            'name': name
-        }
+        return header
 
-    def parse_entries(self, block, entry_size):
-        block_size = len(block)
+    def parse_entries(self, block, entry_size, count=None):
+        # GPTEntry for every used slot of the array; unused slots are
+        # skipped, not taken as the end (arrays may be sparse).
+        if count is None:
+            count = len(block) // entry_size
+        if entry_size == GPT_ENTRY.size:
+            layout = GPT_ENTRY
+        else:
+            layout = struct.Struct(GPT_ENTRY.format + "%dx" % (entry_size - GPT_ENTRY.size))
 
         partitions = []
-        for i in range(int(block_size/entry_size)):
-            entry = block[i*entry_size:(i+1)*entry_size]
-            partition = self.parse_entry(entry)
-            if partition:
-                partitions.append(partition)
-            else:
-                break
-        
+        view = memoryview(block)[:count * entry_size]
+        for index, (type_guid, unique_guid, first, last, flags, name) in enumerate(layout.iter_unpack(view)):
+            if type_guid == UNUSED_GUID:
+                continue
+            name = name.decode('utf-16-le', 'replace').split('\x00', 1)[0]
+            partitions.append(GPTEntry(index, type_guid, unique_guid, first, last - first + 1, flags, name))
+
         return partitions
 
-    def parse(self):
-        data = self.drive.read(1)
-        header = self.parse_header(data)
-        print(header)
+    def read_table(self, lba, backup=None):
+        # (header, entries) of the GPT header at lba, or None when the header
+        # or its entry array fails its CRC. The header and the sectors of a
+        # default sized array next to it (after it for the primary, before
+        # it for the backup, both sides when backup is None) come from one
+        # read; an array elsewhere costs a second one.
+        window = (DEFAULT_ENTRY_ARRAY_SIZE + self.sector_size - 1) // self.sector_size
+        before = min(lba, window) if backup in (True, None) else 0
+        after = window if backup in (False, None) else 0
+        after = max(0, min(after, self.last_lba() - lba))
+        data = self._read(lba - before, before + 1 + after)
+
+        offset = before * self.sector_size
+        header = self.check_header(data[offset:offset + self.sector_size], lba)
+        if header is None:
+            return None
 
-        needed_sector_count = int(header['size_of_partition_entry'] * header['number_of_partition_entries'] / 512)
+        size = header['number_of_partition_entries'] * header['size_of_partition_entry']
+        count = (size + self.sector_size - 1) // self.sector_size
+        start = header['partition_entry_start_lba']
+        if lba - before <= start and start + count <= lba + after + 1:
+            offset = (start - lba + before) * self.sector_size
+            array = memoryview(data)[offset:offset + size]
+        else:
+            array = memoryview(self._read(start, count))[:size]
 
-        data = self.drive.read(header['partition_entry_start_lba'], needed_sector_count)
-        return self.parse_entries(data, header['size_of_partition_entry'])
+        if len(array) < size or zlib.crc32(array) != header['crc32_of_partition_array']:
+            return None
+
+        return header, self.parse_entries(array, header['size_of_partition_entry'],
+                                          header['number_of_partition_entries'])
+
+    def parse(self):
+        # Entries of the primary GPT, or of the backup one when the primary
+        # is missing or corrupt (self.backup tells which).
+        for sector_size in self.sector_sizes:
+            self.sector_size = sector_size
+            table = self.read_table(1, backup=False)
+            if table is None:
+                backup_lba = self.last_lba()
+                data = self._read(1)
+                if data[0:8] == GPT_SIGNATURE:
+                    # A damaged primary may still point to the backup.
+                    backup_lba = self.parse_header(data)['backup_gpt_lba'] or backup_lba
+                if 1 < backup_lba <= self.last_lba():
+                    table = self.read_table(backup_lba, backup=True)
+                if table is None and backup_lba != self.last_lba():
+                    table = self.read_table(self.last_lba(), backup=True)
+                self.backup = table is not None
+
+            if table is not None:
+                self.header, entries = table
+                return entries
+
+        raise Exception("No valid GPT header")
 
 
 if __name__ == '__main__':
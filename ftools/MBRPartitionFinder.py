@@ -10,9 +10,10 @@ class MBRPartitionFinder(object):
     def is_ebr(self, ptype):
         return ptype in [0x05, 0x0F]
 
-    def _parse_partitions(self, ebr_offset, offset):
+    def _parse_partitions(self, ebr_offset, offset, sector=None):
         partitions = []
-        sector = self.drive.read(offset)
+        if sector is None:
+            sector = self.drive.read(offset)
         tables = self.get_table_entries(sector)
 
         for table in tables:
@@ -31,8 +32,9 @@ class MBRPartitionFinder(object):
 
         return partitions
 
-    def parse(self):
-        return self._parse_partitions(0, 0)
+    def parse(self, sector=None):
+        # sector: sector 0 when the caller has already read it.
+        return self._parse_partitions(0, 0, sector)
 
     def get_table_entries(self, sector):
         partitions = []
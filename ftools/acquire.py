@@ -0,0 +1,254 @@
+import datetime
+import hashlib
+import queue
+import sys
+import threading
+import time
+from vdrive import Drive
+
+
+DEFAULT_READ_SIZE = 4 * 1024 * 1024
+DEFAULT_ALGORITHMS = ("md5", "sha256")
+DEFAULT_RETRIES = 3
+# Chunks read ahead of the slowest hasher or the writer.
+DEFAULT_QUEUE_DEPTH = 16
+LOG_SUFFIX = ".log"
+POLL_INTERVAL = 0.1
+
+
+class SegmentWriter(object):
+    # Raw output to path, or, with segment_size, to path.001, path.002, ...
+    # of segment_size bytes each (the names SplitDrive opens again).
+    def __init__(self, path, segment_size=None):
+        self.path = path
+        self.segment_size = segment_size
+        self.paths = []
+        self.f = None
+        self.written = 0
+
+    def _next(self):
+        if self.f is not None:
+            self.f.close()
+
+        if self.segment_size is None:
+            path = self.path
+        else:
+            path = "{}.{:03d}".format(self.path, len(self.paths) + 1)
+        self.paths.append(path)
+        self.f = open(path, "wb")
+        self.written = 0
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view):
+            if self.f is None or (self.segment_size is not None and
+                                  self.written >= self.segment_size):
+                self._next()
+
+            n = len(view)
+            if self.segment_size is not None:
+                n = min(n, self.segment_size - self.written)
+            self.f.write(view[:n])
+            self.written += n
+            view = view[n:]
+
+    def close(self):
+        if self.f is None:
+            self._next()
+        self.f.close()
+
+
+class Acquisition(object):
+    # Images a Drive (an image file or a device such as /dev/sdb).
+    #
+    # A reader thread reads read_size bytes at a time (a multiple of the
+    # sector size, so reads stay aligned) and hands every chunk to one
+    # thread per hash algorithm and to a writer thread, each behind a queue
+    # of queue_depth chunks. The slowest of them sets the pace; none of
+    # them waits for the others. A read that fails is retried, then the
+    # chunk is read again sector by sector and sectors that still fail are
+    # written as zeros and listed in bad_sectors and in the log.
+    def __init__(self, drive, output, read_size=DEFAULT_READ_SIZE, segment_size=None,
+                 algorithms=DEFAULT_ALGORITHMS, retries=DEFAULT_RETRIES,
+                 queue_depth=DEFAULT_QUEUE_DEPTH, log_path=None):
+        if isinstance(drive, str):
+            drive = Drive(drive)
+        self.drive = drive
+        self.block_size = drive.get_block_size()
+        self.read_sectors = max(1, read_size // self.block_size)
+        self.algorithms = tuple(algorithms)
+        self.hashes = dict((name, hashlib.new(name)) for name in self.algorithms)
+        self.retries = retries
+        self.writer = SegmentWriter(output, segment_size)
+        self.log_path = log_path or output + LOG_SUFFIX
+        self.queues = [queue.Queue(queue_depth) for _ in range(len(self.algorithms) + 1)]
+
+        self.size = drive.get_size()
+        self.bytes_done = 0
+        self.bad_sectors = []
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def _put(self, q, item):
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                q.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, q):
+        while self.error is None:
+            try:
+                return q.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+        return None
+
+    def _read(self, sector, count, size):
+        for _ in range(self.retries + 1):
+            try:
+                data = self.drive.read(sector, count)
+                if len(data) >= size:
+                    return data[:size]
+            except OSError:
+                pass
+
+        return None
+
+    def _read_chunk(self, sector, count, size):
+        # size bytes from sector (the last chunk of an image may end inside
+        # a sector); a chunk that cannot be read whole is read again one
+        # sector at a time.
+        data = self._read(sector, count, size)
+        if data is not None:
+            return data
+
+        buf = bytearray(size)
+        for i in range(count):
+            pos = i * self.block_size
+            n = min(self.block_size, size - pos)
+            data = self._read(sector + i, 1, n) if count > 1 else None
+            if data is None:
+                self.bad_sectors.append(sector + i)
+                continue
+            buf[pos:pos + n] = data
+
+        return bytes(buf)
+
+    def _reader(self):
+        try:
+            sector = 0
+            offset = 0
+            while offset < self.size:
+                size = min(self.read_sectors * self.block_size, self.size - offset)
+                count = (size + self.block_size - 1) // self.block_size
+                data = self._read_chunk(sector, count, size)
+                for q in self.queues:
+                    self._put(q, data)
+
+                sector += count
+                offset += size
+                self.bytes_done = offset
+
+            for q in self.queues:
+                self._put(q, None)
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+
+    def _hasher(self, h, q):
+        while True:
+            data = self._get(q)
+            if data is None:
+                return
+            h.update(data)
+
+    def _write(self, q):
+        try:
+            while True:
+                data = self._get(q)
+                if data is None:
+                    break
+                self.writer.write(data)
+            self.writer.close()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+
+    def run(self, progress=None):
+        # progress(bytes_done, size) is called about every POLL_INTERVAL
+        # seconds. Returns the summary also written to the log.
+        self.started = time.monotonic()
+        started_at = datetime.datetime.now()
+        threads = [threading.Thread(target=self._hasher, args=(self.hashes[name], q))
+                   for name, q in zip(self.algorithms, self.queues)]
+        threads.append(threading.Thread(target=self._write, args=(self.queues[-1],)))
+        threads.append(threading.Thread(target=self._reader))
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        reader = threads[-1]
+        while reader.is_alive():
+            reader.join(POLL_INTERVAL)
+            if progress is not None:
+                progress(self.bytes_done, self.size)
+        for t in threads:
+            t.join()
+
+        self.finished = time.monotonic()
+        if self.error is not None:
+            raise self.error
+
+        summary = self.summary(started_at)
+        self.write_log(summary)
+        return summary
+
+    def summary(self, started_at=None):
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        summary = {
+            "source": self.drive.path,
+            "size": self.size,
+            "block_size": self.block_size,
+            "segments": self.writer.paths,
+            "bad_sectors": list(self.bad_sectors),
+            "seconds": elapsed,
+            "started": started_at.isoformat() if started_at else None,
+            "finished": datetime.datetime.now().isoformat()
+        }
+        for name in self.algorithms:
+            summary[name] = self.hashes[name].hexdigest()
+
+        return summary
+
+    def write_log(self, summary):
+        with open(self.log_path, "w") as f:
+            f.write("source: {}\n".format(summary["source"]))
+            f.write("size: {} bytes ({} byte sectors)\n".format(summary["size"],
+                                                                  summary["block_size"]))
+            f.write("started: {}\n".format(summary["started"]))
+            f.write("finished: {}\n".format(summary["finished"]))
+            for path in summary["segments"]:
+                f.write("segment: {}\n".format(path))
+            f.write("bad sectors: {}\n".format(len(summary["bad_sectors"])))
+            for sector in summary["bad_sectors"]:
+                f.write("bad sector: {}\n".format(sector))
+            for name in self.algorithms:
+                f.write("{}: {}\n".format(name, summary[name]))
+
+
+def acquire(source, output, **kwargs):
+    return Acquisition(source, output, **kwargs).run()
+
+
+if __name__ == '__main__':
+    # Windows : "\\\\.\\PhysicalDrive%d"
+    # Linux : "/dev/sda"
+    summary = acquire(sys.argv[1], sys.argv[2])
+    for name in DEFAULT_ALGORITHMS:
+        print("{}: {}".format(name, summary[name]))
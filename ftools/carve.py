@@ -0,0 +1,247 @@
+import os
+import re
+import sys
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from vdrive import worker_factory
+
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+# Extents are handed to workers in batches of about this many bytes.
+DEFAULT_BATCH_SIZE = 64 * 1024 * 1024
+
+HEADER = 0
+FOOTER = 1
+
+
+def sqlite_size(data, offset):
+    page_size, = struct.unpack_from(">H", data, offset + 16)
+    pages, = struct.unpack_from(">I", data, offset + 28)
+    if page_size == 1:
+        page_size = 65536
+
+    return page_size * pages or None
+
+
+class Signature(object):
+    # A file type to carve: it starts at header and ends footer_extra bytes
+    # after the first footer that follows. Types without a footer get their
+    # length from size_func(data, offset) (called with at least header_size
+    # bytes after offset) or run to max_size.
+    def __init__(self, name, header, footer=None, max_size=16 * 1024 * 1024,
+                 footer_extra=0, size_func=None, header_size=0):
+        self.name = name
+        self.header = header
+        self.footer = footer
+        self.max_size = max_size
+        self.footer_extra = footer_extra
+        self.size_func = size_func
+        self.header_size = max(header_size, len(header))
+
+    def __repr__(self):
+        return "Signature({})".format(self.name)
+
+
+SIGNATURES = [
+    Signature("jpg", b"\xff\xd8\xff", b"\xff\xd9", 32 * 1024 * 1024),
+    Signature("png", b"\x89PNG\r\n\x1a\n", b"IEND\xaeB`\x82", 32 * 1024 * 1024),
+    Signature("gif", b"GIF89a", b"\x00\x3b", 16 * 1024 * 1024),
+    Signature("gif", b"GIF87a", b"\x00\x3b", 16 * 1024 * 1024),
+    Signature("pdf", b"%PDF-", b"%%EOF", 128 * 1024 * 1024),
+    # End of central directory record: 4 byte signature + 18 bytes.
+    Signature("zip", b"PK\x03\x04", b"PK\x05\x06", 256 * 1024 * 1024, footer_extra=18),
+    Signature("sqlite", b"SQLite format 3\x00", None, 1024 * 1024 * 1024,
+              size_func=sqlite_size, header_size=32),
+]
+
+
+class Carver(object):
+    # Streams extents of a drive through one compiled regex holding every
+    # header and footer. Chunks of chunk_size bytes are read into a buffer
+    # that keeps the last overlap bytes of the previous chunk, so patterns
+    # and size headers cut by a chunk boundary are still seen whole; a match
+    # is only taken in the chunk where it lies before the overlap, so none
+    # is reported twice. Headers stay open across chunks until their footer
+    # or max_size is reached.
+    def __init__(self, drive, signatures=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.drive = drive
+        self.block_size = drive.get_block_size()
+        self.signatures = SIGNATURES if signatures is None else signatures
+        self.chunk_sectors = max(1, chunk_size // self.block_size)
+
+        # One group per header and per distinct footer, longest first so
+        # that a pattern is not hidden behind a shorter one it starts with.
+        events = [(sig.header, HEADER, sig) for sig in self.signatures]
+        footers = set(sig.footer for sig in self.signatures if sig.footer is not None)
+        events.extend((footer, FOOTER, footer) for footer in footers)
+        events.sort(key=lambda event: -len(event[0]))
+
+        self.events = [(kind, arg) for _, kind, arg in events]
+        self.pattern = re.compile(b"|".join(b"(" + re.escape(pattern) + b")"
+                                            for pattern, _, _ in events))
+
+        overlap = 1
+        for sig in self.signatures:
+            overlap = max(overlap, sig.header_size, len(sig.footer or b""))
+        self.overlap = overlap
+
+    def carve_extent(self, sector, count, end_sector=None):
+        # (offset, type, length) hits, offsets in bytes from the start of
+        # the drive, for headers in the count sectors at sector. Reading
+        # goes on up to end_sector (the end of the free extent this piece
+        # was cut from) while a header still waits for its footer.
+        if end_sector is None:
+            end_sector = sector + count
+        stop = (sector + count) * self.block_size
+        end = end_sector * self.block_size
+        total = end_sector - sector
+        buf = bytearray(self.overlap + self.chunk_sectors * self.block_size)
+        view = memoryview(buf)
+
+        opened = {}
+        kept = 0
+        done = 0
+        # Bytes before reach have been looked at for headers.
+        reach = sector * self.block_size
+        while done < total and (reach < stop or opened):
+            n = min(self.chunk_sectors, total - done)
+            size = self.drive.readinto(sector + done, view[kept:kept + n * self.block_size])
+            # Byte offset on the drive of buf[0].
+            origin = (sector + done) * self.block_size - kept
+            done += n
+            last = done >= total or size < n * self.block_size
+            filled = kept + size
+            limit = filled if last else filled - self.overlap
+
+            for m in self.pattern.finditer(buf, 0, filled):
+                if m.start() >= limit:
+                    break
+
+                kind, arg = self.events[m.lastindex - 1]
+                offset = origin + m.start()
+                if kind == HEADER:
+                    if offset >= stop or arg.name in opened:
+                        continue
+                    if arg.footer is None:
+                        yield self._sized(arg, buf, m.start(), filled, offset, end)
+                    else:
+                        opened[arg.name] = (offset, arg)
+                    continue
+
+                for name, (start, sig) in list(opened.items()):
+                    if sig.footer == arg:
+                        del opened[name]
+                        length = offset + len(arg) + sig.footer_extra - start
+                        yield (start, name, min(length, end - start))
+
+            # Give up on headers whose footer is out of reach.
+            reach = origin + limit
+            for name, (start, sig) in list(opened.items()):
+                if reach - start >= sig.max_size:
+                    del opened[name]
+                    yield (start, name, sig.max_size)
+
+            if last:
+                break
+
+            kept = min(self.overlap, filled)
+            buf[:kept] = buf[filled - kept:filled]
+
+        for name, (start, sig) in sorted(opened.items(), key=lambda item: item[1][0]):
+            yield (start, name, min(sig.max_size, end - start))
+
+    def _sized(self, sig, buf, pos, filled, offset, end):
+        length = None
+        if sig.size_func is not None and pos + sig.header_size <= filled:
+            length = sig.size_func(buf, pos)
+
+        if length is None or length > sig.max_size:
+            length = sig.max_size
+
+        return (offset, sig.name, min(length, end - offset))
+
+    def carve(self, extents):
+        # extents are (sector, count) or (sector, count, end_sector).
+        for extent in extents:
+            for hit in self.carve_extent(*extent):
+                yield hit
+
+
+def unallocated_extents(vfs):
+    # (sector, count) runs of the drive under vfs that no file owns: FAT
+    # entries equal to 0 on FAT32, clear $Bitmap bits on NTFS.
+    return [(vfs.to_sector(cluster), count * vfs.spc)
+            for cluster, count in vfs.free_extends()]
+
+
+def batch_extents(extents, block_size, batch_size=DEFAULT_BATCH_SIZE):
+    # Consecutive extents grouped into batches of about batch_size bytes. A
+    # larger extent is cut into pieces that remember where the extent ends,
+    # so a file starting near the end of a piece is still carved whole.
+    batch_sectors = max(1, batch_size // block_size)
+    batches = []
+    batch = []
+    size = 0
+    for sector, count in extents:
+        end_sector = sector + count
+        while count > 0:
+            n = min(count, batch_sectors - size)
+            batch.append((sector, n, end_sector))
+            size += n
+            sector += n
+            count -= n
+            if size >= batch_sectors:
+                batches.append(batch)
+                batch = []
+                size = 0
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def carve(vfs, signatures=None, workers=1, chunk_size=DEFAULT_CHUNK_SIZE,
+          batch_size=DEFAULT_BATCH_SIZE, drive_factory=None):
+    # Hits in unallocated space of vfs, extent by extent. With more than one
+    # worker, batches of extents are carved by a pool of processes, each
+    # opening the image through drive_factory (worker_factory(vfs.drive)
+    # by default); at most two batches per worker are outstanding.
+    extents = unallocated_extents(vfs)
+    if workers <= 1:
+        for hit in Carver(vfs.drive, signatures, chunk_size).carve(extents):
+            yield hit
+        return
+
+    if drive_factory is None:
+        drive_factory = worker_factory(vfs.drive)
+
+    batches = deque(batch_extents(extents, vfs.drive.get_block_size(), batch_size))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        inflight = deque()
+        while batches or inflight:
+            while batches and len(inflight) < workers * 2:
+                inflight.append(executor.submit(_carve_batch, drive_factory, signatures,
+                                                chunk_size, batches.popleft()))
+
+            for hit in inflight.popleft().result():
+                yield hit
+
+
+def _carve_batch(drive_factory, signatures, chunk_size, extents):
+    drive = drive_factory()
+    try:
+        return list(Carver(drive, signatures, chunk_size).carve(extents))
+    finally:
+        drive.close()
+
+
+if __name__ == '__main__':
+    from vpartition import open_partitions
+
+    for partition in open_partitions(sys.argv[1]):
+        if partition['vfs'] is None:
+            continue
+        for offset, name, length in carve(partition['vfs'], workers=os.cpu_count() or 1):
+            print(partition['index'], offset, name, length)
@@ -0,0 +1,290 @@
+import datetime
+import hashlib
+import os
+import sqlite3
+import sys
+from vdrive import Drive
+from vpartition import open_partitions
+from fat32 import FAT32, ATTR_DIRECTORY, normalize_path
+from ntfs import NTFS
+
+
+FINGERPRINT_SAMPLES = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    fingerprint TEXT PRIMARY KEY,
+    path TEXT,
+    size INTEGER,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS partitions (
+    fingerprint TEXT,
+    part INTEGER,
+    scheme TEXT,
+    lba INTEGER,
+    size INTEGER,
+    type TEXT,
+    fs TEXT,
+    PRIMARY KEY (fingerprint, part)
+);
+CREATE TABLE IF NOT EXISTS files (
+    fingerprint TEXT,
+    id INTEGER,
+    part INTEGER,
+    path TEXT,
+    path_lower TEXT,
+    parent_lower TEXT,
+    name TEXT,
+    name_lower TEXT,
+    ext TEXT,
+    is_dir INTEGER,
+    size INTEGER,
+    ctime TEXT,
+    mtime TEXT,
+    atime TEXT,
+    ref INTEGER,
+    PRIMARY KEY (fingerprint, id)
+);
+CREATE INDEX IF NOT EXISTS files_path ON files (fingerprint, part, path_lower);
+CREATE INDEX IF NOT EXISTS files_parent ON files (fingerprint, part, parent_lower);
+CREATE INDEX IF NOT EXISTS files_name ON files (fingerprint, name_lower);
+CREATE INDEX IF NOT EXISTS files_ext ON files (fingerprint, ext);
+CREATE TABLE IF NOT EXISTS extents (
+    fingerprint TEXT,
+    file_id INTEGER,
+    sector INTEGER,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS extents_file ON extents (fingerprint, file_id);
+"""
+
+FILE_COLUMNS = ("id", "part", "path", "name", "ext", "is_dir", "size",
+                "ctime", "mtime", "atime", "ref")
+
+
+def fingerprint(drive, samples=FINGERPRINT_SAMPLES):
+    # Size, mtime and SHA-1 of samples sectors spread evenly over the image
+    # (the first and the last included): cheap, and changes with any
+    # rewrite of the image file or of its boot and table sectors.
+    size = drive.get_size()
+    try:
+        mtime = os.stat(drive.path).st_mtime
+    except OSError:
+        mtime = 0
+
+    h = hashlib.sha1()
+    h.update(("%d:%r" % (size, mtime)).encode("ascii"))
+    sectors = max(1, size // drive.get_block_size())
+    picked = sorted(set((sectors - 1) * i // max(1, samples - 1) for i in range(samples)))
+    for data in drive.read_many([(sector, 1) for sector in picked]):
+        h.update(data)
+
+    return h.hexdigest(), size, mtime
+
+
+def from_fat_datetime(date, time=0):
+    try:
+        return datetime.datetime((date >> 9) + 1980, (date >> 5) & 0x0F, date & 0x1F,
+                                 time >> 11, (time >> 5) & 0x3F, (time & 0x1F) * 2).isoformat()
+    except ValueError:
+        return None
+
+
+def from_filetime(value):
+    if not value:
+        return None
+
+    try:
+        return (datetime.datetime(1601, 1, 1) +
+                datetime.timedelta(microseconds=value // 10)).isoformat()
+    except OverflowError:
+        return None
+
+
+def _split_ext(name):
+    base, dot, ext = name.rpartition(".")
+    return ext.lower() if dot and base else ""
+
+
+def _parent(path):
+    return path.rsplit("/", 1)[0] or "/"
+
+
+def fat32_files(fat32, base, workers=1):
+    # (path, name, is_dir, size, ctime, mtime, atime, ref, extents) for
+    # every entry reachable from the root.
+    if fat32.fat_table is None:
+        fat32.load_fat()
+
+    for entry in fat32.walk(workers=workers):
+        extents = []
+        if entry["cluster"] >= 2:
+            extents = [(base + fat32.to_sector(c), n * fat32.spc)
+                       for c, n in fat32.get_fat_info(entry["cluster"])]
+
+        yield (entry["path"], fat32.entry_name(entry),
+               bool(entry["attr"] & ATTR_DIRECTORY), entry["size"],
+               from_fat_datetime(entry["cdate"], entry["ctime"]),
+               from_fat_datetime(entry["wdate"], entry["wtime"]),
+               from_fat_datetime(entry["adate"]),
+               entry["cluster"], extents)
+
+
+def ntfs_files(ntfs, base):
+    # Same rows as fat32_files() for every file NTFS.walk() finds; the MFT
+    # record number is the ref.
+    for record in ntfs.walk():
+        data = record["data"]
+        extents = []
+        size = 0
+        if data is not None:
+            if data["non-resident"]:
+                size = data["real_size"]
+                extents = [(base + ntfs.to_sector(lcn), n * ntfs.spc)
+                           for lcn, n in data["runlists"] if lcn is not None]
+            else:
+                size = data["content_size"]
+
+        si = record["standard_information"] or record["name"]
+        yield (record["path"], record["name"]["name"], record["is_directory"], size,
+               from_filetime(si["ctime"]), from_filetime(si["mtime"]),
+               from_filetime(si["atime"]), record["number"], extents)
+
+
+class Catalog(object):
+    # SQLite copy of the partition layout and the file tree of an image,
+    # keyed by fingerprint(): one database can hold many images, and an
+    # image whose fingerprint changed is dropped and walked again by
+    # build(). Paths use "/" and are matched case-insensitively. A drive
+    # opened here from a path is closed by close(); one passed in is left
+    # open.
+    def __init__(self, db_path, drive):
+        self.owns_drive = isinstance(drive, str)
+        if self.owns_drive:
+            drive = Drive(drive)
+        self.drive = drive
+        self.db = sqlite3.connect(db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.fingerprint, self.size, self.mtime = fingerprint(drive)
+
+    def close(self):
+        self.db.close()
+        if self.owns_drive:
+            self.drive.close()
+
+    def is_built(self):
+        row = self.db.execute("SELECT 1 FROM images WHERE fingerprint = ?",
+                              (self.fingerprint,)).fetchone()
+        return row is not None
+
+    def invalidate(self, fingerprint=None):
+        # Drops fingerprint (by default every fingerprint recorded for this
+        # image path that is not the current one).
+        if fingerprint is None:
+            rows = self.db.execute("SELECT fingerprint FROM images WHERE path = ? AND fingerprint != ?",
+                                   (self.drive.path, self.fingerprint)).fetchall()
+            stale = [row[0] for row in rows]
+        else:
+            stale = [fingerprint]
+
+        with self.db:
+            for fp in stale:
+                for table in ("images", "partitions", "files", "extents"):
+                    self.db.execute("DELETE FROM {} WHERE fingerprint = ?".format(table), (fp,))
+
+    def build(self, workers=1, force=False):
+        self.invalidate()
+        if self.is_built() and not force:
+            return False
+        self.invalidate(self.fingerprint)
+
+        fp = self.fingerprint
+        file_id = 0
+        with self.db:
+            for part, partition in enumerate(open_partitions(self.drive)):
+                vfs = partition['vfs']
+                self.db.execute("INSERT INTO partitions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (fp, part, partition['scheme'], partition['lba'],
+                                 partition['size'], str(partition['type']),
+                                 type(vfs).__name__ if vfs is not None else None))
+
+                base = partition['lba']
+                if isinstance(vfs, FAT32):
+                    rows = fat32_files(vfs, base, workers)
+                elif isinstance(vfs, NTFS):
+                    rows = ntfs_files(vfs, base)
+                else:
+                    continue
+
+                files = []
+                extents = []
+                for path, name, is_dir, size, ctime, mtime, atime, ref, runs in rows:
+                    files.append((fp, file_id, part, path, path.lower(),
+                                  _parent(path).lower(), name, name.lower(),
+                                  _split_ext(name), int(is_dir), size,
+                                  ctime, mtime, atime, ref))
+                    extents.extend((fp, file_id, sector, count) for sector, count in runs)
+                    file_id += 1
+
+                self.db.executemany("INSERT INTO files VALUES (%s)" % ", ".join("?" * 15), files)
+                self.db.executemany("INSERT INTO extents VALUES (?, ?, ?, ?)", extents)
+
+            self.db.execute("INSERT INTO images VALUES (?, ?, ?, ?)",
+                            (fp, self.drive.path, self.size, self.mtime))
+
+        return True
+
+    def _files(self, where, args):
+        sql = "SELECT {} FROM files WHERE fingerprint = ? AND {} ORDER BY part, path_lower".format(
+            ", ".join(FILE_COLUMNS), where)
+        return [dict(row) for row in self.db.execute(sql, (self.fingerprint,) + tuple(args))]
+
+    def partitions(self):
+        rows = self.db.execute("SELECT part, scheme, lba, size, type, fs FROM partitions "
+                               "WHERE fingerprint = ? ORDER BY part", (self.fingerprint,))
+        return [dict(row) for row in rows]
+
+    def resolve(self, path, part=0):
+        files = self._files("part = ? AND path_lower = ?",
+                            (part, normalize_path(path).lower()))
+        if not files:
+            raise Exception("No such file: " + path)
+
+        return files[0]
+
+    def list_dir(self, path="/", part=0):
+        return self._files("part = ? AND parent_lower = ?",
+                           (part, normalize_path(path).lower()))
+
+    def find(self, name=None, ext=None):
+        # name: exact file name, or a glob pattern (*, ?, [...]).
+        where = ["1"]
+        args = []
+        if name is not None:
+            glob = any(c in name for c in "*?[")
+            where.append("name_lower GLOB ?" if glob else "name_lower = ?")
+            args.append(name.lower())
+        if ext is not None:
+            where.append("ext = ?")
+            args.append(ext.lower().lstrip("."))
+
+        return self._files(" AND ".join(where), args)
+
+    def extents(self, file):
+        rows = self.db.execute("SELECT sector, count FROM extents WHERE fingerprint = ? "
+                               "AND file_id = ? ORDER BY rowid", (self.fingerprint, file["id"]))
+        return [tuple(row) for row in rows]
+
+
+def open_catalog(db_path, drive, workers=1):
+    catalog = Catalog(db_path, drive)
+    catalog.build(workers)
+    return catalog
+
+
+if __name__ == '__main__':
+    catalog = open_catalog(sys.argv[1], sys.argv[2])
+    for f in catalog.list_dir(sys.argv[3] if len(sys.argv) > 3 else "/"):
+        print(f)
@@ -1,5 +1,9 @@
+import re
 import sys
 import struct
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from vfs import VFS
 from vdrive import Drive
 from vfile import BlockFile
@@ -8,6 +12,21 @@ from utils import Utils
 import pprint
 
 
+FAT_ENTRY_MASK = 0x0FFFFFFF
+FAT_BAD_CLUSTER = 0x0FFFFFF7
+FAT_FREE_RUN = re.compile(b"\x00{4,}")
+
+ATTR_VOLUME_LABEL = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_LFN = 0x0F
+DELETED_ENTRY = 0xE5
+
+# name, ext, attr, reserved, ctime_tenth, ctime, cdate, adate,
+# fat_high, wtime, wdate, fat_low, size
+DIRECTORY_ENTRY_RAW = struct.Struct("<8s3sBBBHHHHHHHI")
+EMPTY_DIRECTORY_ENTRY = DIRECTORY_ENTRY_RAW.unpack(bytes(DIRECTORY_ENTRY_RAW.size))
+RAW_DATE_FIELDS = {"cdate": 6, "adate": 7, "wdate": 10}
+
 def to_decode(byte_arr, decoding):
     if len(byte_arr) == 0:
         return ""
@@ -24,10 +43,219 @@ def to_euc_kr(byte_arr):
     return to_decode(byte_arr, 'euc-kr')
 
 
+def _vbr_schema():
+    vbr_desc = Schema()
+    vbr_desc.add("oem_name", 3, 8, dtype="str")
+    vbr_desc.add("bps", 11, 2)
+    vbr_desc.add("spc", 13, 1)
+    vbr_desc.add("reserved_sector_count", 14, 2)
+    vbr_desc.add("nfats", 16, 1)
+    vbr_desc.add("total_sectors", 32, 4)
+    vbr_desc.add("fat_size", 36, 4)
+    vbr_desc.add("root_dir", 44, 4)
+    vbr_desc.add("fstype", 82, 8, dtype="str")
+    return vbr_desc
+
+def _directory_entry_schema():
+    desc = Schema()
+    desc.add("name", 0, 8, dtype="str", transform=to_euc_kr)
+    desc.add("ext", 8, 3, dtype="str")
+    desc.add("attr", 11, 1)
+    desc.add("ctime_tenth", 13, 1)
+    desc.add("ctime", 14, 2)
+    desc.add("cdate", 16, 2)
+    desc.add("adate", 18, 2)
+    desc.add("fat_high", 20, 2)
+    desc.add("wtime", 22, 2)
+    desc.add("wdate", 24, 2)
+    desc.add("fat_low", 26, 2)
+    desc.add("size", 28, 4)
+    return desc
+
+def _lfn_entry_schema():
+    desc = Schema()
+    desc.add("order", 0, 1)
+    desc.add("name1", 1, 10, dtype="str", transform=to_ucs2_le)
+    desc.add("name2", 14, 12, dtype="str", transform=to_ucs2_le)
+    desc.add("name3", 28, 4, dtype="str", transform=to_ucs2_le)
+    return desc
+
+
+def to_fat_date(date):
+    return ((date.year - 1980) << 9) | (date.month << 5) | date.day
+
+
+def normalize_path(path):
+    # "/" separated and rooted, whatever separators path came with.
+    parts = [p for p in path.replace("\\", "/").split("/") if p]
+    return "/" + "/".join(parts)
+
+
+class DirectoryFilter(object):
+    # Conditions are checked against the raw directory slot before any name
+    # is decoded. attr: bits that must be set, exclude_attr: bits that must
+    # be clear, ext: extensions (case-insensitive, without the dot), sizes in
+    # bytes, dates as datetime.date compared against date_field.
+    def __init__(self, attr=0, exclude_attr=0, ext=None, min_size=None,
+                 max_size=None, date_from=None, date_to=None, date_field="wdate"):
+        self.attr = attr
+        self.exclude_attr = exclude_attr
+        self.min_size = min_size
+        self.max_size = max_size
+        self.date_field = date_field
+        self.date_index = RAW_DATE_FIELDS[date_field]
+        self.date_from = to_fat_date(date_from) if date_from else None
+        self.date_to = to_fat_date(date_to) if date_to else None
+
+        self.ext = None
+        self.raw_ext = None
+        if ext is not None:
+            self.ext = set(e.lower().lstrip(".") for e in ext)
+            # A long name keeps the first three characters of its extension
+            # in the short name.
+            self.raw_ext = set(e[:3].upper().encode().ljust(3) for e in self.ext)
+
+    def _match(self, attr, ext, size, date):
+        if attr & self.attr != self.attr or attr & self.exclude_attr:
+            return False
+
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+
+        if self.date_from is not None and date < self.date_from:
+            return False
+        if self.date_to is not None and date > self.date_to:
+            return False
+
+        if self.raw_ext is not None and ext.upper() not in self.raw_ext:
+            return False
+
+        return True
+
+    def match_raw(self, fields):
+        return self._match(fields[2], fields[1], fields[12], fields[self.date_index])
+
+    def match_entry(self, entry):
+        return (self._match(entry["attr"], bytes(entry["ext"]), entry["size"],
+                            entry[self.date_field]) and
+                self.match(entry))
+
+    def match(self, entry):
+        # The raw check only saw three characters of the extension; compare
+        # the whole one, from the long name or else from the 8.3 name.
+        if self.ext is None:
+            return True
+
+        if "sname" in entry:
+            name = entry["name"]
+            ext = name.rsplit(".", 1)[1].lower() if "." in name else ""
+        else:
+            ext = bytes(entry["ext"]).decode("latin-1").rstrip(" ").lower()
+        return ext in self.ext
+
+
+def is_chain_end(v, cluster_count):
+    # End-of-chain markers (0x0FFFFFF8-0x0FFFFFFF), bad clusters, free
+    # entries and out-of-range values all terminate a chain.
+    v &= FAT_ENTRY_MASK
+    return v < 2 or v >= cluster_count + 2
+
+
+class FATTable(object):
+    # The whole FAT held in one array('I'); entry i describes cluster i.
+    def __init__(self, data, cluster_count):
+        self.cluster_count = cluster_count
+        self.table = array('I' if array('I').itemsize == 4 else 'L')
+        self.table.frombytes(memoryview(data)[:(cluster_count + 2) * 4])
+        if sys.byteorder == 'big':
+            self.table.byteswap()
+
+    def __len__(self):
+        return len(self.table)
+
+    def next(self, cluster):
+        return self.table[cluster] & FAT_ENTRY_MASK
+
+    def chain(self, start):
+        table = self.table
+        limit = self.cluster_count + 2
+        if start < 2 or start >= limit:
+            return []
+
+        clusters = [start]
+        seen = set(clusters)
+        v = table[start] & FAT_ENTRY_MASK
+
+        while 2 <= v < limit and v not in seen:
+            clusters.append(v)
+            seen.add(v)
+            v = table[v] & FAT_ENTRY_MASK
+
+        return clusters
+
+    def is_loop(self, start):
+        clusters = self.chain(start)
+        if not clusters:
+            return False
+
+        v = self.next(clusters[-1])
+        return 2 <= v < self.cluster_count + 2 and v in set(clusters)
+
+    def free_count(self):
+        return self.table.count(0) - self.table[:2].count(0)
+
+    def free_extends(self):
+        # Runs of free entries found with one regex pass over the bytes of
+        # the table (no copy); only the 4-byte aligned part of a zero run is
+        # a run of free entries, whatever the byte order.
+        extends = []
+        for m in FAT_FREE_RUN.finditer(memoryview(self.table).cast('B'), 8):
+            start = (m.start() + 3) // 4
+            end = m.end() // 4
+            if end > start:
+                extends.append((start, end - start))
+
+        return extends
+
+    def chains(self):
+        # Every allocated cluster nobody points at starts a chain; following
+        # all of them visits each cluster at most once.
+        table = self.table
+        limit = self.cluster_count + 2
+        pointed = bytearray(limit)
+        for v in table:
+            v &= FAT_ENTRY_MASK
+            if 2 <= v < limit:
+                pointed[v] = 1
+
+        chains = {}
+        for cluster in range(2, limit):
+            if pointed[cluster]:
+                continue
+
+            v = table[cluster] & FAT_ENTRY_MASK
+            if v == 0 or v == FAT_BAD_CLUSTER:
+                continue
+
+            chains[cluster] = self.chain(cluster)
+
+        return chains
+
+
 class FAT32(VFS):
-    def __init__(self, drive):
+    VBR = _vbr_schema()
+    DIRECTORY_ENTRY = _directory_entry_schema()
+    LFN_ENTRY = _lfn_entry_schema()
+
+    def __init__(self, drive, load_fat=False):
         super(FAT32, self).__init__(drive)
+        self.fat_table = None
+        self.index = None
         self.get_vbr_info()
+        if load_fat:
+            self.load_fat()
 
     def get_vbr_info(self):
         data = self.drive.read(0)
@@ -38,8 +266,39 @@ class FAT32(VFS):
         self.bps = self.vbr["bps"]
         self.spc = self.vbr["spc"]
         self.fds = self.rsc + self.fat_size * nfats
+        self.cluster_count = (self.vbr["total_sectors"] - self.fds) // self.spc
+
+    def load_fat(self, fat_idx=0):
+        data = self.drive.read(self.rsc + fat_idx * self.fat_size, self.fat_size)
+        self.fat_table = FATTable(data, self.cluster_count)
+        return self.fat_table
+
+    def free_cluster_count(self):
+        if self.fat_table is None:
+            self.load_fat()
+
+        return self.fat_table.free_count()
+
+    def free_extends(self):
+        if self.fat_table is None:
+            self.load_fat()
+
+        return self.fat_table.free_extends()
+
+    def get_fat_chains(self):
+        if self.fat_table is None:
+            self.load_fat()
+
+        chains = self.fat_table.chains()
+        for start in chains:
+            chains[start] = self.fat_to_extends(chains[start])
+
+        return chains
 
     def get_fat_info(self, start, fat_idx=0):
+        if self.fat_table is not None and fat_idx == 0:
+            return self.fat_to_extends(self.fat_table.chain(start))
+
         base_sector = self.rsc + fat_idx * self.fat_size
         fps = int(self.bps / 4)
 
@@ -49,11 +308,13 @@ class FAT32(VFS):
         data = None
 
         fat = []
+        seen = set()
 
         v = start
 
-        while v != 0x0FFFFFFF:
+        while not is_chain_end(v, self.cluster_count) and v not in seen:
             fat.append(v)
+            seen.add(v)
             target = v
             new_needed_sector = int(target / fps)
             if needed_sector != new_needed_sector:
@@ -62,7 +323,7 @@ class FAT32(VFS):
                 data = self.drive.read(base_sector + needed_sector)
 
             loc = target % fps
-            v = struct.unpack("<I", data[loc * 4:loc * 4 + 4])[0]            
+            v = struct.unpack("<I", data[loc * 4:loc * 4 + 4])[0] & FAT_ENTRY_MASK
 
         return self.fat_to_extends(fat)
 
@@ -72,6 +333,8 @@ class FAT32(VFS):
         count = 1
 
         extends = []
+        if not fat:
+            return extends
 
         for i in fat:
             if start == -1:
@@ -92,33 +355,173 @@ class FAT32(VFS):
         return extends                
 
     def parse_vbr(self, data):
-        vbr_desc = Schema()
-        vbr_desc.add("oem_name", 3, 8, dtype="str")
-        vbr_desc.add("bps", 11, 2)
-        vbr_desc.add("spc", 13, 1)
-        vbr_desc.add("reserved_sector_count", 14, 2)
-        vbr_desc.add("nfats", 16, 1)
-        vbr_desc.add("total_sectors", 32, 4)
-        vbr_desc.add("fat_size", 36, 4)
-        vbr_desc.add("root_dir", 44, 4)
-        vbr_desc.add("fstype", 82, 8, dtype="str")
-
-        return Utils.schema_to_map(vbr_desc, data, endian=Utils.LITTLE_ENDIAN)
+        return Utils.schema_to_map(self.VBR, data, endian=Utils.LITTLE_ENDIAN)
 
-    def read(self, cluster, count=1):
+    def to_sector(self, cluster):
         if (cluster < 2):
             raise Exception("Not Supported Cluster Number: " + str(cluster))
 
         rc = cluster - 2
-        return self.drive.read(self.fds + self.spc * rc, count * self.spc)
+        return self.fds + self.spc * rc
+
+    def read(self, cluster, count=1):
+        return self.drive.read(self.to_sector(cluster), count * self.spc)
+
+    def pread(self, cluster, count=1):
+        return self.drive.pread(self.to_sector(cluster), count * self.spc)
+
+    def read_directory(self, cluster, positional=False):
+        fats = self.get_fat_info(cluster)
+        if positional:
+            parts = [self.pread(c, count) for c, count in fats]
+        elif len(fats) == 1:
+            parts = [self.read(fats[0][0], fats[0][1])]
+        else:
+            parts = self.read_many(fats)
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def list_many(self, clusters, filter=None, deleted=True):
+        # Lists several directories with one batched read of all their
+        # clusters.
+        chains = [self.get_fat_info(cluster) for cluster in clusters]
+        parts = self.read_many([extend for fats in chains for extend in fats])
+
+        lists = []
+        for fats in chains:
+            data = b"".join(parts[:len(fats)])
+            parts = parts[len(fats):]
+            lists.append(self.parse_list(data, filter, deleted))
+
+        return lists
+
+    def entry_name(self, entry):
+        if "sname" in entry:
+            return entry["name"]
+
+        name = entry["name"]
+        if isinstance(name, bytes):
+            name = name.decode("latin-1")
+        name = name.rstrip(" ")
+        ext = bytes(entry["ext"]).decode("latin-1").rstrip(" ")
+        return name + "." + ext if ext else name
+
+    def _walk_entries(self, path, data, filter, deleted):
+        children = []
+        entries = []
+        for entry in self.iter_list(data, filter, deleted, directories=True):
+            attr = entry["attr"]
+            if attr & ATTR_VOLUME_LABEL and not attr & ATTR_DIRECTORY:
+                continue
+
+            name = self.entry_name(entry)
+            if name in (".", ".."):
+                continue
+
+            entry["path"] = path + "/" + name
+            if attr & ATTR_DIRECTORY:
+                children.append((entry["path"], entry["cluster"]))
+                if filter is not None and not filter.match_entry(entry):
+                    continue
+
+            entries.append(entry)
+
+        return entries, children
+
+    def walk(self, cluster=None, path="", workers=1, filter=None, deleted=False):
+        # Yields every entry below cluster (the root directory by default)
+        # with its full path in entry["path"]. Directories already visited
+        # are not entered again, so corrupt trees cannot loop. With
+        # workers > 1 directory clusters are fetched by a thread pool through
+        # positional reads, after loading the whole FAT.
+        indexing = cluster is None and filter is None and not deleted
+        if cluster is None:
+            cluster = self.vbr["root_dir"]
+
+        index = {}
+        visited = set([cluster])
+        pending = deque([(path, cluster)])
+        inflight = deque()
+
+        executor = None
+        limit = 1
+        if workers > 1:
+            if self.fat_table is None:
+                self.load_fat()
+            executor = ThreadPoolExecutor(max_workers=workers)
+            limit = workers * 4
+
+        try:
+            while pending or inflight:
+                while pending and len(inflight) < limit:
+                    dpath, dcluster = pending.popleft()
+                    if executor is None:
+                        inflight.append((dpath, self.read_directory(dcluster)))
+                    else:
+                        inflight.append((dpath, executor.submit(self.read_directory,
+                                                                dcluster, True)))
+
+                dpath, data = inflight.popleft()
+                if executor is not None:
+                    data = data.result()
+
+                entries, children = self._walk_entries(dpath, data, filter, deleted)
+                for child in children:
+                    if child[1] in visited or is_chain_end(child[1], self.cluster_count):
+                        continue
+                    visited.add(child[1])
+                    pending.append(child)
+
+                for entry in entries:
+                    if indexing:
+                        index[entry["path"].lower()] = entry
+                    yield entry
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        if indexing:
+            self.index = index
+
+    def build_index(self, workers=1):
+        for _ in self.walk(workers=workers):
+            pass
+
+        return self.index
+
+    def lookup(self, path):
+        path = normalize_path(path)
+        if self.index is not None:
+            entry = self.index.get(path.lower())
+            if entry is None:
+                raise Exception("No such file: " + path)
+            return entry
+
+        cluster = self.vbr["root_dir"]
+        entry = None
+        for name in path.split("/")[1:]:
+            if entry is not None and not entry["attr"] & ATTR_DIRECTORY:
+                raise Exception("Not a directory: " + entry["path"])
+
+            entry = None
+            for e in self.iter_list(self.read_directory(cluster), deleted=False):
+                if self.entry_name(e).lower() == name.lower():
+                    entry = e
+                    break
+
+            if entry is None:
+                raise Exception("No such file: " + path)
+            cluster = entry["cluster"]
 
-    def list(self, cluster):
-        fats = fat32.get_fat_info(cluster)
-        data = bytes()
-        for cluster, count in fats:
-            data += self.read(cluster, count)
+        return entry
+
+    def open(self, path):
+        entry = self.lookup(path)
+        return BlockFile(self, entry["size"], self.get_fat_info(entry["cluster"]))
 
-        l = self.parse_list(data)
+    def list(self, cluster, filter=None, deleted=True):
+        data = self.read_directory(cluster)
+
+        l = self.parse_list(data, filter, deleted)
         return l
 
     def strip(self, ucs_str):
@@ -130,21 +533,7 @@ class FAT32(VFS):
         return ucs_str
 
     def _parse_directory_entry(self, data, lfn):
-        desc = Schema()
-        desc.add("name", 0, 8, dtype="str", transform=to_euc_kr)
-        desc.add("ext", 8, 3, dtype="str")
-        desc.add("attr", 11, 1)
-        desc.add("ctime_tenth", 13, 1)
-        desc.add("ctime", 14, 2)
-        desc.add("cdate", 16, 2)
-        desc.add("adate", 18, 2)
-        desc.add("fat_high", 20, 2)
-        desc.add("wtime", 22, 2)
-        desc.add("wdate", 24, 2)
-        desc.add("fat_low", 26, 2)
-        desc.add("size", 28, 4)
-
-        entry = Utils.schema_to_map(desc, data, endian=Utils.LITTLE_ENDIAN)
+        entry = Utils.schema_to_map(self.DIRECTORY_ENTRY, data, endian=Utils.LITTLE_ENDIAN)
         entry["cluster"] = entry["fat_high"] << 16 | entry["fat_low"]
 
         if lfn:
@@ -154,13 +543,7 @@ class FAT32(VFS):
         return entry
 
     def _parse_directory_entry_lfn(self, data, lfn):
-        desc = Schema()
-        desc.add("order", 0, 1)
-        desc.add("name1", 1, 10, dtype="str", transform=to_ucs2_le)
-        desc.add("name2", 14, 12, dtype="str", transform=to_ucs2_le)
-        desc.add("name3", 28, 4, dtype="str", transform=to_ucs2_le)
-
-        entry = Utils.schema_to_map(desc, data, endian=Utils.LITTLE_ENDIAN)
+        entry = Utils.schema_to_map(self.LFN_ENTRY, data, endian=Utils.LITTLE_ENDIAN)
         name1 = self.strip(entry["name1"])
         name2 = self.strip(entry["name2"])
         name3 = self.strip(entry["name3"])
@@ -176,30 +559,47 @@ class FAT32(VFS):
         entry["name"] = name1 + name2 + name3 + extra
         return entry
 
-    def parse_list(self, data):
-        s = len(data)
-        old_lfn = False
-        files = []
+    def iter_list(self, data, filter=None, deleted=True, directories=False):
+        # Raw fields of every slot come from one iter_unpack pass; LFN slots
+        # are only remembered, and names are decoded and dicts built only
+        # for entries that survive the deleted/filter checks. directories
+        # lets every directory through the filter (for tree walks).
+        view = memoryview(data)
+        view = view[:len(view) - len(view) % DIRECTORY_ENTRY_RAW.size]
+        lfn_slots = []
+
+        for i, fields in enumerate(DIRECTORY_ENTRY_RAW.iter_unpack(view)):
+            if fields[2] & ATTR_LFN == ATTR_LFN:
+                lfn_slots.append(i)
+                continue
+
+            if fields == EMPTY_DIRECTORY_ENTRY:
+                break
 
-        lfn = ""
+            if not deleted and fields[0][0] == DELETED_ENTRY:
+                lfn_slots = []
+                continue
 
-        for i in range(0, s, 32):
-            d = data[i:i+32]
-            is_lfn = d[11] & 0x0F is 0x0F
+            if (filter is not None and not filter.match_raw(fields) and
+                    not (directories and fields[2] & ATTR_DIRECTORY)):
+                lfn_slots = []
+                continue
 
-            c = struct.unpack("<QQQQ", d)
-            if c[0] == 0 and c[1] == 0 and c[2] == 0 and c[3] == 0:
-                break
+            lfn = ""
+            for slot in lfn_slots:
+                d = view[slot * 32:slot * 32 + 32]
+                lfn = self._get_lfn(self._parse_directory_entry_lfn(d, lfn))
+            lfn_slots = []
 
-            if not is_lfn:
-                entry = self._parse_directory_entry(d, lfn)
-                files.append(entry)
-                lfn = ""
-            else:
-                entry = self._parse_directory_entry_lfn(d, lfn)
-                lfn = self._get_lfn(entry)
+            entry = self._parse_directory_entry(view[i * 32:i * 32 + 32], lfn)
+            if (filter is not None and not filter.match(entry) and
+                    not (directories and fields[2] & ATTR_DIRECTORY)):
+                continue
+
+            yield entry
 
-        return files
+    def parse_list(self, data, filter=None, deleted=True):
+        return list(self.iter_list(data, filter, deleted))
 
     def _get_lfn(self, entry):
         return entry["name"]
@@ -208,6 +608,6 @@ class FAT32(VFS):
 if __name__ == '__main__':
     vdrive = Drive(sys.argv[1])   
     fat32 = FAT32(vdrive)
-    files = fat32.list(2)
+    files = fat32.list(fat32.vbr["root_dir"])
     for f in files:
         pprint.pprint(f)
@@ -0,0 +1,242 @@
+import csv
+import hashlib
+import heapq
+import json
+import queue
+import sys
+import threading
+import time
+from fat32 import ATTR_DIRECTORY
+from vfile import BlockFile
+
+
+DEFAULT_ALGORITHMS = ("md5", "sha1", "sha256")
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+OUTPUT_FIELDS = ("path", "size")
+
+
+def iter_files(vfs):
+    # (path, file) for every regular file of vfs, file being a BlockFile or
+    # a MemoryFile (resident NTFS data). Volumes are told apart by what they
+    # can do, so classes imported as ftools.* work too.
+    if hasattr(vfs, "data_file"):
+        for record in vfs.walk():
+            if record["is_directory"]:
+                continue
+            f = vfs.data_file(record)
+            if f is not None:
+                yield record["path"], f
+        return
+
+    if hasattr(vfs, "get_fat_info"):
+        if vfs.fat_table is None:
+            vfs.load_fat()
+        for entry in vfs.walk():
+            if entry["attr"] & ATTR_DIRECTORY:
+                continue
+            extents = vfs.get_fat_info(entry["cluster"]) if entry["cluster"] >= 2 else []
+            yield entry["path"], BlockFile(vfs, entry["size"], extents)
+        return
+
+    raise Exception("Not Supported VFS: " + type(vfs).__name__)
+
+
+class VolumeHasher(object):
+    # Hashes every file of a volume with several algorithms at once.
+    #
+    # A reader thread reads the extents of all files in physical order,
+    # keeping every file's own extents in file order: a heap holds the next
+    # extent of each file, keyed by its first cluster, so the image is read
+    # close to sequentially however the files are fragmented. Each chunk
+    # read goes to one thread per algorithm (hashlib drops the GIL on large
+    # updates), and at most memory_limit bytes of chunks are waiting for
+    # them at any time.
+    def __init__(self, vfs, algorithms=DEFAULT_ALGORITHMS,
+                 chunk_size=DEFAULT_CHUNK_SIZE, memory_limit=DEFAULT_MEMORY_LIMIT):
+        self.vfs = vfs
+        self.algorithms = tuple(algorithms)
+        for name in self.algorithms:
+            hashlib.new(name)
+        self.block_size = vfs.get_block_size()
+        self.chunk_blocks = max(1, chunk_size // self.block_size)
+        self.memory_limit = max(memory_limit, self.chunk_blocks * self.block_size)
+
+        self.cond = threading.Condition()
+        self.queues = []
+        self.cancelled = False
+        self.inflight = 0
+        self.bytes_read = 0
+        self.bytes_hashed = 0
+        self.files_done = 0
+        self.started = None
+        self.finished = None
+
+    def _acquire(self, size):
+        with self.cond:
+            while self.inflight and self.inflight + size > self.memory_limit:
+                self.cond.wait()
+            self.inflight += size
+
+    def _release(self, chunk):
+        with self.cond:
+            chunk[1] -= 1
+            if chunk[1] == 0:
+                self.inflight -= len(chunk[0])
+                self.cond.notify_all()
+
+    def _dispatch(self, file_id, data):
+        chunk = [data, len(self.queues)]
+        self._acquire(len(data))
+        for q in self.queues:
+            q.put((file_id, chunk))
+
+    def _hash_worker(self, name, jobs, results):
+        contexts = {}
+        while True:
+            file_id, chunk = jobs.get()
+            if file_id is None:
+                break
+
+            if chunk is None:
+                h = contexts.pop(file_id, None) or hashlib.new(name)
+                results.put((file_id, name, h.hexdigest()))
+                continue
+
+            h = contexts.get(file_id)
+            if h is None:
+                h = contexts[file_id] = hashlib.new(name)
+            h.update(chunk[0])
+            self._release(chunk)
+
+    def _read_all(self, files, results):
+        # files: list of (path, file). Every file gets chunks in file order
+        # then None.
+        try:
+            heap = []
+            for file_id, (_, f) in enumerate(files):
+                if hasattr(f, "extends"):
+                    self._push(heap, file_id, f, 0, f.filesize)
+                else:
+                    if f.filesize:
+                        self._dispatch(file_id, bytes(f.read_at(0, f.filesize)))
+                    self._finish(file_id)
+
+            while heap and not self.cancelled:
+                _, file_id, i, remaining = heapq.heappop(heap)
+                f = files[file_id][1]
+                start, count = f.extends[i]
+                size = min(remaining, count * self.block_size)
+                done = 0
+                while done < size and not self.cancelled:
+                    n = min(size - done, self.chunk_blocks * self.block_size)
+                    if start is None:
+                        data = bytes(n)
+                    else:
+                        first = done // self.block_size
+                        blocks = (n + self.block_size - 1) // self.block_size
+                        buf = bytearray(blocks * self.block_size)
+                        self.vfs.readinto(start + first, buf)
+                        data = memoryview(buf)[:n]
+                        self.bytes_read += len(buf)
+                    self._dispatch(file_id, data)
+                    done += n
+
+                self._push(heap, file_id, f, i + 1, remaining - size)
+        except Exception as e:
+            results.put((None, None, e))
+        finally:
+            for q in self.queues:
+                q.put((None, None))
+
+    def _push(self, heap, file_id, f, i, remaining):
+        # Queues extent i of f, or ends the file.
+        if remaining > 0 and i < len(f.extends):
+            start = f.extends[i][0]
+            heapq.heappush(heap, (-1 if start is None else start, file_id, i, remaining))
+        else:
+            self._finish(file_id)
+
+    def _finish(self, file_id):
+        for q in self.queues:
+            q.put((file_id, None))
+
+    def run(self, files=None):
+        # Yields {"path", "size", <algorithm>: hexdigest, ...} per file, in
+        # the order files complete.
+        files = list(iter_files(self.vfs) if files is None else files)
+        results = queue.Queue()
+        self.queues = [queue.Queue() for _ in self.algorithms]
+        workers = [threading.Thread(target=self._hash_worker, args=(name, q, results))
+                   for name, q in zip(self.algorithms, self.queues)]
+        reader = threading.Thread(target=self._read_all, args=(files, results))
+
+        self.started = time.monotonic()
+        for t in workers + [reader]:
+            t.daemon = True
+            t.start()
+
+        pending = {}
+        try:
+            while self.files_done < len(files):
+                file_id, name, digest = results.get()
+                if file_id is None:
+                    raise digest
+
+                row = pending.setdefault(file_id, {})
+                row[name] = digest
+                if len(row) < len(self.algorithms):
+                    continue
+
+                del pending[file_id]
+                path, f = files[file_id]
+                self.files_done += 1
+                self.bytes_hashed += f.filesize
+                out = {"path": path, "size": f.filesize}
+                for algorithm in self.algorithms:
+                    out[algorithm] = row[algorithm]
+                yield out
+        finally:
+            self.cancelled = True
+            reader.join()
+            for t in workers:
+                t.join()
+            self.finished = time.monotonic()
+
+    def stats(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        elapsed = end - self.started if self.started is not None else 0
+        return {
+            "files": self.files_done,
+            "bytes_hashed": self.bytes_hashed,
+            "bytes_read": self.bytes_read,
+            "seconds": elapsed,
+            "mib_per_second": self.bytes_read / (1024 * 1024) / elapsed if elapsed else 0
+        }
+
+    def report(self):
+        s = self.stats()
+        return "{files} files, {bytes_hashed} bytes in {seconds:.2f}s ({mib_per_second:.1f} MiB/s)".format(**s)
+
+
+def write_jsonl(rows, f):
+    for row in rows:
+        f.write(json.dumps(row) + "\n")
+
+
+def write_csv(rows, f, algorithms=DEFAULT_ALGORITHMS):
+    writer = csv.DictWriter(f, fieldnames=OUTPUT_FIELDS + tuple(algorithms))
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+
+if __name__ == '__main__':
+    from vpartition import open_partitions
+
+    for partition in open_partitions(sys.argv[1]):
+        if partition['vfs'] is None:
+            continue
+        hasher = VolumeHasher(partition['vfs'])
+        write_jsonl(hasher.run(), sys.stdout)
+        print(hasher.report(), file=sys.stderr)
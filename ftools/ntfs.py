@@ -1,14 +1,49 @@
+import os
 import sys
 import struct
+import bisect
+import re
+from array import array
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from vfs import VFS
-from vdrive import Drive
-from vfile import BlockFile
+from vdrive import Drive, worker_factory
+from vfile import BlockFile, MemoryFile
 from schema import Schema
 from utils import Utils
 
 
+ATTR_STANDARD_INFORMATION = 0x10
+ATTR_FILE_NAME = 0x30
 ATTR_DATA = 0x80
-ATTR_INDEX_ALLOCATION = 0x90
+ATTR_INDEX_ROOT = 0x90
+ATTR_INDEX_ALLOCATION = 0xA0
+ATTR_END = 0xFFFFFFFF
+
+MFT_RECORD_IN_USE = 0x01
+MFT_RECORD_IS_DIRECTORY = 0x02
+MFT_REF_MASK = 0xFFFFFFFFFFFF
+MFT_RECORD_ROOT = 5
+MFT_RECORD_BITMAP = 6
+MFT_RECORD_UPCASE = 10
+MFT_SCAN_CHUNK = 4 * 1024 * 1024
+MFT_SHARD_RECORDS = 64 * 1024
+# Update sequence strides are 512 bytes whatever the sector size.
+FIXUP_STRIDE = 512
+# Bytes of $Bitmap with at least one free cluster; inside them, runs of
+# free bytes or single mixed bytes.
+BITMAP_NOT_FULL = re.compile(b"[^\xff]+")
+BITMAP_FREE_OR_MIXED = re.compile(b"\x00+|[^\x00]")
+
+FILE_NAME_NAMESPACE_DOS = 2
+
+INDEX_NAME = "$I30"
+INDEX_ENTRY_SUBNODE = 0x01
+INDEX_ENTRY_LAST = 0x02
+# Index VCNs count clusters, or 512 byte blocks when index records are
+# smaller than a cluster.
+INDEX_BLOCK_SIZE = 512
+INDEX_NODE_CACHE = 1024
 
 def to_decode(byte_arr, decoding):
     if len(byte_arr) == 0:
@@ -23,9 +58,172 @@ def to_euc_kr(byte_arr):
     return to_decode(byte_arr, 'euc-kr')
 
 
+class RunList(object):
+    SPARSE = -1
+
+    # Decoded runs in two arrays plus the starting VCN of every run
+    # (vcns[i]; vcns[-1] is the total cluster count). Iterating yields
+    # (lcn, length) like a plain extent list, with lcn None for sparse runs.
+    def __init__(self, runs=()):
+        self.lcns = array('q')
+        self.lengths = array('q')
+        self.vcns = array('q', [0])
+        for lcn, length in runs:
+            self.append(lcn, length)
+
+    def append(self, lcn, length):
+        self.lcns.append(self.SPARSE if lcn is None else lcn)
+        self.lengths.append(length)
+        self.vcns.append(self.vcns[-1] + length)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, i):
+        lcn = self.lcns[i]
+        return (None if lcn == self.SPARSE else lcn, self.lengths[i])
+
+    def __iter__(self):
+        for i in range(len(self.lengths)):
+            yield self[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def cluster_count(self):
+        return self.vcns[-1]
+
+    def find(self, vcn):
+        # Index of the run holding vcn.
+        return bisect.bisect_right(self.vcns, vcn) - 1
+
+
+def _vbr_schema():
+    vbr_desc = Schema()
+    vbr_desc.add("oem_name", 3, 8, dtype="str")
+    vbr_desc.add("bps", 11, 2)
+    vbr_desc.add("spc", 13, 1)
+    vbr_desc.add("total_sectors", 40, 8)
+    vbr_desc.add("mft", 48, 8)
+    vbr_desc.add("mftmirr", 56, 4)
+    vbr_desc.add("mft_entry_size", 64, 1)
+    vbr_desc.add("index_record_size", 68, 1)
+    return vbr_desc
+
+def _mft_schema():
+    mft_desc = Schema()
+    mft_desc.add("signature", 0, 4, dtype="str")
+    mft_desc.add("offset_fixup_array", 4, 2)
+    mft_desc.add("count_of_fixup_array", 6, 2)
+    mft_desc.add("lsn", 8, 8)
+    mft_desc.add("seq_value", 16, 2)
+    mft_desc.add("hard_link_count", 18, 2)
+    mft_desc.add("offset_first_attr", 20, 2)
+    mft_desc.add("flags", 22, 2)
+    mft_desc.add("used_size_of_mft_etnry", 24, 4)
+    mft_desc.add("allocated_size_of_mft_entry", 28, 4)
+    mft_desc.add("file_ref_to_base", 32, 8)
+    mft_desc.add("next_attr_id", 40, 2)
+    return mft_desc
+
+def _attr_header_schema():
+    attr_desc = Schema()
+    attr_desc.add("attr_type_id", 0, 4)
+    attr_desc.add("length", 4, 4)
+    attr_desc.add("non-resident", 8, 1)
+    attr_desc.add("name_len", 9, 1)
+    attr_desc.add("offset_name", 10, 2)
+    attr_desc.add("flags", 12, 2)
+    attr_desc.add("attr_id", 14, 2)
+    return attr_desc
+
+def _resident_attr_schema():
+    attr_desc = Schema()
+    attr_desc.add("content_size", 16, 4)
+    attr_desc.add("content_offset", 20, 2)
+    attr_desc.add("indexed_flag", 22, 1)
+    return attr_desc
+
+def _non_resident_attr_schema():
+    attr_desc = Schema()
+    attr_desc.add("start_vcn", 16, 8)
+    attr_desc.add("end_vcn", 24, 8)
+    attr_desc.add("runlists_offset", 32, 2)
+    attr_desc.add("comp_unit_size", 34, 2)
+    attr_desc.add("alloc_size", 40, 8)
+    attr_desc.add("real_size", 48, 8)
+    attr_desc.add("init_size", 56, 8)
+    return attr_desc
+
+def _standard_information_schema():
+    desc = Schema()
+    desc.add("ctime", 0, 8)
+    desc.add("mtime", 8, 8)
+    desc.add("mft_mtime", 16, 8)
+    desc.add("atime", 24, 8)
+    desc.add("flags", 32, 4)
+    return desc
+
+def _file_name_schema():
+    desc = Schema()
+    desc.add("parent_ref", 0, 8)
+    desc.add("ctime", 8, 8)
+    desc.add("mtime", 16, 8)
+    desc.add("mft_mtime", 24, 8)
+    desc.add("atime", 32, 8)
+    desc.add("alloc_size", 40, 8)
+    desc.add("real_size", 48, 8)
+    desc.add("flags", 56, 4)
+    desc.add("name_len", 64, 1)
+    desc.add("namespace", 65, 1)
+    desc.add("name", 66, "name_len", dtype="str",
+             len_func=lambda v: v * 2, transform=to_ucs2_le)
+    return desc
+
+def _index_root_schema():
+    desc = Schema()
+    desc.add("attr_type", 0, 4)
+    desc.add("collation_rule", 4, 4)
+    desc.add("index_record_size", 8, 4)
+    desc.add("clusters_per_index_record", 12, 1)
+    return desc
+
+def _index_node_schema():
+    desc = Schema()
+    desc.add("entries_offset", 0, 4)
+    desc.add("index_size", 4, 4)
+    desc.add("alloc_size", 8, 4)
+    desc.add("flags", 12, 1)
+    return desc
+
+def _index_entry_schema():
+    desc = Schema()
+    desc.add("file_ref", 0, 8)
+    desc.add("length", 8, 2)
+    desc.add("content_length", 10, 2)
+    desc.add("flags", 12, 4)
+    return desc
+
+
 class NTFS(VFS):
+    VBR = _vbr_schema()
+    MFT_HEADER = _mft_schema()
+    ATTR_HEADER = _attr_header_schema()
+    RESIDENT_ATTR = _resident_attr_schema()
+    NON_RESIDENT_ATTR = _non_resident_attr_schema()
+    STANDARD_INFORMATION = _standard_information_schema()
+    FILE_NAME = _file_name_schema()
+    INDEX_ROOT = _index_root_schema()
+    INDEX_NODE = _index_node_schema()
+    INDEX_ENTRY = _index_entry_schema()
+
     def __init__(self, drive):
         super(NTFS, self).__init__(drive)
+        self.upcase = None
+        self.index_nodes = OrderedDict()
         self.get_vbr_info()
 
     def get_vbr_info(self):
@@ -37,8 +235,8 @@ class NTFS(VFS):
         self.size = self.vbr["total_sectors"]
         self.mftsize = self.get_mft_entry_size(self.vbr["mft_entry_size"])
         mft0 = self.parse_mft(self.mft)
-        bfile = self.get_attr_datafile(mft0, ATTR_DATA, 0)
-        print(self.vbr)
+        self.mft_file = self.get_attr_datafile(mft0, ATTR_DATA)
+        self.record_count = self.mft_file.filesize // self.mftsize
 
     def get_mft_entry_size(self, v):
         if v < 0x80:
@@ -47,56 +245,99 @@ class NTFS(VFS):
             return pow(2, 256-v)
 
     def parse_vbr(self, data):
-        vbr_desc = Schema()
-        vbr_desc.add("oem_name", 3, 8, dtype="str")
-        vbr_desc.add("bps", 11, 2)
-        vbr_desc.add("spc", 13, 1)
-        vbr_desc.add("total_sectors", 40, 8)
-        vbr_desc.add("mft", 48, 8)
-        vbr_desc.add("mftmirr", 56, 4)
-        vbr_desc.add("mft_entry_size", 64, 1)
-        vbr_desc.add("index_record_size", 68, 1)
-
-        return Utils.schema_to_map(vbr_desc, data, endian=Utils.LITTLE_ENDIAN)
+        return Utils.schema_to_map(self.VBR, data, endian=Utils.LITTLE_ENDIAN)
 
     def parse_mft(self, start_mft):
-        data = self.read(start_mft)
-        mft_desc = Schema()
-        mft_desc.add("signature", 0, 4, dtype="str")
-        mft_desc.add("offset_fixup_array", 4, 2)
-        mft_desc.add("count_of_fixup_array", 6, 2)
-        mft_desc.add("lsn", 8, 8)
-        mft_desc.add("seq_value", 16, 2)
-        mft_desc.add("hard_link_count", 18, 2)
-        mft_desc.add("offset_first_attr", 20, 2)
-        mft_desc.add("flags", 22, 2)
-        mft_desc.add("used_size_of_mft_etnry", 24, 4)
-        mft_desc.add("allocated_size_of_mft_entry", 28, 4)
-        mft_desc.add("file_ref_to_base", 32, 8)
-        mft_desc.add("next_attr_id", 40, 2)
-
-        mft = Utils.schema_to_map(mft_desc, data, endian=Utils.LITTLE_ENDIAN)
-
-        fixup_start = 510
-        fixup_array = mft["offset_fixup_array"]+2
-        for i in range(mft["count_of_fixup_array"]):
-            data[fixup_start] = data[fixup_array]
-            data[fixup_start+1] = data[fixup_array+1]
-            fixup_start += 512
-
-        return self.parse_attrs(data, mft["offset_first_attr"])
-            
+        # The fixup pass patches the record in place, so work on a copy.
+        data = bytearray(self.read(start_mft))
+        mft = Utils.schema_to_map(self.MFT_HEADER, data, endian=Utils.LITTLE_ENDIAN)
+        self.apply_fixup(data, 0)
+
+        return self.parse_attrs(data, mft["offset_first_attr"], self.mftsize)
+
+    def apply_fixup(self, data, offset, size=None):
+        # Puts the original last two bytes of every 512 byte stride of the
+        # size byte record at offset (an MFT record by default) back from the
+        # update sequence array. Returns False if a stride did not carry the
+        # update sequence number (torn write) or if the array does not fit
+        # the record; nothing past the record is ever written.
+        if size is None:
+            size = self.mftsize
+        fixup, count = struct.unpack_from("<HH", data, offset + 4)
+        if (count != size // FIXUP_STRIDE + 1 or fixup + 2 * count > size or
+                offset + size > len(data)):
+            return False
+
+        fixup += offset
+        usn = data[fixup:fixup + 2]
+        valid = True
+
+        end = offset + FIXUP_STRIDE - 2
+        for i in range(1, count):
+            if data[end:end + 2] != usn:
+                valid = False
+            data[end:end + 2] = data[fixup + 2 * i:fixup + 2 * i + 2]
+            end += FIXUP_STRIDE
+
+        return valid
+
+    def read_records(self, number, count=1):
+        # Records [number, number + count) of $MFT in a fresh buffer, ready
+        # for fixups.
+        return self.mft_file.read_at(number * self.mftsize, count * self.mftsize)
+
+    def parse_record(self, data, offset, number):
+        if len(data) < offset + self.mftsize or data[offset:offset + 4] != b"FILE":
+            return None
+
+        record = Utils.schema_to_map(self.MFT_HEADER, data,
+                                     endian=Utils.LITTLE_ENDIAN, base_offset=offset)
+        record["number"] = number
+        record["valid"] = self.apply_fixup(data, offset)
+        record["in_use"] = bool(record["flags"] & MFT_RECORD_IN_USE)
+        record["is_directory"] = bool(record["flags"] & MFT_RECORD_IS_DIRECTORY)
+
+        attrs = self.parse_attrs(data, offset + record["offset_first_attr"],
+                                 offset + self.mftsize)
+        record["attrs"] = attrs
+        record["standard_information"] = None
+        record["file_names"] = []
+        record["data"] = None
+
+        for attr in attrs:
+            type_id = attr["attr_type_id"]
+            if type_id == ATTR_STANDARD_INFORMATION and "value" in attr:
+                record["standard_information"] = attr["value"]
+            elif type_id == ATTR_FILE_NAME and "value" in attr:
+                record["file_names"].append(attr["value"])
+            elif type_id == ATTR_DATA and attr["name_len"] == 0:
+                record["data"] = attr
+
+        return record
+
+    def read_record(self, number):
+        return self.parse_record(self.read_records(number), 0, number)
+
+    def scan_mft(self, start=0, count=None, chunk_size=MFT_SCAN_CHUNK):
+        # Streams the FILE records of $MFT, reading chunk_size bytes of
+        # records at a time through the $MFT runlist.
+        end = self.record_count if count is None else min(self.record_count, start + count)
+        per_chunk = max(1, chunk_size // self.mftsize)
+
+        number = start
+        while number < end:
+            n = min(per_chunk, end - number)
+            data = self.read_records(number, n)
+            for i in range(n):
+                record = self.parse_record(data, i * self.mftsize, number + i)
+                if record is not None:
+                    yield record
+
+            number += n
+
     def parse_attr_header(self, data, offset):
-        attr_desc = Schema()
-        attr_desc.add("attr_type_id", offset, 4)
-        attr_desc.add("length", offset+4, 4)
-        attr_desc.add("non-resident", offset+8, 1)
-        attr_desc.add("name_len", offset+9, 1)
-        attr_desc.add("offset_name", offset+10, 2)
-        attr_desc.add("flags", offset+12, 2)
-        attr_desc.add("attr_id", 14, 2)
-
-        attr = Utils.schema_to_map(attr_desc, data, endian=Utils.LITTLE_ENDIAN)
+        attr = Utils.schema_to_map(self.ATTR_HEADER, data,
+                                   endian=Utils.LITTLE_ENDIAN, base_offset=offset)
         return attr
 
     def copy_map(self, src, tar):
@@ -104,85 +345,350 @@ class NTFS(VFS):
             tar[key] = src[key]
 
     def parse_resident_attr(self, data, offset, attr):
-        attr_desc = Schema()
-        attr_desc.add("content_size", offset+16, 4)
-        attr_desc.add("content_offset", offset+20, 2)
-        attr_desc.add("indexed_flag", offset+22, 1)
-
-        attr2 = Utils.schema_to_map(attr_desc, data, endian=Utils.LITTLE_ENDIAN)
+        attr2 = Utils.schema_to_map(self.RESIDENT_ATTR, data,
+                                    endian=Utils.LITTLE_ENDIAN, base_offset=offset)
         self.copy_map(attr2, attr)
  
         return attr
         
     def parse_non_resident_attr(self, data, offset, attr):
-        attr_desc = Schema()
-        attr_desc.add("start_vcn", offset+16, 8)
-        attr_desc.add("end_vcn", offset+24, 8)
-        attr_desc.add("runlists_offset", offset+32, 2)
-        attr_desc.add("comp_unit_size", offset+34, 2)
-        attr_desc.add("alloc_size", offset+40, 8)
-        attr_desc.add("real_size", offset+48, 8)
-        attr_desc.add("init_size", offset+56, 8)
-
-        attr2 = Utils.schema_to_map(attr_desc, data, endian=Utils.LITTLE_ENDIAN)
+        attr2 = Utils.schema_to_map(self.NON_RESIDENT_ATTR, data,
+                                    endian=Utils.LITTLE_ENDIAN, base_offset=offset)
         self.copy_map(attr2, attr)
 
         runlists = self.parse_runlists(data, offset + attr2["runlists_offset"])
         attr["runlists"] = runlists
         return attr
 
-    def parse_runlists_value(self, v):
-        k = 1
-        ret = 0
-        for i in v:
-            ret += i * k
-            k *= 256
-
-        return ret
+    def parse_runlists_value(self, v, signed=False):
+        return int.from_bytes(v, 'little', signed=signed)
 
     def parse_runlists(self, data, offset):
-        runlists = []
+        # Run offsets are signed deltas from the previous run's LCN; a run
+        # without an offset field is sparse.
+        runlists = RunList()
         pos = offset
-        base_offset = 0
-        while True:
-            if data[pos] == 0:
+        lcn = 0
+        end = len(data)
+        while pos < end:
+            header = data[pos]
+            if header == 0:
                 break
-            offset_size = (data[pos] & 0xF0) >> 4
-            len_size = (data[pos] & 0x0F)
-            
-            l = self.parse_runlists_value(data[pos+1:pos+1+len_size])
-            offset = self.parse_runlists_value(data[pos+1+len_size:pos+1+len_size+offset_size])
-            base_offset += offset
+            offset_size = header >> 4
+            len_size = header & 0x0F
+
+            value = pos + 1 + len_size
+            l = self.parse_runlists_value(data[pos+1:value])
+            if offset_size == 0:
+                runlists.append(None, l)
+            else:
+                lcn += self.parse_runlists_value(data[value:value+offset_size], True)
+                runlists.append(lcn, l)
 
-            pos = pos + 1 + (offset_size + len_size)
-            runlists.append((base_offset, l))
+            pos = value + offset_size
 
         return runlists
 
-    def get_attr_datafile(self, attrs, attr_type_id, attr_id):
+    def get_attr_datafile(self, attrs, attr_type_id, attr_id=None):
         for attr in attrs:
-            if attr['attr_type_id'] == attr_type_id and attr['attr_id'] == attr_id:
-                return self.get_runlists_file(attr['runlists'])
+            if attr['attr_type_id'] != attr_type_id:
+                continue
+            if attr_id is None or attr['attr_id'] == attr_id:
+                return self.get_runlists_file(attr['runlists'], attr['real_size'])
 
         raise Exception("No attr ({}:{})".format(attr_type_id, attr_id))
 
-    def get_runlists_file(self, runlists):
-        return BlockFile(self, -1, runlists)
+    def get_runlists_file(self, runlists, filesize=-1):
+        return BlockFile(self, filesize, runlists)
 
     def parse_index_allocation(self, data, attr):
-        import pdb; pdb.set_trace()
-        datafile = self.get_runlists_file(attr['runlists'])
+        return self.get_runlists_file(attr['runlists'], attr['real_size'])
+
+    def load_upcase(self):
+        # $UpCase maps every UTF-16 code unit to its upper case; names are
+        # collated on it. Volumes without a readable one fall back to
+        # str.upper().
+        try:
+            upcase = self.get_attr_datafile(self.read_record(MFT_RECORD_UPCASE)["attrs"],
+                                            ATTR_DATA)
+            table = array('H', bytes(upcase.read_at(0, 0x20000)))
+            if sys.byteorder == 'big':
+                table.byteswap()
+        except Exception:
+            table = array('H')
+
+        if len(table) < 0x10000:
+            table = array('H', (ord(c.upper()) if len(c.upper()) == 1 else ord(c)
+                                for c in map(chr, range(0x10000))))
+        self.upcase = table
+        return table
+
+    def collate(self, name):
+        upcase = self.upcase if self.upcase is not None else self.load_upcase()
+        units = array('H', name.encode('utf-16-le', 'surrogatepass'))
+        if sys.byteorder == 'big':
+            units.byteswap()
+
+        return tuple(upcase[u] for u in units)
+
+    def _parse_index_node(self, data, offset):
+        # Entries of the node whose header is at offset: ref, flags, the
+        # child VCN (None without one) and, but for the last entry, the
+        # $FILE_NAME value with the collation key of its name.
+        node = Utils.schema_to_map(self.INDEX_NODE, data, endian=Utils.LITTLE_ENDIAN,
+                                   base_offset=offset)
+        pos = offset + node["entries_offset"]
+        end = min(len(data), offset + node["index_size"])
+
+        entries = []
+        while pos + 16 <= end:
+            entry = Utils.schema_to_map(self.INDEX_ENTRY, data, endian=Utils.LITTLE_ENDIAN,
+                                        base_offset=pos)
+            if entry["length"] < 16:
+                break
+
+            entry["ref"] = entry["file_ref"] & MFT_REF_MASK
+            entry["subnode"] = None
+            if entry["flags"] & INDEX_ENTRY_SUBNODE:
+                entry["subnode"] = struct.unpack_from("<Q", data, pos + entry["length"] - 8)[0]
+
+            entry["value"] = None
+            if not entry["flags"] & INDEX_ENTRY_LAST and entry["content_length"]:
+                entry["value"] = Utils.schema_to_map(self.FILE_NAME, data,
+                                                     endian=Utils.LITTLE_ENDIAN,
+                                                     base_offset=pos + 16)
+                entry["key"] = self.collate(entry["value"]["name"])
+
+            entries.append(entry)
+            if entry["flags"] & INDEX_ENTRY_LAST:
+                break
+            pos += entry["length"]
+
+        return entries
+
+    def _cache_node(self, key, node):
+        self.index_nodes[key] = node
+        while len(self.index_nodes) > INDEX_NODE_CACHE:
+            self.index_nodes.popitem(last=False)
+
+    def read_index_root(self, number):
+        # (entries of $INDEX_ROOT, $INDEX_ALLOCATION file or None, index
+        # record size) of the $I30 index of directory record number.
+        key = (number, None)
+        node = self.index_nodes.get(key)
+        if node is not None:
+            self.index_nodes.move_to_end(key)
+            return node
+
+        data = self.read_records(number)
+        record = self.parse_record(data, 0, number)
+        if record is None or not record["is_directory"]:
+            raise Exception("Not a directory: MFT record {}".format(number))
+
+        entries = None
+        allocation = None
+        record_size = 0
+        for attr in record["attrs"]:
+            if attr["name"] != INDEX_NAME:
+                continue
+            if attr["attr_type_id"] == ATTR_INDEX_ROOT:
+                content = attr["offset"] + attr["content_offset"]
+                root = Utils.schema_to_map(self.INDEX_ROOT, data,
+                                           endian=Utils.LITTLE_ENDIAN, base_offset=content)
+                record_size = root["index_record_size"]
+                entries = self._parse_index_node(data, content + 16)
+            elif attr["attr_type_id"] == ATTR_INDEX_ALLOCATION:
+                allocation = self.parse_index_allocation(data, attr)
+
+        if entries is None:
+            raise Exception("No $I30 index: MFT record {}".format(number))
+
+        node = (entries, allocation, record_size)
+        self._cache_node(key, node)
+        return node
+
+    def read_index_node(self, number, vcn):
+        # Entries of the INDX record at vcn of directory number, read through
+        # the $INDEX_ALLOCATION runlist with fixups applied.
+        key = (number, vcn)
+        entries = self.index_nodes.get(key)
+        if entries is not None:
+            self.index_nodes.move_to_end(key)
+            return entries
+
+        _, allocation, record_size = self.read_index_root(number)
+        if allocation is None:
+            raise Exception("No $INDEX_ALLOCATION: MFT record {}".format(number))
+
+        cluster_size = self.spc * self.bps
+        unit = cluster_size if record_size >= cluster_size else INDEX_BLOCK_SIZE
+        data = allocation.read_at(vcn * unit, record_size)
+        if len(data) < record_size or data[0:4] != b"INDX":
+            raise Exception("Bad INDX record at VCN {}: MFT record {}".format(vcn, number))
+
+        self.apply_fixup(data, 0, record_size)
+        entries = self._parse_index_node(data, 24)
+        self._cache_node(key, entries)
+        return entries
+
+    def find_index_entry(self, number, name):
+        # B+tree descent through the $I30 index of directory number: in
+        # every node, the first entry not below name is either name itself
+        # or the one whose child holds it.
+        key = self.collate(name)
+        entries = self.read_index_root(number)[0]
+
+        while True:
+            for entry in entries:
+                if entry["value"] is not None:
+                    if entry["key"] == key:
+                        return entry
+                    if entry["key"] < key:
+                        continue
+
+                if entry["subnode"] is None:
+                    return None
+                entries = self.read_index_node(number, entry["subnode"])
+                break
+            else:
+                return None
+
+    def iter_index(self, number):
+        # Every entry of the $I30 index of directory number, in collation
+        # order.
+        return self._iter_index_node(number, self.read_index_root(number)[0])
+
+    def _iter_index_node(self, number, entries):
+        for entry in entries:
+            if entry["subnode"] is not None:
+                for child in self._iter_index_node(number,
+                                                   self.read_index_node(number, entry["subnode"])):
+                    yield child
+            if entry["value"] is not None:
+                yield entry
+
+    def _lookup_number(self, path):
+        number = MFT_RECORD_ROOT
+        for name in [p for p in path.replace("/", "\\").split("\\") if p]:
+            entry = self.find_index_entry(number, name)
+            if entry is None:
+                raise Exception("No such file: " + path)
+            number = entry["ref"]
+
+        return number
+
+    def lookup(self, path):
+        return self.read_record(self._lookup_number(path))
+
+    def list_dir(self, path):
+        # 8.3 aliases of long names are left out.
+        return [entry for entry in self.iter_index(self._lookup_number(path))
+                if entry["value"]["namespace"] != FILE_NAME_NAMESPACE_DOS]
+
+    def data_file(self, record, stream=""):
+        # The $DATA attribute named stream ("" for the file contents) of
+        # record, as a BlockFile, or a MemoryFile when resident; None if
+        # the record has no such attribute.
+        for attr in record["attrs"]:
+            if attr["attr_type_id"] != ATTR_DATA or attr["name"] != stream:
+                continue
+            if attr["non-resident"]:
+                return self.get_runlists_file(attr["runlists"], attr["real_size"])
+
+            return MemoryFile(attr["value"])
+
+        return None
+
+    def open(self, path, stream=""):
+        f = self.data_file(self.lookup(path), stream)
+        if f is None:
+            raise Exception("No data: " + path)
+
+        return f
+
+    def file_name(self, record):
+        # The $FILE_NAME of record to show: Win32 names before 8.3 aliases.
+        names = record["file_names"]
+        for name in names:
+            if name["namespace"] != FILE_NAME_NAMESPACE_DOS:
+                return name
+
+        return names[0] if names else None
+
+    def walk(self):
+        # Every named, in-use base record below the root, in record order,
+        # with its path ("/" separated) in record["path"]. Paths are put
+        # together from $FILE_NAME parent references once the whole $MFT
+        # has been scanned; records whose parents do not lead to the root
+        # are left out.
+        records = {}
+        for record in self.scan_mft():
+            if not record["in_use"] or record["file_ref_to_base"] & MFT_REF_MASK:
+                continue
+
+            name = self.file_name(record)
+            if name is not None:
+                record["name"] = name
+                records[record["number"]] = record
+
+        paths = {MFT_RECORD_ROOT: ""}
+        for number in sorted(records):
+            chain = []
+            n = number
+            while n not in paths and n in records and n not in chain:
+                chain.append(n)
+                n = records[n]["name"]["parent"]
+            if n not in paths:
+                continue
+
+            path = paths[n]
+            for n in reversed(chain):
+                path = path + "/" + records[n]["name"]["name"]
+                paths[n] = path
+
+            if number != MFT_RECORD_ROOT:
+                record = records[number]
+                record["path"] = paths[number]
+                yield record
 
     def _parse_attr(self, data, attr):
-        if attr["attr_type_id"] == ATTR_INDEX_ALLOCATION:
-            self.parse_index_allocation(data, attr)
-        
-    def parse_attrs(self, data, offset):
+        if attr["non-resident"] != 0:
+            return
+
+        if attr["attr_type_id"] == ATTR_DATA:
+            content = attr["offset"] + attr["content_offset"]
+            attr["value"] = bytes(data[content:content + attr["content_size"]])
+            return
+        elif attr["attr_type_id"] == ATTR_STANDARD_INFORMATION:
+            desc = self.STANDARD_INFORMATION
+        elif attr["attr_type_id"] == ATTR_FILE_NAME:
+            desc = self.FILE_NAME
+        else:
+            return
+
+        content = attr["offset"] + attr["content_offset"]
+        attr["value"] = Utils.schema_to_map(desc, data, endian=Utils.LITTLE_ENDIAN,
+                                            base_offset=content)
+        if attr["attr_type_id"] == ATTR_FILE_NAME:
+            attr["value"]["parent"] = attr["value"]["parent_ref"] & MFT_REF_MASK
+
+    def parse_attrs(self, data, offset, end=None):
+        if end is None:
+            end = len(data)
+
         attrs = []
-        while True:
+        while offset + 16 <= end:
             attr = self.parse_attr_header(data, offset)
-            if attr["length"] == 0:
+            if attr["attr_type_id"] == ATTR_END or attr["length"] == 0:
                 break
+            if offset + attr["length"] > end:
+                break
+
+            attr["offset"] = offset
+            attr["name"] = ""
+            if attr["name_len"]:
+                name = offset + attr["offset_name"]
+                attr["name"] = to_ucs2_le(bytes(data[name:name + attr["name_len"] * 2]))
 
             if attr["non-resident"] == 0:
                 self.parse_resident_attr(data, offset, attr)
@@ -195,10 +701,108 @@ class NTFS(VFS):
 
         return attrs
 
+    def mft_shards(self, shard_records=MFT_SHARD_RECORDS):
+        # Record ranges that follow the $MFT extents: an extent is cut into
+        # pieces of at most shard_records, and pieces of small neighbouring
+        # extents are merged back up to that size.
+        cluster_size = self.get_block_size()
+        shards = []
+        vcn = 0
+        for lcn, length in self.mft_file.extends:
+            first = vcn * cluster_size // self.mftsize
+            vcn += length
+            last = min(self.record_count, vcn * cluster_size // self.mftsize)
+
+            for start in range(first, last, shard_records):
+                count = min(shard_records, last - start)
+                if shards and sum(shards[-1]) == start and shards[-1][1] + count <= shard_records:
+                    shards[-1] = (shards[-1][0], shards[-1][1] + count)
+                else:
+                    shards.append((start, count))
+
+        return shards
+
+    def scan_mft_parallel(self, workers=None, shard_records=MFT_SHARD_RECORDS,
+                          drive_factory=None):
+        # Same records as scan_mft(), parsed by a pool of processes. Every
+        # worker opens the image itself through drive_factory (by default
+        # worker_factory(self.drive)), so only record numbers go to the
+        # workers. Results come back in record order, with at most two
+        # shards per worker outstanding.
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if drive_factory is None:
+            drive_factory = worker_factory(self.drive)
+
+        shards = deque(self.mft_shards(shard_records))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            inflight = deque()
+            while shards or inflight:
+                while shards and len(inflight) < workers * 2:
+                    start, count = shards.popleft()
+                    inflight.append(executor.submit(_scan_mft_shard, drive_factory,
+                                                    start, count))
+
+                for record in inflight.popleft().result():
+                    yield record
+
     def read(self, cluster, count=1):
-        return bytearray(self.drive.read(self.spc * cluster, count * self.spc))
+        return self.drive.read(self.spc * cluster, count * self.spc)
+
+    def read_bitmap(self):
+        # Resident on small volumes.
+        bitmap = self.data_file(self.read_record(MFT_RECORD_BITMAP))
+        if bitmap is None:
+            raise Exception("No $DATA: $Bitmap")
+        return bitmap.read_at(0, bitmap.filesize)
+
+    def free_extends(self):
+        # (lcn, count) runs of clear bits in $Bitmap, bit i of byte n being
+        # cluster 8 * n + i.
+        bitmap = self.read_bitmap()
+        total = self.size // self.spc
+
+        extends = []
+        start = count = 0
+        for region in BITMAP_NOT_FULL.finditer(bitmap):
+            for m in BITMAP_FREE_OR_MIXED.finditer(bitmap, region.start(), region.end()):
+                base = m.start() * 8
+                if bitmap[m.start()] == 0:
+                    bits = [(base, (m.end() - m.start()) * 8)]
+                else:
+                    value = bitmap[m.start()]
+                    bits = [(base + i, 1) for i in range(8) if not value & (1 << i)]
+
+                for lcn, n in bits:
+                    if count and start + count == lcn:
+                        count += n
+                    else:
+                        if count:
+                            extends.append((start, count))
+                        start, count = lcn, n
+
+        if count:
+            extends.append((start, count))
+
+        # The last byte may have bits past the end of the volume.
+        clipped = []
+        for lcn, n in extends:
+            n = min(n, total - lcn)
+            if n > 0:
+                clipped.append((lcn, n))
+
+        return clipped
+
+
+def _scan_mft_shard(drive_factory, start, count):
+    drive = drive_factory()
+    try:
+        return list(NTFS(drive).scan_mft(start, count))
+    finally:
+        drive.close()
 
 
 if __name__ == '__main__':
     vdrive = Drive(sys.argv[1])   
     ntfs = NTFS(vdrive)
+    print(ntfs.vbr)
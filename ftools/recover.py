@@ -0,0 +1,247 @@
+import os
+import re
+import struct
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from vdrive import Drive, worker_factory
+from fat32 import FAT32
+from ntfs import NTFS
+from GPTFinder import GPTFinder
+from utils import Utils
+
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_RANGE_SIZE = 256 * 1024 * 1024
+
+BOOT_SIGNATURE = b"\x55\xaa"
+# One alternation for every signature; the group number tells which one
+# matched and how far into the sector it sits.
+CANDIDATES = re.compile(b"(NTFS    )|(FAT32   )|(EFI PART)")
+CANDIDATE_KINDS = {1: ("ntfs", 3), 2: ("fat32", 82), 3: ("gpt", 0)}
+
+FAT32_BACKUP_BOOT = struct.Struct("<H")
+FAT32_BACKUP_BOOT_OFFSET = 50
+FAT32_DEFAULT_BACKUP_BOOT = 6
+FAT32_MEDIA_ENTRY_MASK = 0x0FFFFF00
+MFT_SIGNATURE = b"FILE"
+
+MBR_TYPES = {"ntfs": 0x07, "fat32": 0x0C}
+MBR_ENTRY = struct.Struct("<B3sB3sII")
+
+
+def find_candidates(buf, base_sector, block_size):
+    # (sector, kind) of every sector of buf that starts like a boot sector
+    # or a GPT header, found with one regex pass over the whole buffer.
+    candidates = []
+    for m in CANDIDATES.finditer(buf):
+        kind, offset = CANDIDATE_KINDS[m.lastindex]
+        pos = m.start() - offset
+        if pos < 0 or pos % block_size:
+            continue
+        if kind != "gpt" and buf[pos + 510:pos + 512] != BOOT_SIGNATURE:
+            continue
+        candidates.append((base_sector + pos // block_size, kind))
+
+    return candidates
+
+
+def scan_range(drive, start, count, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Candidates in sectors [start, start + count), chunk_size bytes per
+    # read into one reused buffer.
+    block_size = drive.get_block_size()
+    chunk_sectors = max(1, chunk_size // block_size)
+    buf = bytearray(chunk_sectors * block_size)
+    view = memoryview(buf)
+
+    candidates = []
+    sector = start
+    end = start + count
+    while sector < end:
+        n = min(chunk_sectors, end - sector)
+        size = drive.readinto(sector, view[:n * block_size])
+        if size <= 0:
+            break
+        candidates.extend(find_candidates(view[:size], sector, block_size))
+        sector += n
+
+    return candidates
+
+
+def _scan_range(drive_factory, start, count, chunk_size):
+    drive = drive_factory()
+    try:
+        return scan_range(drive, start, count, chunk_size)
+    finally:
+        drive.close()
+
+
+class PartitionScanner(object):
+    # Looks for lost FAT32 and NTFS volumes and GPT headers anywhere on a
+    # disk, without trusting its partition tables.
+    #
+    # The disk is cut into ranges of range_size bytes scanned by a pool of
+    # processes (each reopening the image through drive_factory); a range
+    # is read in chunks of chunk_size bytes and every sector-aligned
+    # candidate of a chunk is found at once. Only the few candidates are
+    # then checked here: a boot sector must agree with its backup copy or
+    # lead to the volume's own structures (the FAT, $MFT), which also
+    # tells a primary boot sector from a backup whose primary was wiped.
+    def __init__(self, drive, workers=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                 range_size=DEFAULT_RANGE_SIZE, drive_factory=None):
+        if isinstance(drive, str):
+            drive = Drive(drive)
+        self.drive = drive
+        self.block_size = drive.get_block_size()
+        self.sectors = drive.get_size() // self.block_size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.range_sectors = max(1, range_size // self.block_size)
+        self.drive_factory = drive_factory
+
+    def ranges(self):
+        return [(start, min(self.range_sectors, self.sectors - start))
+                for start in range(0, self.sectors, self.range_sectors)]
+
+    def candidates(self):
+        if self.workers <= 1:
+            for start, count in self.ranges():
+                for candidate in scan_range(self.drive, start, count, self.chunk_size):
+                    yield candidate
+            return
+
+        drive_factory = self.drive_factory or worker_factory(self.drive)
+        ranges = deque(self.ranges())
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            inflight = deque()
+            while ranges or inflight:
+                while ranges and len(inflight) < self.workers * 2:
+                    start, count = ranges.popleft()
+                    inflight.append(executor.submit(_scan_range, drive_factory,
+                                                    start, count, self.chunk_size))
+
+                for candidate in inflight.popleft().result():
+                    yield candidate
+
+    def _read(self, sector, count=1):
+        if sector < 0 or sector >= self.sectors:
+            return b""
+        return self.drive.read(sector, count)
+
+    def _to_sectors(self, count, bps):
+        # Volume sectors (bps bytes) to disk sectors.
+        return count * bps // self.block_size
+
+    def check_ntfs(self, sector):
+        boot = self._read(sector)
+        if len(boot) < self.block_size:
+            return None
+        vbr = Utils.schema_to_map(NTFS.VBR, boot, endian=Utils.LITTLE_ENDIAN)
+        if not vbr["bps"] or not vbr["spc"]:
+            return None
+        total = self._to_sectors(vbr["total_sectors"], vbr["bps"])
+        mft = self._to_sectors(vbr["mft"] * vbr["spc"], vbr["bps"])
+
+        # The backup boot sector is the last sector of the volume, right
+        # after the total_sectors it describes.
+        for start, found in ((sector, "primary"), (sector - total, "backup")):
+            if self._read(start + mft)[:4] != MFT_SIGNATURE:
+                continue
+            other = start + total if found == "primary" else start
+            return {
+                "type": "ntfs",
+                "lba": start,
+                "size": total + 1,
+                "found": found,
+                "verified": self._read(other) == boot
+            }
+
+        return None
+
+    def check_fat32(self, sector):
+        boot = self._read(sector)
+        if len(boot) < self.block_size:
+            return None
+        vbr = Utils.schema_to_map(FAT32.VBR, boot, endian=Utils.LITTLE_ENDIAN)
+        if not vbr["bps"] or not vbr["spc"]:
+            return None
+        backup = FAT32_BACKUP_BOOT.unpack_from(boot, FAT32_BACKUP_BOOT_OFFSET)[0]
+        backup = self._to_sectors(backup or FAT32_DEFAULT_BACKUP_BOOT, vbr["bps"])
+        rsc = self._to_sectors(vbr["reserved_sector_count"], vbr["bps"])
+
+        # The first FAT entry holds the media byte with every other bit set.
+        for start, found in ((sector, "primary"), (sector - backup, "backup")):
+            fat = self._read(start + rsc)
+            if len(fat) < 4:
+                continue
+            media = struct.unpack_from("<I", fat)[0]
+            if media & FAT32_MEDIA_ENTRY_MASK != FAT32_MEDIA_ENTRY_MASK:
+                continue
+            other = start + backup if found == "primary" else start
+            return {
+                "type": "fat32",
+                "lba": start,
+                "size": self._to_sectors(vbr["total_sectors"], vbr["bps"]),
+                "found": found,
+                "verified": self._read(other) == boot
+            }
+
+        return None
+
+    def check_gpt(self, sector):
+        # The partitions of a GPT header found at the LBA it says it is at,
+        # with a good CRC and entry array. verified: the alternate header is
+        # valid too and points back.
+        finder = GPTFinder(self.drive, self.block_size)
+        table = finder.read_table(sector)
+        if table is None:
+            return None
+
+        header, entries = table
+        alternate = header["backup_gpt_lba"]
+        other = finder.read_table(alternate) if 0 < alternate < self.sectors else None
+        verified = other is not None and other[0]["backup_gpt_lba"] == sector
+        found = "primary" if sector < alternate else "backup"
+
+        return [{
+            "type": "gpt",
+            "lba": entry.lba,
+            "size": entry.size,
+            "partition_type_guid": entry.type_uuid(),
+            "name": entry.name,
+            "found": found,
+            "verified": verified
+        } for entry in entries]
+
+    def scan(self):
+        # Reconstructed partition entries, by LBA, with each volume once
+        # even when both of its boot sectors were found.
+        found = {}
+        for sector, kind in self.candidates():
+            if kind == "gpt":
+                for partition in self.check_gpt(sector) or []:
+                    found.setdefault((partition["lba"], "gpt"), partition)
+                continue
+
+            partition = self.check_ntfs(sector) if kind == "ntfs" else self.check_fat32(sector)
+            if partition is None:
+                continue
+            key = (partition["lba"], partition["type"])
+            if key not in found or partition["found"] == "primary":
+                found[key] = partition
+
+        return [found[key] for key in sorted(found)]
+
+
+def to_mbr_entry(partition, active=False):
+    # A 16 byte MBR partition entry (LBA only, CHS fields set to the
+    # "beyond CHS" value) for a reconstructed FAT32 or NTFS volume.
+    chs = b"\xfe\xff\xff"
+    return MBR_ENTRY.pack(0x80 if active else 0, chs, MBR_TYPES[partition["type"]], chs,
+                          partition["lba"], partition["size"])
+
+
+if __name__ == '__main__':
+    scanner = PartitionScanner(sys.argv[1], workers=os.cpu_count() or 1)
+    for partition in scanner.scan():
+        print(partition)
@@ -0,0 +1,225 @@
+import heapq
+import json
+import struct
+import sys
+from array import array
+from ntfs import MFT_REF_MASK
+
+
+REVMAP_MAGIC = b"FTRMAP01"
+REVMAP_HEADER = struct.Struct("<8sQQ")
+
+
+class ReverseMap(object):
+    # Sector ranges -> owning file, for attributing raw hits.
+    #
+    # Ranges [start, end) are kept in three parallel arrays sorted by start.
+    # The sorted arrays double as an implicit interval tree (as in
+    # cgranges): node i at level k (its k low bits set) covers the ranges
+    # i - 2**k + 1 to i + 2**k - 1 and max_ends[i] is the largest end among
+    # them, so that overlapping ranges (cross-linked clusters, files
+    # sharing a run) are found in O(log n) plus the ranges returned. Ranges
+    # added after the last query are buffered, sorted on their own and
+    # merged in on the next query, so the map can be filled while a volume
+    # is walked and queried at any time.
+    def __init__(self):
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self.owners = array('q')
+        self.max_ends = array('Q')
+        self.max_level = -1
+        self.files = []
+        self.pending = []
+
+    def __len__(self):
+        return len(self.starts) + len(self.pending)
+
+    def add_file(self, file, extents):
+        # extents: (sector, count) runs owned by file (a path, an MFT record
+        # number, anything JSON can store). Returns the file id.
+        owner = len(self.files)
+        self.files.append(file)
+        for sector, count in extents:
+            if count > 0:
+                self.pending.append((sector, sector + count, owner))
+
+        return owner
+
+    def _seal(self):
+        if not self.pending:
+            return
+
+        self.pending.sort()
+        if self.starts and self.pending[0] < (self.starts[-1], self.ends[-1], self.owners[-1]):
+            ranges = heapq.merge(zip(self.starts, self.ends, self.owners), self.pending)
+            self.starts = array('Q')
+            self.ends = array('Q')
+            self.owners = array('q')
+        else:
+            # Walked in disk order: the batch goes after the sealed ranges.
+            ranges = self.pending
+
+        for start, end, owner in ranges:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.owners.append(owner)
+        self.pending = []
+        self._build_max_ends()
+
+    def _build_max_ends(self):
+        # Largest end of every node's subtree, level by level; last is the
+        # largest end below the rightmost node of the level, which stands
+        # in for right children past the end of the arrays.
+        n = len(self.ends)
+        self.max_ends = array('Q', self.ends)
+        self.max_level = -1
+        if not n:
+            return
+
+        last_i = (n - 1) & ~1
+        last = self.ends[last_i]
+        k = 1
+        while 1 << k <= n:
+            x = 1 << (k - 1)
+            for i in range(2 * x - 1, n, 4 * x):
+                right = self.max_ends[i + x] if i + x < n else last
+                self.max_ends[i] = max(self.ends[i], self.max_ends[i - x], right)
+            last_i = last_i - x if last_i >> k & 1 else last_i + x
+            if last_i < n and self.max_ends[last_i] > last:
+                last = self.max_ends[last_i]
+            k += 1
+
+        self.max_level = k - 1
+
+    def find_range(self, sector, count=1):
+        # (start, count, file) of every range sharing a sector with
+        # [sector, sector + count), by start. In-order walk of the implicit
+        # tree skipping subtrees that end before sector or start after the
+        # query; subtrees of up to 15 ranges are scanned.
+        self._seal()
+        n = len(self.starts)
+        end = sector + count
+
+        found = []
+        if not n:
+            return found
+
+        k = self.max_level
+        stack = [(k, (1 << k) - 1, False)]
+        while stack:
+            k, i, left_done = stack.pop()
+            if k <= 3:
+                first = i >> k << k
+                for j in range(first, min(first + (1 << (k + 1)) - 1, n)):
+                    if self.starts[j] >= end:
+                        break
+                    if self.ends[j] > sector:
+                        found.append(j)
+            elif not left_done:
+                stack.append((k, i, True))
+                left = i - (1 << (k - 1))
+                if left >= n or self.max_ends[left] > sector:
+                    stack.append((k - 1, left, False))
+            elif i < n and self.starts[i] < end:
+                if self.ends[i] > sector:
+                    found.append(i)
+                stack.append((k - 1, i + (1 << (k - 1)), False))
+
+        return [(self.starts[i], self.ends[i] - self.starts[i], self.files[self.owners[i]])
+                for i in found]
+
+    def find(self, sector):
+        return self.find_range(sector, 1)
+
+    def owner(self, sector):
+        # The file owning sector, None for a sector no file owns.
+        found = self.find_range(sector, 1)
+        return found[-1][2] if found else None
+
+    def attribute(self, sectors):
+        return [self.owner(sector) for sector in sectors]
+
+    def save(self, path):
+        self._seal()
+        arrays = [self.starts, self.ends, self.owners]
+        files = json.dumps(self.files).encode("utf-8")
+
+        with open(path, "wb") as f:
+            f.write(REVMAP_HEADER.pack(REVMAP_MAGIC, len(self.starts), len(files)))
+            for a in arrays:
+                if sys.byteorder == 'big':
+                    a = array(a.typecode, a)
+                    a.byteswap()
+                a.tofile(f)
+            f.write(files)
+
+    @classmethod
+    def load(cls, path):
+        rmap = cls()
+        with open(path, "rb") as f:
+            magic, count, files_size = REVMAP_HEADER.unpack(f.read(REVMAP_HEADER.size))
+            if magic != REVMAP_MAGIC:
+                raise Exception("Not a reverse map: " + path)
+
+            for name in ("starts", "ends", "owners"):
+                a = getattr(rmap, name)
+                a.fromfile(f, count)
+                if sys.byteorder == 'big':
+                    a.byteswap()
+            rmap.files = json.loads(f.read(files_size).decode("utf-8"))
+
+        rmap._build_max_ends()
+        return rmap
+
+
+def _base_sector(vfs):
+    # Sectors are kept relative to the whole disk when vfs sits on a
+    # partition view.
+    return getattr(vfs.drive, "start_lba", 0)
+
+
+def add_fat32(rmap, fat32, workers=1):
+    # Every file and directory reachable from the root, by path.
+    if fat32.fat_table is None:
+        fat32.load_fat()
+
+    base = _base_sector(fat32)
+
+    def extents(cluster):
+        return [(base + fat32.to_sector(c), n * fat32.spc)
+                for c, n in fat32.get_fat_info(cluster)]
+
+    rmap.add_file("/", extents(fat32.vbr["root_dir"]))
+    for entry in fat32.walk(workers=workers):
+        if entry["cluster"] >= 2:
+            rmap.add_file(entry["path"], extents(entry["cluster"]))
+
+    return rmap
+
+
+def add_ntfs(rmap, ntfs):
+    # Every non-resident attribute of every in-use record, by MFT record
+    # number (of the base record for extension records).
+    base = _base_sector(ntfs)
+    for record in ntfs.scan_mft():
+        if not record["in_use"]:
+            continue
+
+        extents = []
+        for attr in record["attrs"]:
+            for lcn, n in attr.get("runlists", ()):
+                if lcn is not None:
+                    extents.append((base + ntfs.to_sector(lcn), n * ntfs.spc))
+
+        if extents:
+            number = record["file_ref_to_base"] & MFT_REF_MASK or record["number"]
+            rmap.add_file(number, extents)
+
+    return rmap
+
+
+def build(vfs, workers=1):
+    if hasattr(vfs, "scan_mft"):
+        return add_ntfs(ReverseMap(), vfs)
+
+    return add_fat32(ReverseMap(), vfs, workers)
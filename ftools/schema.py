@@ -1,6 +1,16 @@
+import struct
+from utils import Utils
+
+
+FIELD = 0
+NESTED = 1
+DYNAMIC = 2
+
+
 class Schema:
     def __init__(self):
         self.schema = []
+        self.compiled = {}
 
     def add(self, label, offset, length, transform=None,
             schema=None, dtype="int", len_func=None):
@@ -12,3 +22,144 @@ class Schema:
                    'len_func': len_func,
                    'transform': transform}
         self.schema.append(schema)
+        self.compiled = {}
+
+    def compile(self, endian=Utils.LITTLE_ENDIAN):
+        compiled = self.compiled.get(endian)
+        if compiled is None:
+            compiled = CompiledSchema(self, endian)
+            self.compiled[endian] = compiled
+
+        return compiled
+
+
+class CompiledSchema(object):
+    # Every column whose offset and length are known up front is packed into
+    # one struct.Struct; nested schemas are flattened into the same struct.
+    # Columns whose length depends on an earlier column are decoded after
+    # the single unpack_from() call.
+    def __init__(self, schema, endian=Utils.LITTLE_ENDIAN):
+        self.endian = endian
+        self.prefix = Utils.SIZE_TO_UNPACK[endian][1][0]
+        self.fields = []
+        self.plan = self._build_plan(schema, 0)
+        self.structs, self.size = self._build_structs()
+        self.labels = self._simple_labels()
+
+    def _field_code(self, column, length):
+        if column["type"] == "int" and length in Utils.SIZE_TO_UNPACK[self.endian]:
+            return Utils.SIZE_TO_UNPACK[self.endian][length][1]
+
+        return "%ds" % length
+
+    def _build_plan(self, schema, base_offset):
+        plan = []
+        for column in schema.schema:
+            offset = base_offset + column["offset"]
+
+            if column["type"] == "schema":
+                sub_plan = self._build_plan(column["schema"], offset)
+                plan.append((column["label"], NESTED, sub_plan, column["transform"]))
+            elif isinstance(column["length"], int):
+                length = Utils._column_length(column, None)
+                self.fields.append((offset, length, self._field_code(column, length)))
+                plan.append((column["label"], FIELD, len(self.fields) - 1,
+                             column["transform"]))
+            else:
+                plan.append((column["label"], DYNAMIC, (column, base_offset), None))
+
+        return plan
+
+    def _build_structs(self):
+        # Fields are laid out by offset; a field overlapping an earlier one
+        # goes to the next struct so that every struct stays a plain layout.
+        lanes = []
+        for idx in sorted(range(len(self.fields)), key=lambda i: self.fields[i][0]):
+            offset, length, code = self.fields[idx]
+            for lane in lanes:
+                if lane["end"] <= offset:
+                    break
+            else:
+                lane = {"end": 0, "fmt": [], "slots": []}
+                lanes.append(lane)
+
+            if offset > lane["end"]:
+                lane["fmt"].append("%dx" % (offset - lane["end"]))
+            lane["fmt"].append(code)
+            lane["slots"].append(idx)
+            lane["end"] = offset + length
+
+        order = []
+        structs = []
+        size = 0
+        for lane in lanes:
+            structs.append(struct.Struct(self.prefix + "".join(lane["fmt"])))
+            order.extend(lane["slots"])
+            size = max(size, lane["end"])
+
+        # Point the plan at positions in the concatenated unpack result.
+        position = dict((slot, pos) for pos, slot in enumerate(order))
+        self.plan = self._remap(self.plan, position)
+        return structs, size
+
+    def _remap(self, plan, position):
+        remapped = []
+        for label, kind, arg, transform in plan:
+            if kind == FIELD:
+                arg = position[arg]
+            elif kind == NESTED:
+                arg = self._remap(arg, position)
+            remapped.append((label, kind, arg, transform))
+
+        return remapped
+
+    def _simple_labels(self):
+        # A flat schema of plain fields, laid out in schema order with unique
+        # labels, decodes with a single dict(zip()).
+        if len(self.structs) > 1:
+            return None
+
+        labels = []
+        for pos, (label, kind, arg, transform) in enumerate(self.plan):
+            if kind != FIELD or transform is not None or arg != pos or label in labels:
+                return None
+            labels.append(label)
+
+        return tuple(labels)
+
+    def unpack(self, buf, base_offset=0):
+        if len(self.structs) == 1:
+            return self.structs[0].unpack_from(buf, base_offset)
+
+        values = ()
+        for st in self.structs:
+            values += st.unpack_from(buf, base_offset)
+
+        return values
+
+    def decode(self, buf, base_offset=0):
+        values = self.unpack(buf, base_offset)
+        if self.labels is not None:
+            return dict(zip(self.labels, values))
+
+        return self._decode_plan(self.plan, values, buf, base_offset)
+
+    def _decode_plan(self, plan, values, buf, base_offset):
+        v = {}
+        for label, kind, arg, transform in plan:
+            if kind == FIELD:
+                value = values[arg]
+            elif kind == NESTED:
+                value = self._decode_plan(arg, values, buf, base_offset)
+            else:
+                column, column_base = arg
+                length = Utils._column_length(column, v)
+                _, value = Utils._type_to_map(column, length, buf, self.endian,
+                                              base_offset + column_base)
+
+            if transform is not None:
+                value = transform(value)
+
+            Utils._merge(v, label, value)
+
+        return v
@@ -38,6 +38,8 @@ class Utils:
             v = Utils.schema_to_map(s, buf, endian=endian, base_offset = offset)
         else:
             v = buf[offset:offset+length]
+            if isinstance(v, memoryview):
+                v = v.tobytes()
 
         if column["transform"] is not None:
             v = column["transform"](v)
@@ -63,22 +65,17 @@ class Utils:
         return len_func(length)
 
     @staticmethod
-    def schema_to_map(schema, buf, endian=0, base_offset=0):
-        v = {}
-        sub_offset = 0
-            
-        for column in schema.schema:
-            length = Utils._column_length(column, v)
-            k, value = Utils._type_to_map(column, length, buf,
-                                          endian=endian, base_offset=base_offset)
-            if k in v and type(v[k]) != list:
-                tmp_v = v[k]
-                v[k] = []
-                v[k].append(tmp_v)
-                v[k].append(value)
-            elif k in v and type(v[k]) == list:
-                v[k].append(value)
-            else: 
-                v[k] = value
+    def _merge(v, k, value):
+        if k in v and type(v[k]) != list:
+            tmp_v = v[k]
+            v[k] = []
+            v[k].append(tmp_v)
+            v[k].append(value)
+        elif k in v and type(v[k]) == list:
+            v[k].append(value)
+        else: 
+            v[k] = value
 
-        return v
+    @staticmethod
+    def schema_to_map(schema, buf, endian=0, base_offset=0):
+        return schema.compile(endian).decode(buf, base_offset)
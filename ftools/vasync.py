@@ -0,0 +1,173 @@
+import asyncio
+from collections import deque
+from ntfs import MFT_SCAN_CHUNK
+from fat32 import FATTable, is_chain_end
+
+
+class AsyncDrive(object):
+    DEFAULT_MAX_INFLIGHT = 8
+
+    # Runs the blocking reads of a Drive in an executor (the loop's default
+    # one unless given; share one executor between images to cap threads).
+    # At most max_inflight reads of this drive are outstanding, later
+    # callers wait for a slot. The drive must tolerate concurrent reads:
+    # reads go through pread(), which every Drive provides, and PreadDrive
+    # or MmapDrive are safe for anything else run through run().
+    def __init__(self, drive, max_inflight=DEFAULT_MAX_INFLIGHT, executor=None):
+        self.drive = drive
+        self.executor = executor
+        self.max_inflight = max_inflight
+        self.semaphore = asyncio.Semaphore(max_inflight)
+
+    def get_block_size(self):
+        return self.drive.get_block_size()
+
+    async def run(self, func, *args):
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    async def read(self, sector, count=1):
+        return await self.run(self.drive.pread, sector, count)
+
+    async def read_many(self, requests):
+        return await asyncio.gather(*[self.read(sector, count)
+                                      for sector, count in requests])
+
+
+class AsyncFAT32(object):
+    def __init__(self, fat32, adrive):
+        self.fat32 = fat32
+        self.adrive = adrive
+        self.loading = None
+
+    async def _load_fat(self):
+        fat32 = self.fat32
+        try:
+            data = await self.adrive.read(fat32.rsc, fat32.fat_size)
+            fat32.fat_table = FATTable(data, fat32.cluster_count)
+        except BaseException:
+            self.loading = None
+            raise
+
+    async def _fat(self):
+        # The FAT is read once, with a positional read, however many
+        # callers need it at the same time.
+        if self.fat32.fat_table is not None:
+            return
+        if self.loading is None:
+            self.loading = asyncio.ensure_future(self._load_fat())
+        await asyncio.shield(self.loading)
+
+    async def read_directory(self, cluster):
+        await self._fat()
+        fat32 = self.fat32
+        parts = await self.adrive.read_many([(fat32.to_sector(c), count * fat32.spc)
+                                             for c, count in fat32.get_fat_info(cluster)])
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    async def list(self, cluster, filter=None, deleted=True):
+        data = await self.read_directory(cluster)
+        for entry in self.fat32.iter_list(data, filter, deleted):
+            yield entry
+
+    async def walk(self, cluster=None, path="", filter=None, deleted=False):
+        # Same entries as FAT32.walk(); up to max_inflight directories of
+        # the drive are read at once.
+        fat32 = self.fat32
+        if cluster is None:
+            cluster = fat32.vbr["root_dir"]
+
+        visited = set([cluster])
+        pending = deque([(path, cluster)])
+        inflight = deque()
+        limit = self.adrive.max_inflight
+
+        try:
+            while pending or inflight:
+                while pending and len(inflight) < limit:
+                    dpath, dcluster = pending.popleft()
+                    task = asyncio.ensure_future(self.read_directory(dcluster))
+                    inflight.append((dpath, task))
+
+                dpath, task = inflight.popleft()
+                entries, children = fat32._walk_entries(dpath, await task, filter, deleted)
+                for child in children:
+                    if child[1] in visited or is_chain_end(child[1], fat32.cluster_count):
+                        continue
+                    visited.add(child[1])
+                    pending.append(child)
+
+                for entry in entries:
+                    yield entry
+        finally:
+            for _, task in inflight:
+                task.cancel()
+
+
+class AsyncNTFS(object):
+    def __init__(self, ntfs, adrive):
+        self.ntfs = ntfs
+        self.adrive = adrive
+
+    async def _read_clusters(self, lcn, count):
+        ntfs = self.ntfs
+        if lcn is None:
+            return bytes(count * ntfs.get_block_size())
+        return await self.adrive.read(ntfs.to_sector(lcn), count * ntfs.spc)
+
+    async def read_records(self, number, count=1):
+        # Same bytes as NTFS.read_records(), read with positional reads of
+        # the $MFT clusters holding them: BlockFile reads seek the drive's
+        # shared file position, which is not safe with reads in flight.
+        ntfs = self.ntfs
+        cluster_size = ntfs.get_block_size()
+        offset = number * ntfs.mftsize
+        size = max(0, min(count * ntfs.mftsize, ntfs.mft_file.filesize - offset))
+        first = offset // cluster_size
+        last = (offset + size + cluster_size - 1) // cluster_size
+
+        parts = await asyncio.gather(*[self._read_clusters(lcn, n)
+                                       for lcn, n in ntfs.mft_file.bget(first, last - first)])
+        skip = offset - first * cluster_size
+        return bytearray(b"".join(parts)[skip:skip + size])
+
+    def _parse_records(self, data, number, count):
+        ntfs = self.ntfs
+        records = []
+        for i in range(count):
+            record = ntfs.parse_record(data, i * ntfs.mftsize, number + i)
+            if record is not None:
+                records.append(record)
+
+        return records
+
+    async def scan_mft(self, start=0, count=None, chunk_size=MFT_SCAN_CHUNK, prefetch=1):
+        # Same records as NTFS.scan_mft(); the next prefetch chunks are read
+        # while the current one is parsed and consumed. Chunks are parsed in
+        # the executor so that a large $MFT does not hold up the other
+        # images served by the loop.
+        ntfs = self.ntfs
+        end = ntfs.record_count if count is None else min(ntfs.record_count, start + count)
+        per_chunk = max(1, chunk_size // ntfs.mftsize)
+        loop = asyncio.get_running_loop()
+
+        chunks = deque((number, min(per_chunk, end - number))
+                       for number in range(start, end, per_chunk))
+        inflight = deque()
+
+        try:
+            while chunks or inflight:
+                while chunks and len(inflight) <= prefetch:
+                    number, n = chunks.popleft()
+                    task = asyncio.ensure_future(self.read_records(number, n))
+                    inflight.append((number, n, task))
+
+                number, n, task = inflight.popleft()
+                records = await loop.run_in_executor(self.adrive.executor, self._parse_records,
+                                                     await task, number, n)
+                for record in records:
+                    yield record
+        finally:
+            for _, _, task in inflight:
+                task.cancel()
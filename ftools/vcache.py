@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+from vdrive import DEFAULT_MERGE_GAP, read_many, worker_factory
+
+
+class CachedDrive(object):
+    DEFAULT_CAPACITY = 64 * 1024 * 1024
+    DEFAULT_PAGE_SECTORS = 8
+    DEFAULT_MAX_READAHEAD = 256
+
+    # Wraps any Drive. Sectors are cached in pages of page_sectors sectors,
+    # evicted least recently used first once capacity bytes are held. Reads
+    # that continue where the previous read stopped grow a read-ahead window
+    # (in pages, doubling up to max_readahead) so sequential walks turn into
+    # a few large reads.
+    def __init__(self, drive, capacity=DEFAULT_CAPACITY,
+                 page_sectors=DEFAULT_PAGE_SECTORS,
+                 max_readahead=DEFAULT_MAX_READAHEAD):
+        self.drive = drive
+        self.path = drive.path
+        self.block_size = drive.get_block_size()
+        self.page_sectors = page_sectors
+        self.page_size = self.block_size * page_sectors
+        self.capacity = capacity
+        self.max_readahead = max_readahead
+
+        self.pages = OrderedDict()
+        self.used = 0
+        self.last_page = None
+        self.readahead = 0
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0
+        self.bytes_read = 0
+
+    def get_block_size(self):
+        return self.block_size
+
+    def get_size(self):
+        return self.drive.get_size()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'reads': self.reads,
+            'bytes_read': self.bytes_read,
+            'cached_bytes': self.used
+        }
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+            self.used = 0
+
+    def close(self):
+        self.clear()
+        self.drive.close()
+
+    def factory(self):
+        # Workers read the underlying image without a cache of their own.
+        return worker_factory(self.drive)
+
+    def _update_readahead(self, first, last):
+        if self.last_page is not None and first in (self.last_page, self.last_page + 1):
+            self.readahead = min(self.max_readahead, max(1, self.readahead * 2))
+        else:
+            self.readahead = 0
+
+        self.last_page = last
+
+    def _insert(self, page, data):
+        self.pages[page] = data
+        self.used += len(data)
+
+        while self.used > self.capacity and self.pages:
+            _, old = self.pages.popitem(last=False)
+            self.used -= len(old)
+
+    def _fetch(self, first, last, limit):
+        # One read for pages [first, last], extended up to limit while the
+        # following pages are not cached yet.
+        while last < limit and last + 1 not in self.pages:
+            last += 1
+
+        count = last - first + 1
+        data = self.drive.read(first * self.page_sectors, count * self.page_sectors)
+        self.reads += 1
+        self.bytes_read += len(data)
+
+        fetched = {}
+        for i in range(count):
+            page = data[i * self.page_size:(i + 1) * self.page_size]
+            if len(page) == 0:
+                break
+            page = bytes(page)
+            fetched[first + i] = page
+            self._insert(first + i, page)
+
+        return fetched
+
+    def read(self, sector, count=1):
+        first = sector // self.page_sectors
+        last = (sector + count - 1) // self.page_sectors
+
+        with self.lock:
+            self._update_readahead(first, last)
+
+            pages = []
+            page = first
+            while page <= last:
+                data = self.pages.get(page)
+                if data is not None:
+                    self.hits += 1
+                    self.pages.move_to_end(page)
+                    pages.append(data)
+                    page += 1
+                    continue
+
+                end = page
+                while end < last and end + 1 not in self.pages:
+                    end += 1
+
+                limit = end + self.readahead if end == last else end
+                fetched = self._fetch(page, end, limit)
+                self.misses += end - page + 1
+
+                for p in range(page, end + 1):
+                    if p not in fetched:
+                        break
+                    pages.append(fetched[p])
+                else:
+                    page = end + 1
+                    continue
+                break
+
+        start = (sector - first * self.page_sectors) * self.block_size
+        size = count * self.block_size
+        if len(pages) == 1:
+            return pages[0][start:start + size]
+
+        return b"".join(pages)[start:start + size]
+
+    def readinto(self, sector, buf):
+        data = self.read(sector, (len(buf) + self.block_size - 1) // self.block_size)
+        n = min(len(data), len(buf))
+        buf[:n] = data[:n]
+        return n
+
+    def read_many(self, requests, gap=DEFAULT_MERGE_GAP):
+        return read_many(self, requests, gap)
+
+    def pread(self, sector, count=1):
+        return self.read(sector, count)
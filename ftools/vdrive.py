@@ -1,15 +1,212 @@
+import functools
+import mmap
+import os
+import queue
+import threading
+
+
+DEFAULT_MERGE_GAP = 64
+
+
+def merge_requests(requests, gap=DEFAULT_MERGE_GAP):
+    # Sorts (sector, count) requests by sector and merges those that
+    # overlap or are at most gap sectors apart. Returns [start, end, indexes]
+    # runs, indexes pointing back into requests.
+    runs = []
+    for i in sorted(range(len(requests)), key=lambda i: requests[i][0]):
+        sector, count = requests[i]
+        if runs and sector <= runs[-1][1] + gap:
+            runs[-1][1] = max(runs[-1][1], sector + count)
+            runs[-1][2].append(i)
+        else:
+            runs.append([sector, sector + count, [i]])
+
+    return runs
+
+
+def read_many(drive, requests, gap=DEFAULT_MERGE_GAP):
+    block_size = drive.get_block_size()
+    results = [None] * len(requests)
+
+    for start, end, indexes in merge_requests(requests, gap):
+        data = drive.read(start, end - start)
+        for i in indexes:
+            sector, count = requests[i]
+            offset = (sector - start) * block_size
+            results[i] = data[offset:offset + count * block_size]
+
+    return results
+
+
+def pread_full(fd, size, offset):
+    # os.pread may return less than asked for large reads; stop only at EOF.
+    data = os.pread(fd, size, offset)
+    if len(data) == size or not data:
+        return data
+
+    parts = [data]
+    done = len(data)
+    while done < size:
+        data = os.pread(fd, size - done, offset + done)
+        if not data:
+            break
+        parts.append(data)
+        done += len(data)
+
+    return b"".join(parts)
+
+
+def worker_factory(drive):
+    # Picklable callable that opens the image behind drive again, for worker
+    # processes. Drives that are views or stacks over other files provide
+    # their own factory(); anything else is mapped from drive.path.
+    factory = getattr(drive, "factory", None)
+    if factory is not None:
+        return factory()
+
+    return functools.partial(MmapDrive, drive.path, drive.get_block_size())
+
+
 class Drive(object):
     def __init__(self, drive, block_size=512):
+        self.path = drive
         self.drive = open(drive, "rb")
         self.drive.seek(0)
         self.block_size = block_size
+        self.lock = threading.Lock()
 
     def get_block_size(self):
         return self.block_size
 
+    def get_size(self):
+        # st_size is 0 for block devices, so ask the end of the file instead.
+        return self.drive.seek(0, os.SEEK_END)
+
     def seek(self, sector):
         self.drive.seek(sector * self.block_size)
 
     def read(self, sector, count=1):
         self.seek(sector)
         return self.drive.read(self.block_size * count)
+
+    def readinto(self, sector, buf):
+        self.seek(sector)
+        return self.drive.readinto(buf)
+
+    def read_many(self, requests, gap=DEFAULT_MERGE_GAP):
+        # Serves a batch of (sector, count) requests with as few, as
+        # sequential reads as possible; results come back in request order.
+        return read_many(self, requests, gap)
+
+    def pread(self, sector, count=1):
+        # Positional read that leaves the shared file position alone, so
+        # several threads can read through one Drive.
+        if hasattr(os, "pread"):
+            return pread_full(self.drive.fileno(), self.block_size * count,
+                              sector * self.block_size)
+
+        with self.lock:
+            return Drive.read(self, sector, count)
+
+    def close(self):
+        self.drive.close()
+
+
+class MmapDrive(Drive):
+    # Reads are memoryview slices of a read-only mapping of the whole image:
+    # no syscall and no copy per read. Callers that need to modify the data
+    # must copy it themselves (e.g. bytearray(view)).
+    def __init__(self, drive, block_size=512):
+        super(MmapDrive, self).__init__(drive, block_size)
+        self.mmap = mmap.mmap(self.drive.fileno(), self.get_size(),
+                              access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+    def read(self, sector, count=1):
+        start = sector * self.block_size
+        return self.view[start:start + self.block_size * count]
+
+    def readinto(self, sector, buf):
+        start = sector * self.block_size
+        data = self.view[start:start + len(buf)]
+        buf[:len(data)] = data
+        return len(data)
+
+    def pread(self, sector, count=1):
+        return self.read(sector, count)
+
+    def close(self):
+        # Views returned by read() may outlive the drive; the mapping is then
+        # left to be unmapped by the garbage collector once the last one goes.
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
+        super(MmapDrive, self).close()
+
+
+class PreadDrive(Drive):
+    # Drive without a shared file position: every read is a positional
+    # os.pread()/os.preadv(), so one PreadDrive can serve many threads.
+    # With pool_size, reads take one of pool_size descriptors of the image
+    # in turn, blocking while all of them are busy.
+    def __init__(self, drive, block_size=512, pool_size=None):
+        super(PreadDrive, self).__init__(drive, block_size)
+        self.pool = None
+        if pool_size:
+            self.pool = queue.Queue()
+            for _ in range(pool_size):
+                self.pool.put(os.open(drive, os.O_RDONLY | getattr(os, "O_BINARY", 0)))
+
+    def _acquire(self):
+        if self.pool is None:
+            return self.drive.fileno()
+
+        return self.pool.get()
+
+    def _release(self, fd):
+        if self.pool is not None:
+            self.pool.put(fd)
+
+    def read(self, sector, count=1):
+        if not hasattr(os, "pread"):
+            return super(PreadDrive, self).pread(sector, count)
+
+        fd = self._acquire()
+        try:
+            return pread_full(fd, self.block_size * count, sector * self.block_size)
+        finally:
+            self._release(fd)
+
+    def pread(self, sector, count=1):
+        return self.read(sector, count)
+
+    def readinto(self, sector, buf):
+        if not hasattr(os, "preadv"):
+            data = self.read(sector, (len(buf) + self.block_size - 1) // self.block_size)
+            n = min(len(data), len(buf))
+            buf[:n] = data[:n]
+            return n
+
+        view = memoryview(buf).cast('B')
+        offset = sector * self.block_size
+        done = 0
+
+        fd = self._acquire()
+        try:
+            while done < len(view):
+                n = os.preadv(fd, [view[done:]], offset + done)
+                if n == 0:
+                    break
+                done += n
+        finally:
+            self._release(fd)
+
+        return done
+
+    def close(self):
+        if self.pool is not None:
+            while not self.pool.empty():
+                os.close(self.pool.get())
+        super(PreadDrive, self).close()
@@ -1,75 +1,174 @@
+import io
+import bisect
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
 class BlockFile(object):
     def __init__(self, vfs, filesize, extends):
         self.vfs = vfs
         self.block_size = vfs.get_block_size()
         self.extends = extends
+        self.bounds = self._calculate_bounds(extends)
         self.filesize = self._calculate_filesize(filesize)
 
+    def _calculate_bounds(self, extends):
+        # bounds[i] is the first file block of extent i, bounds[-1] the total.
+        bounds = [0]
+        for extend in extends:
+            bounds.append(bounds[-1] + extend[1])
+
+        return bounds
+
     def _calculate_filesize(self, filesize):
         if filesize >= 0:
             return filesize
 
-        bsize = self.vfs.get_block_size()
-        size = 0
-        for extend in self.extends:
-            size += bsize * extend[1]
+        return self.bounds[-1] * self.block_size
 
-        return size
-        
-    def read(self, offset, size):
-        blocks = self.bget(offset, size)
-        buf = b""
+    def _readinto(self, offset, view):
+        # Fills view from byte offset of the file. Whole blocks go straight
+        # into view; only a partial first/last block goes through a temporary.
+        bs = self.block_size
+        size = len(view)
+        pos = 0
+
+        while pos < size:
+            block, skip = divmod(offset + pos, bs)
+            i = bisect.bisect_right(self.bounds, block) - 1
+            if i >= len(self.extends):
+                break
 
-        for block in blocks:
-            buf += self.vfs.read(block[0], block[1])
+            start, nblocks = self.extends[i]
+            inner = block - self.bounds[i]
+            want = min(size - pos, (nblocks - inner) * bs - skip)
 
+            if skip or want < bs:
+                want = min(want, bs - skip)
+            else:
+                want -= want % bs
+
+            if start is None:
+                view[pos:pos + want] = bytes(want)
+            elif skip or want < bs:
+                data = self.vfs.read(start + inner, 1)
+                view[pos:pos + want] = data[skip:skip + want]
+            else:
+                self.vfs.readinto(start + inner, view[pos:pos + want])
+
+            pos += want
+
+        return pos
+
+    def readinto_at(self, offset, buf):
+        size = max(0, min(len(buf), self.filesize - offset))
+        view = memoryview(buf).cast('B')
+        return self._readinto(offset, view[:size])
+
+    def read_at(self, offset, size):
+        size = max(0, min(size, self.filesize - offset))
+        buf = bytearray(size)
+        n = self._readinto(offset, memoryview(buf))
+        return buf if n == size else buf[:n]
+
+    def read(self, offset, size):
+        # offset and size in blocks, not limited to the file size.
+        count = max(0, min(size, self.bounds[-1] - offset))
+        buf = bytearray(count * self.block_size)
+        self._readinto(offset * self.block_size, memoryview(buf))
         return buf
 
+    def open(self):
+        return BlockFileStream(self)
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        offset = 0
+        while offset < self.filesize:
+            chunk = self.read_at(offset, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+            offset += len(chunk)
+
     def bget(self, offset, size):
         blocks = []
-        current_bound = 0
+        i = bisect.bisect_right(self.bounds, offset) - 1
         nsize = size
-        noffset = offset
 
-        store = False
-        added = 0
+        while nsize > 0 and i < len(self.extends):
+            start, nblocks = self.extends[i]
+            inner = offset - self.bounds[i] if not blocks else 0
+            added = min(nblocks - inner, nsize)
+            blocks.append((None if start is None else start + inner, added))
+            nsize -= added
+            i += 1
 
-        for extend in self.extends:
-            nblocks = extend[1]
-            start_offset = extend[0]
+        return blocks
 
-            current_bound += nblocks
 
-            if not store and offset < current_bound:
-                store = True
-                capa = current_bound - offset
-                added = capa if nsize > capa else nsize
-                blocks.append((start_offset+noffset, added))
-                nsize -= added
+class MemoryFile(object):
+    # Same byte interface as BlockFile for contents already in memory, such
+    # as resident NTFS attributes.
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.filesize = len(self.data)
 
-            elif store == False:
-                noffset -= extend[1]
+    def readinto_at(self, offset, buf):
+        data = self.read_at(offset, len(buf))
+        memoryview(buf).cast('B')[:len(data)] = data
+        return len(data)
 
-            elif store:
-                added = nblocks if nblocks < nsize else nsize
-                blocks.append((start_offset, added))
-                nsize -= added
+    def read_at(self, offset, size):
+        return bytearray(self.data[offset:offset + max(0, size)])
 
-            if nsize <= 0:
-                break
-                
-        return blocks
+    def open(self):
+        return BlockFileStream(self)
 
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        for offset in range(0, self.filesize, chunk_size):
+            yield self.read_at(offset, chunk_size)
 
-class VFile(BlockFile):
-    def __init__(self, vfs, filesize, extends):
-        super(BlockFile, self).__init__(vfs, filesize, extends)
 
-    def read(self, offset, size):
-        blocks = self.bget(offset, size)
-        buf = b""
+class BlockFileStream(io.RawIOBase):
+    # Seekable, read-only file object over a BlockFile, for hashlib,
+    # shutil.copyfileobj, zipfile and friends.
+    def __init__(self, bfile):
+        super(BlockFileStream, self).__init__()
+        self.bfile = bfile
+        self.pos = 0
 
-        for block in blocks:
-            buf += self.vfs.read(block[0], block[1])
+    def readable(self):
+        return True
 
-        return buf
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.bfile.readinto_at(self.pos, b)
+        self.pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.bfile.filesize + offset
+        else:
+            raise ValueError("Invalid whence: " + str(whence))
+
+        if pos < 0:
+            raise ValueError("Negative seek position: " + str(pos))
+
+        self.pos = pos
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+class VFile(BlockFile):
+    def __init__(self, vfs, filesize, extends):
+        super(VFile, self).__init__(vfs, filesize, extends)
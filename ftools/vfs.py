@@ -7,5 +7,18 @@ class VFS(object):
     def set_spc(self, spc):
         self.spc = spc
 
+    def get_block_size(self):
+        return self.drive.get_block_size() * self.spc
+
+    def to_sector(self, cluster):
+        return cluster * self.spc
+
     def read(self, cluster, count=1):
-        return self.drive.read(cluster, self.spc * count)
+        return self.drive.read(self.to_sector(cluster), self.spc * count)
+
+    def readinto(self, cluster, buf):
+        return self.drive.readinto(self.to_sector(cluster), buf)
+
+    def read_many(self, requests):
+        return self.drive.read_many([(self.to_sector(cluster), count * self.spc)
+                                     for cluster, count in requests])
@@ -0,0 +1,231 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from vdrive import DEFAULT_MERGE_GAP, read_many
+
+
+# Accept both gzip and zlib headers.
+WBITS = 32 + zlib.MAX_WBITS
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+INPUT_CHUNK = 64 * 1024
+DEFAULT_BLOCK = 1024 * 1024
+DEFAULT_SPAN = 32 * 1024 * 1024
+DEFAULT_CACHE = 64 * 1024 * 1024
+
+
+class GzipDrive(object):
+    # Random access to a gzip/zlib compressed raw image.
+    #
+    # The image is decompressed in blocks of block bytes held in a
+    # byte-bounded LRU. A read decompresses only from the closest access
+    # point before it. Access points are the start of every gzip member
+    # plus, inside a member, a copy of the decompressor taken every span
+    # bytes of output.
+    #
+    # The first open decompresses the whole image once. It records every
+    # access point and saves the member table and the image size next to
+    # the image (path + ".idx"). Python's zlib cannot restore a decompressor
+    # in the middle of a deflate stream in another process (no
+    # inflatePrime). So a reopen restores member boundaries at once and
+    # takes in-member access points again as reads pass them. Images
+    # compressed as independent members (bgzip, pigz --independent,
+    # concatenated gzip) are fully random access from the saved index.
+    def __init__(self, drive, block_size=512, span=DEFAULT_SPAN,
+                 block=DEFAULT_BLOCK, cache_size=DEFAULT_CACHE, index_path=None):
+        self.path = drive
+        self.drive = open(drive, "rb")
+        self.block_size = block_size
+        self.block = block
+        self.span = max(block, span // block * block)
+        self.cache_size = max(cache_size, block)
+        self.index_path = index_path or drive + INDEX_SUFFIX
+        self.source_size = self._source_stat()[0]
+        self.lock = threading.RLock()
+
+        self.cache = OrderedDict()
+        self.cached = 0
+        self.offsets = []
+        self.points = []
+        self.size = None
+
+        if not self.load_index():
+            self.build_index()
+            self.save_index()
+
+    def get_block_size(self):
+        return self.block_size
+
+    def get_size(self):
+        return self.size
+
+    def close(self):
+        self.cache.clear()
+        self.drive.close()
+
+    def factory(self):
+        return functools.partial(GzipDrive, self.path, self.block_size, self.span,
+                                 self.block, self.cache_size, self.index_path)
+
+    def _source_stat(self):
+        st = os.fstat(self.drive.fileno())
+        return st.st_size, st.st_mtime
+
+    def _add_point(self, uoffset, coffset, state):
+        i = bisect.bisect_left(self.offsets, uoffset)
+        if i < len(self.offsets) and self.offsets[i] == uoffset:
+            return
+
+        self.offsets.insert(i, uoffset)
+        self.points.insert(i, (uoffset, coffset, state))
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        size, mtime = self._source_stat()
+        if (index.get("version") != INDEX_VERSION or
+                index.get("source_size") != size or
+                index.get("source_mtime") != mtime):
+            return False
+
+        self.size = index["size"]
+        for uoffset, coffset in index["members"]:
+            self._add_point(uoffset, coffset, None)
+
+        return True
+
+    def save_index(self):
+        size, mtime = self._source_stat()
+        index = {
+            "version": INDEX_VERSION,
+            "source_size": size,
+            "source_mtime": mtime,
+            "size": self.size,
+            "members": [[u, c] for u, c, state in self.points if state is None]
+        }
+
+        try:
+            with open(self.index_path, "w") as f:
+                json.dump(index, f)
+        except OSError:
+            pass
+
+    def build_index(self):
+        with self.lock:
+            self._add_point(0, 0, None)
+            self.size = self._inflate(self.points[0], None)
+
+    def _cache_block(self, n, data):
+        if n in self.cache:
+            return
+
+        self.cache[n] = data
+        self.cached += len(data)
+        while self.cached > self.cache_size and self.cache:
+            _, old = self.cache.popitem(last=False)
+            self.cached -= len(old)
+
+    def _inflate(self, point, target):
+        # Decompresses from point until block target is cached (to the end
+        # of the image when target is None), recording access points on the
+        # way. Returns the uncompressed offset reached.
+        uoffset, coffset, state = point
+        d = state.copy() if state is not None else zlib.decompressobj(WBITS)
+        pending = b""
+        at_eof = False
+        buf = bytearray()
+        buf_start = uoffset
+
+        while True:
+            if not pending and not at_eof:
+                self.drive.seek(coffset)
+                pending = self.drive.read(INPUT_CHUNK)
+                at_eof = not pending
+
+            boundary = (uoffset // self.block + 1) * self.block
+            try:
+                out = d.decompress(pending, boundary - uoffset)
+            except zlib.error:
+                # Trailing garbage after the last member.
+                break
+
+            member_end = d.eof
+            rest = d.unused_data if member_end else d.unconsumed_tail
+            coffset += len(pending) - len(rest)
+            pending = rest
+            uoffset += len(out)
+            buf += out
+
+            if member_end:
+                rest = pending.lstrip(b"\x00")
+                coffset += len(pending) - len(rest)
+                pending = rest
+                if coffset >= self.source_size:
+                    break
+                d = zlib.decompressobj(WBITS)
+                self._add_point(uoffset, coffset, None)
+            elif not out and at_eof:
+                break
+
+            if uoffset == boundary:
+                n = boundary // self.block - 1
+                if target is not None and buf_start <= n * self.block:
+                    self._cache_block(n, bytes(buf[n * self.block - buf_start:]))
+                    if n >= target:
+                        return uoffset
+                buf = bytearray()
+                buf_start = uoffset
+
+                if uoffset % self.span == 0:
+                    self._add_point(uoffset, coffset, d.copy())
+
+        n = max(0, uoffset - 1) // self.block
+        if target is not None and buf and buf_start <= n * self.block:
+            self._cache_block(n, bytes(buf[n * self.block - buf_start:]))
+
+        return uoffset
+
+    def _get_block(self, n):
+        data = self.cache.get(n)
+        if data is not None:
+            self.cache.move_to_end(n)
+            return data
+
+        i = bisect.bisect_right(self.offsets, n * self.block) - 1
+        self._inflate(self.points[i], n)
+        return self.cache.get(n, b"")
+
+    def read(self, sector, count=1):
+        start = sector * self.block_size
+        end = min(start + count * self.block_size, self.size)
+        if start >= end:
+            return b""
+
+        with self.lock:
+            parts = []
+            for n in range(start // self.block, (end - 1) // self.block + 1):
+                data = self._get_block(n)
+                base = n * self.block
+                parts.append(data[max(start, base) - base:end - base])
+
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def pread(self, sector, count=1):
+        return self.read(sector, count)
+
+    def readinto(self, sector, buf):
+        data = self.read(sector, (len(buf) + self.block_size - 1) // self.block_size)
+        n = min(len(data), len(buf))
+        buf[:n] = data[:n]
+        return n
+
+    def read_many(self, requests, gap=DEFAULT_MERGE_GAP):
+        return read_many(self, requests, gap)
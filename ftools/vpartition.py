@@ -0,0 +1,150 @@
+import functools
+import sys
+from vdrive import Drive, DEFAULT_MERGE_GAP, worker_factory
+from vcache import CachedDrive
+from MBRPartitionFinder import MBRPartitionFinder
+from GPTFinder import GPTFinder
+from fat32 import FAT32
+from ntfs import NTFS
+
+
+MBR_SIGNATURE = b"\x55\xaa"
+MBR_TYPE_GPT_PROTECTIVE = 0xEE
+
+VBR_SIGNATURES = [
+    (3, b"NTFS    ", NTFS),
+    (82, b"FAT32   ", FAT32),
+]
+
+
+class PartitionDrive(object):
+    # A partition seen as a Drive of its own: sector 0 is start_lba of the
+    # parent. Reads are clipped to the partition and every read goes to the
+    # parent, so views of one disk share its handle, cache and stats.
+    # Closing a view leaves the parent open unless the view owns it.
+    def __init__(self, parent, start_lba, length, owns_parent=False):
+        self.parent = parent
+        self.path = parent.path
+        self.start_lba = start_lba
+        self.length = length
+        self.owns_parent = owns_parent
+
+    def get_block_size(self):
+        return self.parent.get_block_size()
+
+    def get_size(self):
+        return self.length * self.get_block_size()
+
+    def stats(self):
+        # Empty unless the parent keeps some (a CachedDrive).
+        return getattr(self.parent, "stats", lambda: {})()
+
+    def close(self):
+        if self.owns_parent:
+            self.parent.close()
+
+    def factory(self):
+        return functools.partial(_open_partition, worker_factory(self.parent),
+                                 self.start_lba, self.length)
+
+    def _translate(self, sector, count):
+        if sector < 0 or sector > self.length:
+            raise Exception("Sector {} is outside of the partition ({} sectors)".format(
+                sector, self.length))
+
+        return self.start_lba + sector, min(count, self.length - sector)
+
+    def read(self, sector, count=1):
+        sector, count = self._translate(sector, count)
+        return self.parent.read(sector, count)
+
+    def pread(self, sector, count=1):
+        sector, count = self._translate(sector, count)
+        return self.parent.pread(sector, count)
+
+    def readinto(self, sector, buf):
+        block_size = self.get_block_size()
+        count = (len(buf) + block_size - 1) // block_size
+        sector, count = self._translate(sector, count)
+        view = memoryview(buf).cast('B')
+        return self.parent.readinto(sector, view[:count * block_size])
+
+    def read_many(self, requests, gap=DEFAULT_MERGE_GAP):
+        return self.parent.read_many([self._translate(sector, count)
+                                      for sector, count in requests], gap)
+
+
+def _open_partition(parent_factory, start_lba, length):
+    return PartitionDrive(parent_factory(), start_lba, length, owns_parent=True)
+
+
+def detect_vfs(vbr):
+    for offset, signature, cls in VBR_SIGNATURES:
+        if vbr[offset:offset + len(signature)] == signature:
+            return cls
+
+    return None
+
+
+def find_partitions(drive, sector=None):
+    # (scheme, index, lba, size, type) for every partition, from one read of
+    # sector 0 and of the partition tables it points to.
+    if sector is None:
+        sector = drive.read(0)
+
+    if sector[510:512] != MBR_SIGNATURE:
+        return []
+
+    finder = MBRPartitionFinder(drive)
+    primary = finder.get_table_entries(sector)
+    if any(entry.partition_type == MBR_TYPE_GPT_PROTECTIVE for entry in primary):
+        # GPT LBAs count the disk's logical sectors, which may be larger
+        # than the drive's blocks (a 4Kn image read in 512 byte blocks).
+        gpt = GPTFinder(drive)
+        entries = gpt.parse()
+        scale = gpt.sector_size // drive.get_block_size()
+        return [('gpt', entry.index, entry.lba * scale, entry.size * scale, entry.type_uuid())
+                for entry in entries]
+
+    return [('mbr', i, entry.lba, entry.size, entry.partition_type)
+            for i, entry in enumerate(finder.parse(sector))]
+
+
+def open_partitions(drive):
+    # Opens every partition of a disk with the VFS class its boot sector
+    # asks for (None when the file system is not supported). drive is a
+    # Drive or a path, opened behind one CachedDrive shared by all views.
+    # A disk without a partition table that holds a file system itself
+    # (a "superfloppy" or a volume image) comes back as one partition.
+    if isinstance(drive, str):
+        drive = CachedDrive(Drive(drive))
+
+    sector = drive.read(0)
+    if detect_vfs(sector) is not None:
+        # A boot sector carries 0x55AA too; never read it as an MBR.
+        partitions = [('none', 0, 0, drive.get_size() // drive.get_block_size(), None)]
+        vbrs = [sector]
+    else:
+        partitions = find_partitions(drive, sector)
+        vbrs = drive.read_many([(lba, 1) for _, _, lba, _, _ in partitions])
+
+    opened = []
+    for (scheme, index, lba, length, ptype), vbr in zip(partitions, vbrs):
+        view = PartitionDrive(drive, lba, length)
+        cls = detect_vfs(vbr)
+        opened.append({
+            'scheme': scheme,
+            'index': index,
+            'lba': lba,
+            'size': length,
+            'type': ptype,
+            'drive': view,
+            'vfs': cls(view) if cls is not None else None
+        })
+
+    return opened
+
+
+if __name__ == '__main__':
+    for partition in open_partitions(sys.argv[1]):
+        print(partition)
@@ -0,0 +1,125 @@
+import bisect
+import functools
+import os
+import re
+import threading
+from vdrive import DEFAULT_MERGE_GAP, read_many
+
+
+SEGMENT_NAME = re.compile(r"^(.*\.)(\d+)$")
+
+
+def find_segments(path):
+    # image.001 (or image.000, image.1, ...) -> every consecutive segment
+    # that exists next to it.
+    m = SEGMENT_NAME.match(path)
+    if m is None:
+        return [path]
+
+    prefix, number = m.group(1), m.group(2)
+    width = len(number)
+    n = int(number)
+
+    segments = []
+    while True:
+        segment = "{}{:0{}d}".format(prefix, n, width)
+        if not os.path.exists(segment):
+            break
+        segments.append(segment)
+        n += 1
+
+    if not segments:
+        raise Exception("No such segment: " + path)
+
+    return segments
+
+
+class SplitDrive(object):
+    # One Drive over a segmented raw image. Segments are opened on first
+    # use; a sector is mapped to (segment, offset) by bisecting the segment
+    # start offsets, and a read spanning segments costs one positional read
+    # per segment it touches.
+    def __init__(self, drive, block_size=512):
+        if isinstance(drive, (list, tuple)):
+            self.paths = list(drive)
+        else:
+            self.paths = find_segments(drive)
+        self.path = self.paths[0]
+        self.block_size = block_size
+        self.lock = threading.Lock()
+
+        self.starts = [0]
+        for path in self.paths:
+            self.starts.append(self.starts[-1] + os.stat(path).st_size)
+        self.fds = [None] * len(self.paths)
+
+    def get_block_size(self):
+        return self.block_size
+
+    def get_size(self):
+        return self.starts[-1]
+
+    def factory(self):
+        return functools.partial(SplitDrive, self.paths, self.block_size)
+
+    def close(self):
+        with self.lock:
+            for i, fd in enumerate(self.fds):
+                if fd is not None:
+                    os.close(fd)
+                    self.fds[i] = None
+
+    def _fd(self, i):
+        fd = self.fds[i]
+        if fd is None:
+            with self.lock:
+                fd = self.fds[i]
+                if fd is None:
+                    fd = os.open(self.paths[i], os.O_RDONLY | getattr(os, "O_BINARY", 0))
+                    self.fds[i] = fd
+
+        return fd
+
+    def _preadinto(self, fd, view, offset):
+        if hasattr(os, "preadv"):
+            return os.preadv(fd, [view], offset)
+
+        if hasattr(os, "pread"):
+            data = os.pread(fd, len(view), offset)
+        else:
+            with self.lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                data = os.read(fd, len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def _readinto(self, offset, view):
+        size = min(len(view), max(0, self.starts[-1] - offset))
+        i = bisect.bisect_right(self.starts, offset) - 1
+        done = 0
+
+        while done < size:
+            inner = offset + done - self.starts[i]
+            want = min(size - done, self.starts[i + 1] - self.starts[i] - inner)
+            n = self._preadinto(self._fd(i), view[done:done + want], inner)
+            done += n
+            if n < want:
+                break
+            i += 1
+
+        return done
+
+    def readinto(self, sector, buf):
+        return self._readinto(sector * self.block_size, memoryview(buf).cast('B'))
+
+    def read(self, sector, count=1):
+        offset = sector * self.block_size
+        buf = bytearray(max(0, min(count * self.block_size, self.starts[-1] - offset)))
+        n = self._readinto(offset, memoryview(buf))
+        return buf if n == len(buf) else buf[:n]
+
+    def pread(self, sector, count=1):
+        return self.read(sector, count)
+
+    def read_many(self, requests, gap=DEFAULT_MERGE_GAP):
+        return read_many(self, requests, gap)
@@ -0,0 +1,327 @@
+import os
+import struct
+import sys
+import pytest
+
+# ftools modules import their siblings by bare name (they also run as scripts).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ftools"))
+
+
+# A volume in memory for BlockFile tests; block i is filled with byte i.
+class MemoryVFS(object):
+    def __init__(self, block_size, blocks):
+        self.block_size = block_size
+        self.data = b"".join(bytes([i]) * block_size for i in range(blocks))
+
+    def get_block_size(self):
+        return self.block_size
+
+    def read(self, block, count=1):
+        return self.data[block * self.block_size:(block + count) * self.block_size]
+
+    def readinto(self, block, buf):
+        data = self.read(block, len(buf) // self.block_size)
+        buf[:len(data)] = data
+        return len(data)
+
+
+@pytest.fixture
+def memory_vfs():
+    return MemoryVFS
+
+
+def make_resident_data(content, type_id=0x80, name=""):
+    # The content follows the (UTF-16) name, 8 byte aligned.
+    start = (24 + 2 * len(name) + 7) // 8 * 8
+    length = start + (len(content) + 7) // 8 * 8
+    attr = bytearray(length)
+    struct.pack_into("<IIBBHHHIH", attr, 0, type_id, length, 0, len(name), 24, 0, 0,
+                     len(content), start)
+    attr[24:24 + 2 * len(name)] = name.encode("utf-16-le")
+    attr[start:start + len(content)] = content
+    return bytes(attr)
+
+
+def make_nonresident_data(runs, size, cluster_size, type_id=0x80, name=""):
+    runlist = b""
+    prev = 0
+    for lcn, count in runs:
+        delta = (lcn - prev).to_bytes(2, "little", signed=True)
+        runlist += bytes([0x21]) + bytes([count]) + delta
+        prev = lcn
+    runlist += b"\x00"
+    start = (64 + 2 * len(name) + 7) // 8 * 8
+    length = start + (len(runlist) + 7) // 8 * 8
+    clusters = sum(count for _, count in runs)
+    attr = bytearray(length)
+    struct.pack_into("<IIBBHHH", attr, 0, type_id, length, 1, len(name), 64, 0, 0)
+    struct.pack_into("<QQHH", attr, 16, 0, clusters - 1, start, 0)
+    struct.pack_into("<QQQ", attr, 40, clusters * cluster_size, size, size)
+    attr[64:64 + 2 * len(name)] = name.encode("utf-16-le")
+    attr[start:start + len(runlist)] = runlist
+    return bytes(attr)
+
+
+def set_fixups(record, usa, strides):
+    # Moves the last two bytes of every 512 byte stride to the update
+    # sequence array at usa and puts the sequence number in their place.
+    record[usa:usa + 2] = b"\xab\xcd"
+    for i in range(strides):
+        tail = 512 * (i + 1) - 2
+        record[usa + 2 + 2 * i:usa + 4 + 2 * i] = record[tail:tail + 2]
+        record[tail:tail + 2] = b"\xab\xcd"
+
+
+def make_mft_record(size=1024, data=None, attrs=(), flags=1):
+    # FILE record (in use by default) with an update sequence array at 48
+    # and attrs (plus a resident $DATA holding data); the last two bytes of
+    # every 512 byte stride are moved to the array and replaced by the
+    # sequence number.
+    if data is not None:
+        attrs = list(attrs) + [make_resident_data(data)]
+    strides = size // 512
+    first_attr = (48 + 2 * (strides + 1) + 7) // 8 * 8
+    record = bytearray(size)
+    struct.pack_into("<4sHH", record, 0, b"FILE", 48, strides + 1)
+    struct.pack_into("<HH", record, 20, first_attr, flags)
+    end = first_attr
+    for attr in attrs:
+        record[end:end + len(attr)] = attr
+        end += len(attr)
+    struct.pack_into("<I", record, end, 0xFFFFFFFF)
+    if not attrs:
+        for i in range(strides):
+            struct.pack_into("<H", record, 512 * (i + 1) - 2, 0x1100 + i)
+    set_fixups(record, 48, strides)
+    return record
+
+
+def make_index_entry(ref, name=None, subnode=None):
+    # An $I30 entry for name (the last entry of its node when None),
+    # pointing at the child node at VCN subnode.
+    content = b""
+    if name is not None:
+        content = struct.pack("<Q48xI4xBB", 5, 0, len(name), 1) + name.encode("utf-16-le")
+    length = 16 + (len(content) + 7) // 8 * 8 + (8 if subnode is not None else 0)
+    flags = (1 if subnode is not None else 0) | (2 if name is None else 0)
+    entry = bytearray(length)
+    struct.pack_into("<QHHI", entry, 0, ref, length, len(content), flags)
+    entry[16:16 + len(content)] = content
+    if subnode is not None:
+        struct.pack_into("<Q", entry, length - 8, subnode)
+    return bytes(entry)
+
+
+def make_index_node(*entries, **kwargs):
+    # Node header and entries; the entries start entries_offset bytes after
+    # the header.
+    entries_offset = kwargs.get("entries_offset", 16)
+    body = bytes(entries_offset - 16) + b"".join(entries)
+    return struct.pack("<IIIB3x", entries_offset, 16 + len(body), 16 + len(body), 1) + body
+
+
+def make_index_root(*entries):
+    # Resident $INDEX_ROOT of an $I30 index of 1 KiB INDX records.
+    root = struct.pack("<IIIB3x", 0x30, 1, 1024, 1) + make_index_node(*entries)
+    return make_resident_data(root, 0x90, "$I30")
+
+
+def make_indx_record(vcn, *entries, **kwargs):
+    # INDX record (1 KiB by default) with its update sequence array at 40
+    # and the node header at 24.
+    size = kwargs.get("size", 1024)
+    strides = size // 512
+    record = bytearray(size)
+    struct.pack_into("<4sHHQQ", record, 0, b"INDX", 40, strides + 1, 0, vcn)
+    node = make_index_node(*entries, entries_offset=40)
+    record[24:24 + len(node)] = node
+    set_fixups(record, 40, strides)
+    return record
+
+
+NTFS_MFT_RUNS = [(20, 4), (10, 3), (40, 5)]
+# The two INDX records of the root directory's $I30 index, VCN 0 and 1.
+NTFS_INDEX_RUNS = [(52, 1), (48, 1)]
+
+
+def make_ntfs_root():
+    # Root directory record: "Mid" (7) in $INDEX_ROOT, the names below it in
+    # the INDX record at VCN 0 and those above in the one at VCN 1. The name
+    # of "document-04.txt" (4) crosses the end of the first 512 byte stride.
+    root = make_mft_record(attrs=[
+        make_index_root(make_index_entry(7, "Mid", subnode=0), make_index_entry(0, subnode=1)),
+        make_nonresident_data(NTFS_INDEX_RUNS, 2048, 1024, 0xA0, "$I30")], flags=3)
+    below = [make_index_entry(n, "document-%02d.txt" % n) for n in range(1, 5)]
+    above = [make_index_entry(8, "System32"), make_index_entry(9, "zeta")]
+    nodes = [make_indx_record(0, *(below + [make_index_entry(0)])),
+             make_indx_record(1, *(above + [make_index_entry(0)]))]
+    return root, nodes
+
+
+def make_ntfs_image(path, index=False):
+    # 1 KiB clusters holding one record each; $MFT (11 records, the last
+    # extent cut short by its size) spread over NTFS_MFT_RUNS. Record 5 is
+    # the root directory of make_ntfs_root() with index, zeroed otherwise.
+    image = bytearray(64 * 1024)
+    boot = bytearray(512)
+    boot[3:11] = b"NTFS    "
+    struct.pack_into("<HB", boot, 11, 512, 2)
+    struct.pack_into("<QQ", boot, 40, 127, NTFS_MFT_RUNS[0][0])
+    boot[64] = 0xF6
+    boot[510:512] = b"\x55\xaa"
+    image[0:512] = boot
+
+    clusters = [lcn + i for lcn, count in NTFS_MFT_RUNS for i in range(count)]
+    records = [make_mft_record(attrs=[make_nonresident_data(NTFS_MFT_RUNS, 11 * 1024, 1024)])]
+    records += [make_mft_record(data=bytes([n]) * 100) for n in range(1, 12)]
+    records[5] = bytearray(1024)
+    used = [0] + clusters
+    if index:
+        records[5], nodes = make_ntfs_root()
+        for node, (lcn, _) in zip(nodes, NTFS_INDEX_RUNS):
+            image[lcn * 1024:(lcn + 1) * 1024] = node
+            used.append(lcn)
+    # Resident $Bitmap: the boot cluster, $MFT and the INDX records in use.
+    bitmap = bytearray(8)
+    for lcn in used:
+        bitmap[lcn // 8] |= 1 << (lcn % 8)
+    records[6] = make_mft_record(data=bytes(bitmap))
+    for record, lcn in zip(records, clusters):
+        image[lcn * 1024:(lcn + 1) * 1024] = record
+    path.write_bytes(bytes(image))
+    return str(path)
+
+
+def make_fat32_entries(name, attr, cluster, size, number):
+    # A long name entry (for anything but "." and "..") and the 8.3 entry.
+    if name in (".", ".."):
+        short = name.encode().ljust(11)
+    else:
+        ext = name.rpartition(".")[2] if "." in name else ""
+        short = ("F%06d" % number).encode().ljust(8) + ext.upper().encode()[:3].ljust(3)
+    entries = b""
+    if name not in (".", ".."):
+        checksum = 0
+        for c in short:
+            checksum = (((checksum & 1) << 7) + (checksum >> 1) + c) & 0xFF
+        raw = name.encode("utf-16-le") + b"\x00\x00"
+        parts = [raw[i:i + 26] for i in range(0, len(raw), 26)]
+        for i in reversed(range(len(parts))):
+            part = parts[i].ljust(26, b"\xff")
+            order = (i + 1) | (0x40 if i == len(parts) - 1 else 0)
+            entries += (bytes([order]) + part[0:10] + bytes([0x0F, 0, checksum]) +
+                        part[10:22] + b"\x00\x00" + part[22:26])
+    return entries + short + bytes([attr, 0, 0]) + struct.pack(
+        "<HHHHHHHI", 0, 0x5021, 0x5021, cluster >> 16, 0, 0x5021, cluster & 0xFFFF, size)
+
+
+def make_fat32_image(path, tree, clusters=200, rsc=32):
+    # FAT32 volume of 512 byte clusters (the root directory at cluster 2)
+    # holding tree: bytes are files, dicts directories, and an int is a
+    # directory entry pointing at that cluster. Files named frag* get every
+    # other cluster.
+    fat = [0x0FFFFFF8, 0x0FFFFFFF] + [0] * clusters
+    data = {}
+    state = {"next": 2, "number": 0}
+
+    def alloc(n, step=1):
+        chain = list(range(state["next"], state["next"] + n * step, step))
+        state["next"] += n * step
+        for a, b in zip(chain, chain[1:]):
+            fat[a] = b
+        fat[chain[-1]] = 0x0FFFFFFF
+        return chain
+
+    def write(chain, payload):
+        for i, cluster in enumerate(chain):
+            data[cluster] = payload[i * 512:(i + 1) * 512]
+
+    def add_dir(tree, cluster, parent):
+        entries = b""
+        if parent is not None:
+            entries += make_fat32_entries(".", 0x10, cluster, 0, 0)
+            entries += make_fat32_entries("..", 0x10, parent, 0, 0)
+        for name, value in tree.items():
+            state["number"] += 1
+            if isinstance(value, int):
+                entries += make_fat32_entries(name, 0x10, value, 0, state["number"])
+            elif isinstance(value, dict):
+                sub = alloc(1)[0]
+                entries += make_fat32_entries(name, 0x10, sub, 0, state["number"])
+                add_dir(value, sub, cluster)
+            else:
+                chain = alloc(max(1, -(-len(value) // 512)), 2 if name.startswith("frag") else 1)
+                write(chain, value)
+                entries += make_fat32_entries(name, 0x20, chain[0], len(value), state["number"])
+        chain = [cluster]
+        extra = -(-(len(entries) + 32) // 512) - 1
+        if extra:
+            chain += alloc(extra)
+            fat[cluster] = chain[1]
+        write(chain, entries)
+
+    add_dir(tree, alloc(1)[0], None)
+
+    fat_size = -(-len(fat) * 4 // 512)
+    total = rsc + 2 * fat_size + clusters
+    image = bytearray(total * 512)
+    boot = bytearray(512)
+    boot[0:3] = b"\xebX\x90"
+    struct.pack_into("<HBHB", boot, 11, 512, 1, rsc, 2)
+    struct.pack_into("<III", boot, 32, total, fat_size, 0)
+    struct.pack_into("<I", boot, 44, 2)
+    boot[82:90] = b"FAT32   "
+    boot[510:512] = b"\x55\xaa"
+    image[0:512] = boot
+    table = struct.pack("<%dI" % len(fat), *fat)
+    for i in range(2):
+        offset = (rsc + i * fat_size) * 512
+        image[offset:offset + len(table)] = table
+    first_data = rsc + 2 * fat_size
+    for cluster, payload in data.items():
+        offset = (first_data + cluster - 2) * 512
+        image[offset:offset + len(payload)] = payload
+    path.write_bytes(bytes(image))
+    return str(path)
+
+
+FAT32_TREE = {
+    "readme.txt": b"hello world\n",
+    "frag.dat": b"ABCDEFGH" * 300,
+    "Docs": {
+        "Report.PDF": b"%PDF-1.4 report %%EOF",
+        "sub": {"deep.jpg": b"\xff\xd8\xff\xe0" + b"j" * 700 + b"\xff\xd9",
+                # Points back at the root directory.
+                "up": 2},
+    },
+}
+
+
+@pytest.fixture
+def mft_record():
+    return make_mft_record
+
+
+@pytest.fixture
+def ntfs_image(tmp_path):
+    return make_ntfs_image(tmp_path / "ntfs.img")
+
+
+@pytest.fixture
+def ntfs_index_image(tmp_path):
+    return make_ntfs_image(tmp_path / "ntfs.img", index=True)
+
+
+@pytest.fixture
+def index_entry():
+    return make_index_entry
+
+
+@pytest.fixture
+def index_node():
+    return make_index_node
+
+
+@pytest.fixture
+def fat32_image(tmp_path):
+    return make_fat32_image(tmp_path / "fat32.img", FAT32_TREE)
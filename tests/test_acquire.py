@@ -0,0 +1,34 @@
+import hashlib
+import pytest
+from ftools.vdrive import Drive
+from ftools.acquire import Acquisition
+
+
+class FailingDrive(Drive):
+    def __init__(self, path, bad):
+        super(FailingDrive, self).__init__(path)
+        self.bad = bad
+
+    def read(self, sector, count=1):
+        if sector <= self.bad < sector + count:
+            raise OSError(5, "Input/output error")
+        return super(FailingDrive, self).read(sector, count)
+
+
+def test_acquisition_split_output_and_bad_sectors(tmp_path):
+    data = b"".join(bytes([i]) * 512 for i in range(20)) + b"tail"
+    source = tmp_path / "source.img"
+    source.write_bytes(data)
+    output = str(tmp_path / "image")
+
+    acquisition = Acquisition(FailingDrive(str(source), 9), output,
+                              read_size=2048, segment_size=3000, retries=1)
+    summary = acquisition.run()
+
+    expected = data[:9 * 512] + bytes(512) + data[10 * 512:]
+    assert summary["bad_sectors"] == [9]
+    assert summary["md5"] == hashlib.md5(expected).hexdigest()
+    assert summary["sha256"] == hashlib.sha256(expected).hexdigest()
+    assert summary["segments"] == [output + ".%03d" % i for i in range(1, 5)]
+    assert b"".join(open(p, "rb").read() for p in summary["segments"]) == expected
+    assert "bad sector: 9" in open(output + ".log").read()
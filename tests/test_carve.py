@@ -0,0 +1,28 @@
+import pytest
+from ftools.vdrive import Drive
+from ftools.carve import Carver, batch_extents
+
+
+def test_carver_matches_across_chunks(tmp_path):
+    data = bytearray(16 * 512)
+    jpg = b"\xff\xd8\xff\xe0" + b"A" * 1500 + b"\xff\xd9"
+    # Header cut by the first chunk boundary, footer by a later one.
+    data[1022:1022 + len(jpg)] = jpg
+    data[5000:5005] = b"%PDF-"
+    path = tmp_path / "free.img"
+    path.write_bytes(bytes(data))
+
+    carver = Carver(Drive(str(path)), chunk_size=1024)
+
+    assert list(carver.carve([(0, 16)])) == [(1022, 'jpg', len(jpg)),
+                                             (5000, 'pdf', 16 * 512 - 5000)]
+    # A piece of a longer extent only reports headers inside it, but reads
+    # on to find their footer.
+    assert list(carver.carve([(0, 2, 16)])) == [(1022, 'jpg', len(jpg))]
+    assert list(carver.carve([(2, 14, 16)])) == [(5000, 'pdf', 16 * 512 - 5000)]
+
+
+def test_batch_extents():
+    batches = batch_extents([(0, 3), (10, 6)], 512, 4 * 512)
+
+    assert batches == [[(0, 3, 3), (10, 1, 16)], [(11, 4, 16)], [(15, 1, 16)]]
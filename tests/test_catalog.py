@@ -0,0 +1,72 @@
+import pytest
+import struct
+from ftools.catalog import Catalog, from_fat_datetime
+
+
+def test_catalog_is_keyed_by_fingerprint(tmp_path):
+    mbr = bytearray(512)
+    mbr[446:462] = bytes([0, 0, 0, 0, 0x83, 0, 0, 0]) + struct.pack('<II', 1, 7)
+    mbr[510:512] = b"\x55\xaa"
+    image = tmp_path / "disk.img"
+    image.write_bytes(bytes(mbr) + bytes(7 * 512))
+    db = str(tmp_path / "catalog.db")
+
+    catalog = Catalog(db, str(image))
+    assert not catalog.is_built()
+    assert catalog.build()
+    assert not catalog.build()
+    assert catalog.partitions() == [{'part': 0, 'scheme': 'mbr', 'lba': 1, 'size': 7,
+                                     'type': '131', 'fs': None}]
+    catalog.close()
+
+    data = bytearray(image.read_bytes())
+    data[-1] = 1
+    image.write_bytes(bytes(data))
+    catalog = Catalog(db, str(image))
+
+    assert not catalog.is_built()
+    assert catalog.build()
+    # The entry of the old contents was dropped.
+    assert catalog.db.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 1
+
+
+def test_from_fat_datetime():
+    assert from_fat_datetime((40 << 9) | (2 << 5) | 29, (13 << 11) | (5 << 5) | 7) == \
+        "2020-02-29T13:05:14"
+    assert from_fat_datetime(0) is None
+
+
+def test_catalog_queries_fat32(tmp_path, fat32_image):
+    catalog = Catalog(str(tmp_path / "catalog.db"), fat32_image)
+    assert catalog.build()
+    assert catalog.partitions()[0]['fs'] == 'FAT32'
+
+    assert [f["name"] for f in catalog.list_dir("/")] == ["Docs", "frag.dat", "readme.txt"]
+    assert [f["path"] for f in catalog.list_dir("docs/SUB")] == ["/Docs/sub/deep.jpg",
+                                                                 "/Docs/sub/up"]
+    readme = catalog.resolve("\\README.TXT")
+    assert (readme["size"], readme["is_dir"]) == (12, 0)
+    with pytest.raises(Exception):
+        catalog.resolve("/nope")
+
+    assert [f["path"] for f in catalog.find(ext=".pdf")] == ["/Docs/Report.PDF"]
+    assert [f["path"] for f in catalog.find(name="*.JP?")] == ["/Docs/sub/deep.jpg"]
+    assert [f["path"] for f in catalog.find(name="report.pdf")] == ["/Docs/Report.PDF"]
+
+    # frag.dat has every other cluster of the data area (sector 36 on).
+    assert catalog.extents(catalog.resolve("/frag.dat")) == [(38, 1), (40, 1), (42, 1),
+                                                             (44, 1), (46, 1)]
+    assert catalog.extents(catalog.resolve("/Docs")) == [(48, 1)]
+
+
+def test_catalog_closes_only_its_own_drive(tmp_path, fat32_image):
+    from ftools.vdrive import Drive
+
+    db = str(tmp_path / "catalog.db")
+    catalog = Catalog(db, fat32_image)
+    catalog.close()
+    assert catalog.drive.drive.closed
+
+    drive = Drive(fat32_image)
+    Catalog(db, drive).close()
+    assert not drive.drive.closed
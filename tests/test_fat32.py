@@ -0,0 +1,89 @@
+import pytest
+import struct
+from ftools.fat32 import FATTable
+
+
+def make_table(entries):
+    return FATTable(struct.pack("<%dI" % len(entries), *entries), len(entries) - 2)
+
+
+def test_fat_table_chains():
+    # 2 -> 3 -> 5 (EOC 0x0FFFFFF8), 4 free, 6 -> 7 -> 6 (loop), 8 free
+    table = make_table([0x0FFFFFF8, 0x0FFFFFFF, 3, 5, 0, 0x0FFFFFF8, 7, 6, 0])
+
+    assert table.chain(2) == [2, 3, 5]
+    assert table.chain(6) == [6, 7]
+    assert table.is_loop(6)
+    assert not table.is_loop(2)
+    assert table.free_count() == 2
+    assert table.free_extends() == [(4, 1), (8, 1)]
+    assert table.chains() == {2: [2, 3, 5]}
+
+
+def directory_entry(name, ext, attr, cluster, size):
+    return (name + ext + bytes([attr, 0, 0]) +
+            struct.pack("<HHHHHHHI", 0, 0x5021, 0x5021, cluster >> 16, 0, 0x5021,
+                        cluster & 0xFFFF, size))
+
+
+def lfn_entry(order, name):
+    raw = name.encode("utf-16-le") + b"\x00\x00"
+    raw = raw.ljust(26, b"\xff")
+    return bytes([order]) + raw[0:10] + bytes([0x0F, 0, 0]) + raw[10:22] + b"\x00\x00" + raw[22:26]
+
+
+def test_parse_list_filters_on_raw_fields():
+    from ftools.fat32 import FAT32, DirectoryFilter
+
+    data = (lfn_entry(0x41, "photo.jpeg") +
+            directory_entry(b"PHOTO~1 ", b"JPE", 0x20, 3, 5000) +
+            directory_entry(b"\xe5EMOVED ", b"TXT", 0x20, 4, 10) +
+            directory_entry(b"DIR     ", b"   ", 0x10, 5, 0) +
+            bytes(32) +
+            directory_entry(b"AFTER   ", b"TXT", 0x20, 6, 10))
+
+    fat32 = FAT32.__new__(FAT32)
+
+    names = [e["name"] for e in fat32.parse_list(data)]
+    assert len(names) == 3
+    assert names[0] == "photo.jpeg"
+    assert names[2] == "DIR     "
+
+    files = fat32.parse_list(data, DirectoryFilter(exclude_attr=0x10), deleted=False)
+    assert [(e["name"], e["sname"], e["cluster"]) for e in files] == [("photo.jpeg", "PHOTO~1 ", 3)]
+
+    assert fat32.parse_list(data, DirectoryFilter(ext=["jpeg"]))[0]["size"] == 5000
+    assert fat32.parse_list(data, DirectoryFilter(ext=["jpg"])) == []
+    # Without a long name the 8.3 extension must match in full.
+    short = directory_entry(b"PHOTO   ", b"JPE", 0x20, 3, 5000)
+    assert fat32.parse_list(short, DirectoryFilter(ext=["jpeg"])) == []
+    assert fat32.parse_list(short, DirectoryFilter(ext=["JPE"]))[0]["cluster"] == 3
+    assert fat32.parse_list(data, DirectoryFilter(min_size=6000)) == []
+
+
+def test_walk_lookup_and_open(fat32_image):
+    from ftools.vdrive import Drive
+    from ftools.fat32 import FAT32
+
+    fat32 = FAT32(Drive(fat32_image))
+    paths = [entry["path"] for entry in fat32.walk()]
+
+    assert paths == ["/readme.txt", "/frag.dat", "/Docs", "/Docs/Report.PDF", "/Docs/sub",
+                     "/Docs/sub/deep.jpg", "/Docs/sub/up"]
+    # "." and ".." are skipped, and /Docs/sub/up (back to the root) is
+    # listed but not entered again.
+    assert not any(p.endswith("/.") or p.endswith("/..") for p in paths)
+    assert sorted(e["path"] for e in fat32.walk(workers=4)) == sorted(paths)
+
+    assert fat32.lookup("\\docs\\SUB\\Deep.JPG")["size"] == 706
+    with pytest.raises(Exception):
+        fat32.lookup("/readme.txt/x")
+    assert fat32.open("/Docs/Report.PDF").read_at(0, 100) == b"%PDF-1.4 report %%EOF"
+    # Every other cluster.
+    assert fat32.open("/frag.dat").read_at(0, 3000) == b"ABCDEFGH" * 300
+
+    index = fat32.build_index(workers=2)
+    assert sorted(index) == sorted(p.lower() for p in paths)
+    assert fat32.lookup("/DOCS/report.pdf") is index["/docs/report.pdf"]
+    with pytest.raises(Exception):
+        fat32.lookup("/missing")
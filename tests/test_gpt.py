@@ -0,0 +1,79 @@
+import struct
+import uuid
+import zlib
+import pytest
+from ftools.vdrive import Drive
+from ftools.GPTFinder import GPTFinder
+
+BASIC_DATA = uuid.UUID("ebd0a0a2-b9e5-4433-87c0-68b6b726c4a7")
+
+
+def gpt_image(path, sector_size=512, sectors=128, slots=None):
+    # Primary and backup GPT with 128 entries; slots: {index: (first, last, name)}.
+    entries = bytearray(128 * 128)
+    for index, (first, last, name) in (slots or {}).items():
+        struct.pack_into("<16s16sQQQ72s", entries, index * 128, BASIC_DATA.bytes_le,
+                         uuid.uuid4().bytes_le, first, last, 0, name.encode("utf-16-le"))
+    array_sectors = len(entries) // sector_size
+
+    disk = bytearray(sector_size * sectors)
+    last = sectors - 1
+    for lba, alternate, start in ((1, last, 2), (last, 1, last - array_sectors)):
+        header = bytearray(92)
+        struct.pack_into("<8sIIIIQQQQ16sQIII", header, 0, b"EFI PART", 0x10000, 92, 0, 0,
+                         lba, alternate, 2 + array_sectors, last - array_sectors - 1,
+                         uuid.uuid4().bytes_le, start, 128, 128, zlib.crc32(entries))
+        struct.pack_into("<I", header, 16, zlib.crc32(header))
+        disk[lba * sector_size:lba * sector_size + 92] = header
+        disk[start * sector_size:start * sector_size + len(entries)] = entries
+
+    path.write_bytes(bytes(disk))
+    return disk
+
+
+def test_gpt_sparse_and_backup(tmp_path):
+    path = tmp_path / "gpt.img"
+    disk = gpt_image(path, slots={0: (40, 49, "first"), 5: (50, 89, "second")})
+
+    finder = GPTFinder(Drive(str(path)))
+    first, second = finder.parse()
+    assert (first.index, first.lba, first.size, first.name) == (0, 40, 10, "first")
+    assert (second.index, second.lba, second.size) == (5, 50, 40)
+    assert first.type_uuid() == BASIC_DATA
+    assert not finder.backup
+
+    # Corrupt entry array of the primary: the backup is used.
+    disk[2 * 512] ^= 0xFF
+    path.write_bytes(bytes(disk))
+    finder = GPTFinder(Drive(str(path)))
+    assert [entry.lba for entry in finder.parse()] == [40, 50]
+    assert finder.backup and finder.header['gpt_lba'] == 127
+
+    disk[127 * 512] = 0
+    path.write_bytes(bytes(disk))
+    with pytest.raises(Exception):
+        GPTFinder(Drive(str(path))).parse()
+
+
+def test_gpt_4kn(tmp_path):
+    path = tmp_path / "gpt4k.img"
+    gpt_image(path, sector_size=4096, sectors=32, slots={3: (10, 19, "data")})
+
+    finder = GPTFinder(Drive(str(path)))
+    entry, = finder.parse()
+    assert (finder.sector_size, entry.index, entry.lba, entry.size) == (4096, 3, 10, 10)
+
+
+def test_open_partitions_4kn(tmp_path):
+    from ftools.vpartition import open_partitions
+
+    path = tmp_path / "gpt4k.img"
+    disk = gpt_image(path, sector_size=4096, sectors=32, slots={0: (10, 19, "data")})
+    disk[446:462] = bytes([0, 0, 0, 0, 0xEE, 0, 0, 0]) + struct.pack("<II", 1, 31)
+    disk[510:512] = b"\x55\xaa"
+    disk[10 * 4096:11 * 4096] = b"\x5a" * 4096
+    path.write_bytes(bytes(disk))
+
+    partition, = open_partitions(str(path))
+    assert (partition['lba'], partition['size']) == (80, 80)
+    assert partition['drive'].read(0) == b"\x5a" * 512
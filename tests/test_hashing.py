@@ -0,0 +1,42 @@
+import hashlib
+import io
+import json
+import pytest
+from ftools.vfile import BlockFile, MemoryFile
+from ftools.hashing import VolumeHasher, write_jsonl
+
+
+def test_volume_hasher_matches_hashlib(memory_vfs):
+    vfs = memory_vfs(4, 16)
+    files = [("/frag", BlockFile(vfs, 18, [(10, 2), (None, 1), (3, 2)])),
+             ("/small", BlockFile(vfs, 5, [(1, 2)])),
+             ("/resident", MemoryFile(b"hello")),
+             ("/empty", BlockFile(vfs, 0, []))]
+    hasher = VolumeHasher(vfs, algorithms=("md5", "sha256"), chunk_size=4, memory_limit=8)
+    chunks = []
+    inflight = []
+    acquire = hasher._acquire
+
+    def tracked(size):
+        acquire(size)
+        chunks.append(size)
+        inflight.append(hasher.inflight)
+    hasher._acquire = tracked
+
+    out = io.StringIO()
+    write_jsonl(hasher.run(files), out)
+    rows = dict((row["path"], row) for row in map(json.loads, out.getvalue().splitlines()))
+
+    assert len(rows) == 4
+    for path, f in files:
+        data = bytes(f.read_at(0, f.filesize))
+        assert rows[path]["size"] == len(data)
+        assert rows[path]["md5"] == hashlib.md5(data).hexdigest()
+        assert rows[path]["sha256"] == hashlib.sha256(data).hexdigest()
+    assert hasher.stats()["files"] == 4
+    # Resident data first, then extents by physical position (/small at
+    # block 1 before /frag at block 10) in chunks of one 4 byte block; at
+    # most memory_limit bytes wait for the hash threads.
+    assert chunks == [5, 4, 1, 4, 4, 4, 4, 2]
+    assert hasher.stats()["bytes_read"] == 24
+    assert max(inflight) <= 8
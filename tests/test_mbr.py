@@ -12,3 +12,24 @@ def test_table_entry():
     assert table.active == 0x80
     assert table.lba == 0
     assert table.size == 1024
+
+
+def test_open_partitions_views(tmp_path):
+    from ftools.vpartition import open_partitions
+
+    mbr = bytearray(512)
+    mbr[446:462] = bytes([0, 0, 0, 0, 0x83, 0, 0, 0]) + struct.pack('<II', 4, 2)
+    mbr[462:478] = bytes([0, 0, 0, 0, 0x83, 0, 0, 0]) + struct.pack('<II', 6, 3)
+    mbr[510:512] = b"\x55\xaa"
+    path = tmp_path / "disk.img"
+    path.write_bytes(bytes(mbr) + b"".join(bytes([i]) * 512 for i in range(1, 9)))
+
+    first, second = open_partitions(str(path))
+
+    assert (first['scheme'], first['lba'], first['size'], first['vfs']) == ('mbr', 4, 2, None)
+    assert first['drive'].read(0) == bytes([4]) * 512
+    # Reads are clipped to the partition.
+    assert second['drive'].read(2, 5) == bytes([8]) * 512
+    with pytest.raises(Exception):
+        first['drive'].read(3)
+    assert first['drive'].parent is second['drive'].parent
@@ -0,0 +1,159 @@
+import pytest
+import struct
+from collections import OrderedDict
+from ftools.ntfs import NTFS, RunList
+from ftools.vfile import MemoryFile
+
+
+def test_parse_runlists_signed_and_sparse():
+    # 4 clusters at LCN 0x100, 2 clusters at 0x100 - 0x10, 3 sparse clusters,
+    # 1 cluster at 0xF0 + 0x20
+    data = bytes([0x21, 0x04, 0x00, 0x01,
+                  0x11, 0x02, 0xF0,
+                  0x01, 0x03,
+                  0x11, 0x01, 0x20,
+                  0x00])
+
+    runlists = NTFS.__new__(NTFS).parse_runlists(data, 0)
+
+    assert list(runlists) == [(0x100, 4), (0xF0, 2), (None, 3), (0x110, 1)]
+    assert list(runlists.vcns) == [0, 4, 6, 9, 10]
+    assert runlists.cluster_count() == 10
+    assert runlists.find(5) == 1
+    assert runlists.find(9) == 3
+    assert runlists == RunList([(0x100, 4), (0xF0, 2), (None, 3), (0x110, 1)])
+
+
+def test_index_descent_by_collation(index_entry, index_node):
+    ntfs = NTFS.__new__(NTFS)
+    ntfs.upcase = None
+    ntfs.index_nodes = OrderedDict()
+    parse = ntfs._parse_index_node
+    # Decoded nodes come from the cache, so no image is needed.
+    ntfs.index_nodes[(5, None)] = (parse(index_node(index_entry(30, "Mid", subnode=0),
+                                                    index_entry(0, subnode=1)), 0), None, 4096)
+    ntfs.index_nodes[(5, 0)] = parse(index_node(index_entry(31, "apple"), index_entry(0)), 0)
+    ntfs.index_nodes[(5, 1)] = parse(index_node(index_entry(32, "System32"),
+                                                index_entry(33, "zeta"), index_entry(0)), 0)
+
+    assert ntfs.find_index_entry(5, "SYSTEM32")["ref"] == 32
+    assert ntfs.find_index_entry(5, "Apple")["ref"] == 31
+    assert ntfs.find_index_entry(5, "mid")["ref"] == 30
+    assert ntfs.find_index_entry(5, "nope") is None
+    assert [e["value"]["name"] for e in ntfs.iter_index(5)] == ["apple", "Mid", "System32", "zeta"]
+
+
+def test_fixup_4k_record(mft_record):
+    ntfs = NTFS.__new__(NTFS)
+    ntfs.bps = 4096
+    ntfs.mftsize = 4096
+    data = mft_record(4096) + mft_record(4096)
+
+    assert ntfs.apply_fixup(data, 4096)
+    assert len(data) == 8192
+    assert [bytes(data[4096 + 512 * i - 2:4096 + 512 * i]) for i in range(1, 9)] == \
+        [struct.pack("<H", 0x1100 + i) for i in range(8)]
+    # The first record is left alone.
+    assert data[510:512] == b"\xab\xcd"
+
+
+def test_fixup_rejects_corrupt_count(mft_record):
+    ntfs = NTFS.__new__(NTFS)
+    ntfs.bps = 512
+    ntfs.mftsize = 1024
+    data = mft_record() + mft_record()
+    struct.pack_into("<H", data, 6, 60000)
+    before = bytes(data)
+
+    assert not ntfs.apply_fixup(data, 0)
+    assert bytes(data) == before
+    assert ntfs.apply_fixup(data, 1024)
+
+
+def test_scan_mft_chunks_and_fixups(mft_record):
+    records = [mft_record(data=bytes([n]) * 600) for n in range(7)]
+    records[3] = bytearray(1024)
+    records[5][1022] ^= 0xFF
+    ntfs = NTFS.__new__(NTFS)
+    ntfs.bps = 512
+    ntfs.mftsize = 1024
+    ntfs.mft_file = MemoryFile(b"".join(records))
+    ntfs.record_count = 7
+
+    for chunk_size in (1024, 3072, 1 << 20):
+        scanned = list(ntfs.scan_mft(chunk_size=chunk_size))
+        assert [r["number"] for r in scanned] == [0, 1, 2, 4, 5, 6]
+        assert [r["valid"] for r in scanned] == [True, True, True, True, False, True]
+        # The $DATA content crosses the end of the first stride.
+        assert scanned[1]["data"]["value"] == bytes([1]) * 600
+
+    assert [r["number"] for r in ntfs.scan_mft(start=2, count=3, chunk_size=2048)] == [2, 4]
+    assert ntfs.read_record(6)["data"]["value"] == bytes([6]) * 600
+    assert ntfs.read_record(3) is None
+
+
+def test_mft_shards_follow_fragments(ntfs_image):
+    from ftools.vdrive import Drive
+
+    ntfs = NTFS(Drive(ntfs_image))
+
+    assert ntfs.record_count == 11
+    assert ntfs.mft_shards(2) == [(0, 2), (2, 2), (4, 2), (6, 1), (7, 2), (9, 2)]
+    # Small neighbouring extents are merged up to the shard size.
+    assert ntfs.mft_shards(8) == [(0, 7), (7, 4)]
+
+
+def test_scan_mft_parallel_matches_serial(ntfs_image):
+    from ftools.vdrive import Drive
+
+    ntfs = NTFS(Drive(ntfs_image))
+
+    def summary(records):
+        return [(r["number"], r["valid"], r["data"].get("value")) for r in records]
+
+    serial = summary(ntfs.scan_mft())
+    assert [number for number, _, _ in serial] == [0, 1, 2, 3, 4, 6, 7, 8, 9, 10]
+    assert serial[-1][2] == bytes([10]) * 100
+    assert summary(ntfs.scan_mft_parallel(workers=2, shard_records=2)) == serial
+
+
+def test_free_extends_and_carve_resident_bitmap(ntfs_image):
+    from ftools.vdrive import Drive
+    from ftools.carve import carve
+
+    jpg = b"\xff\xd8\xff\xe0" + b"J" * 3000 + b"\xff\xd9"
+    with open(ntfs_image, "r+b") as f:
+        f.seek(50 * 1024)
+        f.write(jpg)
+        # Inside $MFT (cluster 41): allocated, never carved.
+        f.seek(41 * 1024 + 200)
+        f.write(jpg)
+
+    ntfs = NTFS(Drive(ntfs_image))
+
+    # 63 clusters; 0 and the $MFT runs (20-23, 10-12, 40-44) in use.
+    assert ntfs.free_extends() == [(1, 9), (13, 7), (24, 16), (45, 18)]
+    assert list(carve(ntfs, chunk_size=4096)) == [(50 * 1024, 'jpg', len(jpg))]
+
+
+def test_lookup_through_index_allocation(ntfs_index_image):
+    from ftools.vdrive import Drive
+
+    ntfs = NTFS(Drive(ntfs_index_image))
+
+    entries, allocation, record_size = ntfs.read_index_root(5)
+    assert [(e["ref"], e["subnode"]) for e in entries] == [(7, 0), (0, 1)]
+    assert record_size == 1024 and list(allocation.extends) == [(52, 1), (48, 1)]
+
+    # VCN 1 lives in the second run, one cluster before VCN 0.
+    assert [e["value"]["name"] for e in ntfs.read_index_node(5, 1)[:-1]] == ["System32", "zeta"]
+    assert ntfs.lookup("/zeta")["data"]["value"] == bytes([9]) * 100
+    assert ntfs.lookup("\\SYSTEM32")["number"] == 8
+    assert ntfs.lookup("/mid")["number"] == 7
+    # Only right once the fixup is put back at the end of the first stride.
+    assert ntfs.lookup("/Document-04.TXT")["data"]["value"] == bytes([4]) * 100
+    assert [e["value"]["name"] for e in ntfs.list_dir("/")] == [
+        "document-01.txt", "document-02.txt", "document-03.txt", "document-04.txt",
+        "Mid", "System32", "zeta"]
+    with pytest.raises(Exception):
+        ntfs.lookup("/nope")
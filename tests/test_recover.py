@@ -0,0 +1,35 @@
+import struct
+from ftools.recover import PartitionScanner, to_mbr_entry
+
+
+def fat32_boot(total_sectors):
+    boot = bytearray(512)
+    boot[0:3] = b"\xeb\x58\x90"
+    struct.pack_into("<HBH", boot, 11, 512, 1, 8)
+    struct.pack_into("<I", boot, 32, total_sectors)
+    boot[82:90] = b"FAT32   "
+    boot[510:512] = b"\x55\xaa"
+    return bytes(boot)
+
+
+def test_scan_finds_volume_from_backup(tmp_path):
+    sectors = bytearray(512 * 96)
+    boot = fat32_boot(64)
+    for lba in (16, 40):
+        # Primary at lba, backup at lba + 6, FAT at lba + 8.
+        sectors[(lba + 6) * 512:(lba + 7) * 512] = boot
+        sectors[(lba + 8) * 512:(lba + 8) * 512 + 8] = b"\xf8\xff\xff\x0f\xff\xff\xff\x0f"
+    sectors[16 * 512:17 * 512] = boot
+    # Not sector aligned: ignored.
+    sectors[70 * 512 + 100:70 * 512 + 612] = boot
+    path = tmp_path / "disk.img"
+    path.write_bytes(bytes(sectors))
+
+    scanner = PartitionScanner(str(path), chunk_size=1024, range_size=8192)
+    first, second = scanner.scan()
+
+    assert (first["lba"], first["found"], first["verified"]) == (16, "primary", True)
+    assert (second["lba"], second["found"], second["verified"]) == (40, "backup", False)
+    assert second["size"] == 64
+    assert to_mbr_entry(second)[4] == 0x0C
+    assert struct.unpack_from("<II", to_mbr_entry(second), 8) == (40, 64)
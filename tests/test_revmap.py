@@ -0,0 +1,37 @@
+import pytest
+from ftools.vdrive import Drive
+from ftools.fat32 import FAT32
+from ftools.revmap import ReverseMap, build
+
+
+def test_reverse_map_queries_and_roundtrip(tmp_path):
+    rmap = ReverseMap()
+    rmap.add_file("/a", [(100, 8), (200, 8)])
+    assert rmap.owner(104) == "/a"
+    # Added after a query; overlaps /a.
+    rmap.add_file("/b", [(90, 4), (204, 2)])
+
+    assert rmap.owner(95) is None
+    assert rmap.owner(205) == "/b"
+    assert rmap.find_range(92, 20) == [(90, 4, "/b"), (100, 8, "/a")]
+    assert rmap.find(205) == [(200, 8, "/a"), (204, 2, "/b")]
+
+    path = str(tmp_path / "disk.rmap")
+    rmap.save(path)
+    loaded = ReverseMap.load(path)
+
+    assert loaded.attribute([91, 107, 108, 207]) == ["/b", "/a", None, "/a"]
+
+
+def test_reverse_map_build_fat32(fat32_image):
+    fat32 = FAT32(Drive(fat32_image))
+    rmap = build(fat32)
+
+    assert rmap.owner(fat32.to_sector(3)) == "/readme.txt"
+    # frag.dat takes every other cluster from 4 to 12.
+    assert rmap.attribute([fat32.to_sector(c) for c in (4, 5, 12, 13)]) == [
+        "/frag.dat", None, "/frag.dat", None]
+    assert rmap.owner(fat32.to_sector(15)) == "/Docs/Report.PDF"
+    assert rmap.owner(fat32.to_sector(17)) == "/Docs/sub/deep.jpg"
+    # The root directory is also reached through "up".
+    assert sorted(f for _, _, f in rmap.find(fat32.to_sector(2))) == ["/", "/Docs/sub/up"]
@@ -0,0 +1,49 @@
+import pytest
+import struct
+from ftools.schema import Schema
+from ftools.utils import Utils
+
+
+def test_schema_to_map_flat():
+    desc = Schema()
+    desc.add("a", 0, 2)
+    desc.add("b", 2, 4)
+    desc.add("name", 6, 3, dtype="str")
+
+    data = struct.pack("<HI", 7, 1024) + b"abc"
+    m = Utils.schema_to_map(desc, data, endian=Utils.LITTLE_ENDIAN)
+
+    assert m == {"a": 7, "b": 1024, "name": b"abc"}
+    assert desc.compile() is desc.compile()
+
+
+def test_schema_to_map_base_offset_and_big_endian():
+    desc = Schema()
+    desc.add("a", 0, 2)
+
+    data = b"\x00\x00" + struct.pack(">H", 0x1234)
+    m = Utils.schema_to_map(desc, data, endian=Utils.BIG_ENDIAN, base_offset=2)
+
+    assert m == {"a": 0x1234}
+
+
+def test_schema_to_map_nested_repeated_and_len_func():
+    sub = Schema()
+    sub.add("x", 0, 1)
+    sub.add("y", 1, 1, transform=lambda v: v * 2)
+
+    desc = Schema()
+    desc.add("len", 0, 1)
+    desc.add("body", 1, "len", dtype="str", len_func=lambda v: v * 2)
+    desc.add("item", 8, 0, dtype="schema", schema=sub)
+    desc.add("item", 10, 0, dtype="schema", schema=sub)
+    desc.add("item", 12, 0, dtype="schema", schema=sub)
+    desc.add("whole", 8, 2)
+
+    data = bytes([2]) + b"abcd" + b"\x00" * 3 + bytes([1, 2, 3, 4, 5, 6])
+    m = Utils.schema_to_map(desc, data, endian=Utils.LITTLE_ENDIAN)
+
+    assert m["len"] == 2
+    assert m["body"] == b"abcd"
+    assert m["item"] == [{"x": 1, "y": 4}, {"x": 3, "y": 8}, {"x": 5, "y": 12}]
+    assert m["whole"] == 0x0201
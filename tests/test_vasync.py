@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ftools.vdrive import Drive
+from ftools.fat32 import FAT32
+from ftools.ntfs import NTFS
+from ftools.vasync import AsyncDrive, AsyncFAT32, AsyncNTFS
+
+
+class SlowDrive(object):
+    # Sector i is filled with byte i; counts the reads running at once.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def get_block_size(self):
+        return 512
+
+    def pread(self, sector, count=1):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        return bytes([sector]) * 512 * count
+
+
+def test_async_drive_backpressure():
+    drive = SlowDrive()
+
+    async def main():
+        adrive = AsyncDrive(drive, max_inflight=2, executor=ThreadPoolExecutor(8))
+        return await adrive.read_many([(i, 1) for i in range(8)])
+
+    assert asyncio.run(main()) == [bytes([i]) * 512 for i in range(8)]
+    assert drive.peak == 2
+
+
+def test_async_fat32_walk(fat32_image):
+    fat32 = FAT32(Drive(fat32_image))
+
+    async def main():
+        afat32 = AsyncFAT32(fat32, AsyncDrive(Drive(fat32_image), max_inflight=2))
+        return [entry["path"] async for entry in afat32.walk()]
+
+    paths = asyncio.run(main())
+    assert sorted(paths) == sorted(entry["path"] for entry in fat32.walk())
+    assert "/Docs/sub/deep.jpg" in paths and paths.count("/Docs/sub/up") == 1
+
+
+def test_async_ntfs_scan_mft(ntfs_image):
+    ntfs = NTFS(Drive(ntfs_image))
+    serial = [(r["number"], r["valid"], r["data"].get("value")) for r in ntfs.scan_mft()]
+
+    def unsafe(sector, buf):
+        raise Exception("seek and read with reads in flight")
+    # Only positional reads are safe with several reads in flight.
+    ntfs.drive.readinto = unsafe
+    ntfs.drive.read = unsafe
+
+    async def main():
+        antfs = AsyncNTFS(ntfs, AsyncDrive(ntfs.drive, executor=ThreadPoolExecutor(4)))
+        return [(r["number"], r["valid"], r["data"].get("value"))
+                async for r in antfs.scan_mft(chunk_size=3072, prefetch=2)]
+
+    assert asyncio.run(main()) == serial
+
+
+def test_async_fat32_concurrent_list_shares_drive(fat32_image):
+    drive = Drive(fat32_image)
+    fat32 = FAT32(drive)
+    reads = []
+    pread = drive.pread
+
+    def counted(sector, count=1):
+        reads.append((sector, count))
+        return pread(sector, count)
+
+    def unsafe(*args):
+        raise Exception("seek and read with reads in flight")
+    drive.pread = counted
+    drive.read = drive.readinto = unsafe
+
+    async def names(afat32, cluster):
+        return [afat32.fat32.entry_name(entry) async for entry in afat32.list(cluster, deleted=False)]
+
+    async def main():
+        afat32 = AsyncFAT32(fat32, AsyncDrive(drive, executor=ThreadPoolExecutor(4)))
+        return await asyncio.gather(*[names(afat32, cluster) for cluster in (2, 14, 16, 2)])
+
+    root, docs, sub, again = asyncio.run(main())
+    assert root == again == ["readme.txt", "frag.dat", "Docs"]
+    assert docs == [".", "..", "Report.PDF", "sub"]
+    assert sub == [".", "..", "deep.jpg", "up"]
+    # The FAT (sectors 32-33) was read once.
+    assert reads.count((fat32.rsc, fat32.fat_size)) == 1
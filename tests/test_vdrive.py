@@ -0,0 +1,133 @@
+import pytest
+from ftools.vdrive import Drive, MmapDrive
+
+
+def make_image(tmp_path, sectors=16):
+    path = tmp_path / "disk.img"
+    path.write_bytes(b"".join(bytes([i]) * 512 for i in range(sectors)))
+    return str(path)
+
+
+def test_mmap_drive_returns_views(tmp_path):
+    path = make_image(tmp_path)
+    drive = MmapDrive(path)
+
+    data = drive.read(3, 2)
+
+    assert isinstance(data, memoryview)
+    assert data == Drive(path).read(3, 2)
+    assert drive.get_size() == 16 * 512
+
+    # A view still held does not keep the drive from closing, and stays
+    # readable until it goes.
+    drive.close()
+    assert data == bytes([3]) * 512 + bytes([4]) * 512
+
+
+class CountingDrive(Drive):
+    def __init__(self, path):
+        super(CountingDrive, self).__init__(path)
+        self.calls = []
+
+    def read(self, sector, count=1):
+        self.calls.append((sector, count))
+        return super(CountingDrive, self).read(sector, count)
+
+
+def test_cached_drive_hits_and_readahead(tmp_path):
+    from ftools.vcache import CachedDrive
+
+    path = make_image(tmp_path, sectors=64)
+    raw = CountingDrive(path)
+    drive = CachedDrive(raw, page_sectors=2, max_readahead=8)
+
+    assert drive.read(5, 3) == Drive(path).read(5, 3)
+    assert drive.read(5) == bytes([5]) * 512
+    assert drive.stats()['hits'] == 1
+
+    for sector in range(8, 40, 2):
+        assert drive.read(sector, 2) == Drive(path).read(sector, 2)
+
+    # sequential reads are served by a handful of growing read-ahead reads
+    assert len(raw.calls) < 8
+    assert drive.read(63, 4) == bytes([63]) * 512
+
+
+def test_cached_drive_capacity(tmp_path):
+    from ftools.vcache import CachedDrive
+
+    path = make_image(tmp_path, sectors=64)
+    drive = CachedDrive(Drive(path), capacity=4 * 512, page_sectors=1)
+
+    for sector in range(0, 64, 3):
+        drive.read(sector)
+
+    assert drive.stats()['cached_bytes'] <= 4 * 512
+
+
+def test_partition_drive_stats(tmp_path):
+    from ftools.vcache import CachedDrive
+    from ftools.vpartition import PartitionDrive
+
+    path = make_image(tmp_path, sectors=64)
+    assert PartitionDrive(Drive(path), 8, 16).stats() == {}
+
+    cached = CachedDrive(Drive(path), page_sectors=1)
+    partition = PartitionDrive(cached, 8, 16)
+    assert partition.read(2) == bytes([10]) * 512
+    assert partition.read(2) == bytes([10]) * 512
+    assert partition.stats() == cached.stats() and partition.stats()['hits'] == 1
+
+
+def test_read_many_merges_and_keeps_order(tmp_path):
+    path = make_image(tmp_path, sectors=64)
+    drive = CountingDrive(path)
+
+    requests = [(40, 2), (3, 1), (5, 2), (60, 1), (4, 1)]
+    results = drive.read_many(requests, gap=2)
+
+    assert results == [Drive(path).read(s, c) for s, c in requests]
+    assert drive.calls == [(3, 4), (40, 2), (60, 1)]
+
+
+def test_pread_drive_shared_between_threads(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from ftools.vdrive import PreadDrive
+
+    path = make_image(tmp_path, sectors=64)
+    drive = PreadDrive(path, pool_size=2)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda s: drive.read(s, 2), range(63)))
+
+    assert results == [Drive(path).read(s, 2) for s in range(63)]
+
+    buf = bytearray(3 * 512)
+    assert drive.readinto(62, buf) == 2 * 512
+    assert buf[:1024] == bytes([62]) * 512 + bytes([63]) * 512
+    drive.close()
+
+
+def test_split_drive_reads_across_segments(tmp_path):
+    from ftools.vsplit import SplitDrive
+
+    whole = make_image(tmp_path, sectors=10)
+    with open(whole, "rb") as f:
+        data = f.read()
+    # Uneven segments, one boundary in the middle of a sector.
+    for i, (start, end) in enumerate([(0, 1024), (1024, 2900), (2900, len(data))]):
+        (tmp_path / ("split.%03d" % (i + 1))).write_bytes(data[start:end])
+
+    drive = SplitDrive(str(tmp_path / "split.001"))
+
+    assert len(drive.paths) == 3
+    assert drive.get_size() == len(data)
+    assert drive.fds == [None, None, None]
+    assert drive.read(1, 5) == data[512:3072]
+    assert drive.read(9, 4) == data[9 * 512:]
+    assert drive.read_many([(5, 1), (0, 2)]) == [data[2560:3072], data[:1024]]
+
+    buf = bytearray(1024)
+    assert drive.readinto(5, buf) == 1024
+    assert buf == data[2560:3584]
+    drive.close()
@@ -0,0 +1,37 @@
+import pytest
+from ftools.vfile import BlockFile
+
+
+def test_block_file_byte_reads(memory_vfs):
+    vfs = memory_vfs(4, 16)
+    bfile = BlockFile(vfs, 18, [(10, 2), (None, 1), (3, 2)])
+
+    assert bfile.read_at(0, 100) == b"\x0a" * 4 + b"\x0b" * 4 + b"\x00" * 4 + b"\x03" * 4 + b"\x04" * 2
+    assert bfile.read_at(6, 4) == b"\x0b\x0b\x00\x00"
+    assert bfile.read_at(17, 4) == b"\x04"
+    assert bfile.read_at(18, 4) == b""
+    assert bfile.read(1, 2) == b"\x0b" * 4 + b"\x00" * 4
+    assert bfile.bget(1, 3) == [(11, 1), (None, 1), (3, 1)]
+
+    buf = bytearray(5)
+    assert bfile.readinto_at(3, buf) == 5
+    assert buf == b"\x0a\x0b\x0b\x0b\x0b"
+
+
+def test_block_file_stream(memory_vfs):
+    import io
+    import hashlib
+
+    vfs = memory_vfs(4, 16)
+    bfile = BlockFile(vfs, 18, [(10, 2), (None, 1), (3, 2)])
+    expected = bfile.read_at(0, 18)
+
+    stream = bfile.open()
+    assert stream.read(3) == expected[:3]
+    assert stream.tell() == 3
+    stream.seek(-4, io.SEEK_END)
+    assert stream.read() == expected[-4:]
+    stream.seek(0)
+    assert hashlib.sha256(io.BufferedReader(stream).read()).digest() == hashlib.sha256(expected).digest()
+
+    assert b"".join(bfile.iter_chunks(5)) == expected
@@ -0,0 +1,52 @@
+import pytest
+import gzip
+import os
+import random
+from ftools.vgzip import GzipDrive
+
+
+def test_gzip_drive_random_reads(tmp_path):
+    rnd = random.Random(7)
+    raw = bytes(rnd.randrange(16) for _ in range(256 * 1024)) + bytes(256 * 1024)
+
+    path = str(tmp_path / "disk.img.gz")
+    with open(path, "wb") as f:
+        # two members, as written by pigz --independent or bgzip
+        f.write(gzip.compress(raw[:300000]))
+        f.write(gzip.compress(raw[300000:]))
+
+    drive = GzipDrive(path, block=16384, span=65536, cache_size=32768)
+    assert drive.get_size() == len(raw)
+    assert os.path.exists(path + ".idx")
+
+    for _ in range(50):
+        sector = rnd.randrange(len(raw) // 512)
+        count = rnd.randrange(1, 64)
+        assert drive.read(sector, count) == raw[sector * 512:(sector + count) * 512]
+
+    reopened = GzipDrive(path, block=16384, span=65536)
+    assert [p[:2] for p in reopened.points] == [(0, 0), (300000, reopened.points[1][1])]
+    assert reopened.read(700, 20) == raw[700 * 512:720 * 512]
+
+
+def test_gzip_drive_reopen_single_member(tmp_path):
+    rnd = random.Random(11)
+    raw = bytes(rnd.randrange(16) for _ in range(512 * 1024))
+
+    path = str(tmp_path / "single.img.gz")
+    with open(path, "wb") as f:
+        f.write(gzip.compress(raw))
+
+    built = GzipDrive(path, block=16384, span=65536)
+    assert len(built.points) == len(raw) // 65536
+
+    # Only the member start comes back from the index; the in-member points
+    # are taken again by the first read that passes them.
+    reopened = GzipDrive(path, block=16384, span=65536)
+    assert reopened.get_size() == len(raw)
+    assert [p[:2] for p in reopened.points] == [(0, 0)]
+    assert reopened.read(900, 8) == raw[900 * 512:908 * 512]
+    assert [p[0] for p in reopened.points] == [0, 65536, 131072, 196608, 262144, 327680, 393216, 458752]
+
+    reopened.cache.clear()
+    assert reopened.read(300, 4) == raw[300 * 512:304 * 512]